@@ -17,6 +17,8 @@ except ImportError:
 from nbt.region import RegionFile
 from nbt.chunk import Chunk
 from nbt.world import AnvilWorldFolder,UnknownWorldFormat
+from nbt.nbt import PARSER_LAZY
+from nbt.analysis import map_reduce, Counter, MAP_NBT
 
 BIOMES = {
     0 : "Ocean",
@@ -85,9 +87,15 @@ BIOMES = {
 }
 
 
+def biomes_per_chunk(chunk):
+    """Given the NBT of a chunk, return the biome ID of each column"""
+    return chunk["Level"]["Biomes"]
+
+
 def print_results(biome_totals):
     locale.setlocale(locale.LC_ALL, '')
-    for id,count in enumerate(biome_totals):
+    for id in range(256):
+        count = biome_totals[id]
         # Biome ID 255 is ignored. It means it is not calculated by Minecraft yet
         if id == 255 or (count == 0 and id not in BIOMES):
             continue
@@ -99,22 +107,17 @@ def print_results(biome_totals):
 
 
 def main(world_folder):
-    world = AnvilWorldFolder(world_folder)  # Not supported for McRegion
+    # Only the biomes are read, so only decode the compounds that are accessed
+    world = AnvilWorldFolder(world_folder, parser=PARSER_LAZY)  # Not supported for McRegion
     if not world.nonempty():  # likely still a McRegion file
         sys.stderr.write("World folder %r is empty or not an Anvil formatted world\n" % world_folder)
         return 65  # EX_DATAERR
-    biome_totals = [0]*256 # 256 counters for 256 biome IDs
-    
-    try:
-        for chunk in world.iter_nbt():
-            for biomeid in chunk["Level"]["Biomes"]:
-                biome_totals[biomeid] += 1
+    # Count the biomes of each region file in a separate process
+    biome_totals = map_reduce(world, biomes_per_chunk, Counter(), level=MAP_NBT)
 
-    except KeyboardInterrupt:
-        print_results(biome_totals)
-        return 75 # EX_TEMPFAIL
-    
     print_results(biome_totals)
+    if not biome_totals.complete:
+        return 75 # EX_TEMPFAIL
     return 0 # NOERR
 
 
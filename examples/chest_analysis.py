@@ -14,6 +14,7 @@ except ImportError:
         raise
     sys.path.append(extrasearchpath)
 from nbt.world import WorldFolder
+from nbt.nbt import PARSER_LAZY
 
 class Position(object):
     def __init__(self, x,y,z):
@@ -72,7 +73,8 @@ def print_results(chests):
 
 
 def main(world_folder):
-    world = WorldFolder(world_folder)
+    # Only the (tile) entities are read, so only decode the compounds that are accessed
+    world = WorldFolder(world_folder, parser=PARSER_LAZY)
     
     try:
         for chunk in world.iter_nbt():
@@ -294,6 +294,14 @@ def print_errors(filename, warnings=True):
     for error in errors:
         print(error)
 
+def compact_regionfile(filename):
+    region = RegionFile(filename)
+    try:
+        reclaimed = region.compact()
+    finally:
+        region.close()
+    print("%s: compacted, %d bytes reclaimed" % (filename, reclaimed))
+
 
 
 if __name__ == '__main__':
@@ -302,6 +310,9 @@ if __name__ == '__main__':
                     action="store_true", help="Show detailed info about region file")
     parser.add_option("-q", "--quiet", dest="warnings", default=True,
                     action="store_false", help="Only show errors, no warnings")
+    parser.add_option("-c", "--compact", dest="compact", default=False,
+                    action="store_true", help="Remove unused sectors from the region file. " \
+                    "Chunks that can not be read are removed as well.")
 
     (options, args) = parser.parse_args()
     if (len(args) == 0):
@@ -314,6 +325,8 @@ if __name__ == '__main__':
                 debug_regionfile(filename, options.warnings)
             else:
                 print_errors(filename, options.warnings)
+            if options.compact:
+                compact_regionfile(filename)
         except IOError as e:
             sys.stderr.write("%s: %s\n" % (e.filename, e.strerror))
             # sys.exit(72) # EX_IOERR
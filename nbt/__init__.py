@@ -1,4 +1,4 @@
-__all__ = ["nbt", "world", "region", "chunk"]
+__all__ = ["nbt", "world", "region", "chunk", "analysis"]
 from . import *
 
 # Documentation only automatically includes functions specified in __all__.
@@ -0,0 +1,190 @@
+"""
+Analyse a world with map-reduce: a mapper function is called for each
+chunk, and its results are added to an accumulator. Each region file is
+handled by a worker process with its own accumulator, and the accumulators
+are merged in the calling process.
+
+For example, to count the biomes in a world::
+
+    def biomes(nbt):
+        return nbt["Level"]["Biomes"]
+
+    counts = map_reduce(WorldFolder(path), biomes, Counter(), level=MAP_NBT)
+
+The mapper is pickled, so it must be a function defined at module level.
+"""
+
+from functools import partial
+import collections
+import heapq
+from .world import _iter_nbt
+
+MAP_REGION = 'region'
+"""Constant to call the mapper with each :class:`nbt.region.RegionFile`."""
+MAP_NBT = 'nbt'
+"""Constant to call the mapper with the :class:`nbt.nbt.NBTFile` of each chunk."""
+MAP_CHUNK = 'chunk'
+"""Constant to call the mapper with each chunk, as instance of the
+chunkclass of the world folder (e.g. :class:`nbt.chunk.AnvilChunk`)."""
+
+
+class Accumulator(object):
+    """
+    Abstract class of a mergeable accumulator.
+
+    Subclasses implement new(), add() and merge(). Accumulators are pickled
+    to pass them between processes.
+    """
+    complete = True
+    """False if the map-reduce was interrupted, and only contains the
+    results of part of the world."""
+
+    def new(self):
+        """Return a new, empty accumulator with the same settings."""
+        raise NotImplementedError()
+
+    def add(self, value):
+        """Add a single value."""
+        raise NotImplementedError()
+
+    def update(self, values):
+        """Add each of the values."""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Add all values of another accumulator of the same type."""
+        raise NotImplementedError()
+
+
+class Counter(collections.Counter, Accumulator):
+    """
+    Accumulator that counts values, comparable to a collections.Counter.
+    update() accepts an iterable of values, or a mapping of value to count.
+    """
+    def new(self):
+        return self.__class__()
+
+    def add(self, value):
+        self[value] += 1
+
+    def merge(self, other):
+        collections.Counter.update(self, other)
+
+
+class Histogram(Accumulator):
+    """
+    Accumulator that counts numbers in bins of the given size.
+    A number n is counted in the bin starting at
+    origin + binsize * floor((n - origin) / binsize).
+    """
+    def __init__(self, binsize=1, origin=0):
+        self.binsize = binsize
+        self.origin = origin
+        self.bins = {}
+        """Count of numbers for each bin, by bin index."""
+
+    def new(self):
+        return self.__class__(self.binsize, self.origin)
+
+    def add(self, value):
+        index = int((value - self.origin) // self.binsize)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other):
+        if (other.binsize, other.origin) != (self.binsize, self.origin):
+            raise ValueError("Can not merge histograms with different bins")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def total(self):
+        """Return the count of all numbers."""
+        return sum(self.bins.values())
+
+    def result(self):
+        """Return a sorted list of (bin start, count) tuples."""
+        return [(self.origin + self.binsize * index, count) \
+                for index, count in sorted(self.bins.items())]
+
+
+class TopK(Accumulator):
+    """
+    Accumulator that keeps the k largest values. If key is given, it is
+    called to get the value to compare, like the key argument of sorted().
+    The key must be a function defined at module level to be pickled.
+    """
+    def __init__(self, k, key=None):
+        self.k = k
+        self.key = key
+        self.items = []
+        """The k largest values, largest first."""
+
+    def new(self):
+        return self.__class__(self.k, self.key)
+
+    def add(self, value):
+        self.update([value])
+
+    def update(self, values):
+        self.items = heapq.nlargest(self.k, self.items + list(values), key=self.key)
+
+    def merge(self, other):
+        self.update(other.items)
+
+    def result(self):
+        """Return the k largest values, largest first."""
+        return self.items
+
+
+def _map_region(mapper, accumulator, level, boundingbox, regionfile):
+    """Call mapper for the region file, or for each chunk in the region
+    file, and return a new accumulator with the results."""
+    accumulator = accumulator.new()
+    if level == MAP_REGION:
+        values = [mapper(regionfile)]
+    elif level == MAP_NBT:
+        values = (mapper(nbt) for nbt in _iter_nbt(regionfile, boundingbox))
+    else:
+        values = (mapper(regionfile.chunkclass(nbt)) for nbt in _iter_nbt(regionfile, boundingbox))
+    for value in values:
+        if value is not None:
+            accumulator.update(value)
+    return accumulator
+
+
+def map_reduce(world, mapper, accumulator, level=MAP_CHUNK, workers=None, \
+               chunksize=1, progress=None, boundingbox=None):
+    """
+    Call mapper for each chunk in the world folder, and add the returned
+    values to accumulator with accumulator.update(). The mapper returns an
+    iterable of values, or None to skip the chunk.
+
+    level determines what the mapper is called with: MAP_CHUNK (default),
+    MAP_NBT or MAP_REGION.
+    workers and chunksize are passed to
+    :meth:`nbt.world._BaseWorldFolder.call_for_each_region`. If workers
+    is 0, all work is done in the current process.
+    If progress is given, it is called as progress(done, total) after
+    each region file, with the number of region files done and in total.
+    If a boundingbox (in chunk coordinates) is given, only the chunks
+    inside it, or the region files overlapping it, are passed to mapper.
+
+    Return the accumulator. If interrupted with a KeyboardInterrupt, the
+    accumulator contains the results of the region files done so far, and
+    its complete attribute is False.
+    """
+    total = len(world._region_coords(boundingbox))
+    results = world.call_for_each_region(partial(_map_region, mapper, accumulator, level, boundingbox), \
+            boundingbox=boundingbox, workers=workers, chunksize=chunksize, ordered=False)
+    done = 0
+    try:
+        for result in results:
+            accumulator.merge(result)
+            done += 1
+            if progress is not None:
+                progress(done, total)
+    except KeyboardInterrupt:
+        accumulator.complete = False
+    finally:
+        results.close()
+    return accumulator
@@ -7,8 +7,15 @@ https://minecraft.gamepedia.com/Chunk_format
 
 from io import BytesIO
 from struct import pack
+from collections import OrderedDict
 import array
+import sys
 import nbt
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional, and only required for AnvilChunk.blocks_ndarray()
+    numpy = None
 
 
 # Legacy numeric block identifiers
@@ -95,6 +102,90 @@ def block_id_to_name(bid):
     return name
 
 
+# Packed block states
+# Since MC 1.13, each section stores the palette index of its 4096 blocks
+# in an array of longs, with a variable number of bits per block.
+# Before MC 1.16 (data version 2529) an index may span two longs.
+
+_LONG_MASK = (1 << 64) - 1
+_LOW_NIBBLES = bytes(bytearray(i & 15 for i in range(256)))
+_HIGH_NIBBLES = bytes(bytearray(i >> 4 for i in range(256)))
+
+def _little_endian_bytes(states):
+    """Return the longs in states as little-endian bytes."""
+    if isinstance(states, array.array) and states.itemsize == 8:
+        if sys.byteorder == 'little':
+            return states.tostring() if sys.version_info < (3,) else states.tobytes()
+        states = list(states)
+    return pack("<%dq" % len(states), *states)
+
+def _unpack_block_states_numpy(states, bits, spanning):
+    if isinstance(states, array.array) and states.itemsize == 8:
+        words = numpy.frombuffer(states, dtype=numpy.uint64)
+    else:
+        words = numpy.array(states, dtype=numpy.int64).view(numpy.uint64)
+    mask = numpy.uint64((1 << bits) - 1)
+    if not spanning:
+        shifts = numpy.arange(0, 64 - bits + 1, bits, dtype=numpy.uint64)
+        indexes = (words[:, None] >> shifts) & mask
+        return indexes.ravel()[:4096].tolist()
+    offsets = numpy.arange(4096, dtype=numpy.uint64) * numpy.uint64(bits)
+    j = (offsets >> numpy.uint64(6)).astype(numpy.intp)
+    shifts = offsets & numpy.uint64(63)
+    words = numpy.append(words, numpy.uint64(0))
+    # Shift the next long in two steps, as a shift by 64 is undefined.
+    high = (words[j + 1] << (numpy.uint64(63) - shifts)) << numpy.uint64(1)
+    return (((words[j] >> shifts) | high) & mask).tolist()
+
+def unpack_block_states(states, bits, spanning=True):
+    """
+    Return a list of the 4096 palette indexes packed in states, a sequence
+    of signed longs with the given number of bits per block.
+    If spanning is True, an index may span two longs (before MC 1.16).
+    Otherwise, the high bits of each long are unused if they can not hold a
+    whole index. Uses NumPy if available.
+    """
+    per_long = 64 // bits
+    if spanning:
+        length = (4096 * bits + 63) // 64
+    else:
+        length = (4096 + per_long - 1) // per_long
+    if len(states) != length:
+        raise ValueError("Expected %d longs for %d bits per block, got %d" % \
+                (length, bits, len(states)))
+    if 64 % bits == 0:
+        # Both layouts are the same
+        spanning = False
+    if bits == 4:
+        # The most common case: one index per nibble
+        data = _little_endian_bytes(states)
+        indexes = bytearray(4096)
+        indexes[0::2] = data.translate(_LOW_NIBBLES)
+        indexes[1::2] = data.translate(_HIGH_NIBBLES)
+        return list(indexes)
+    if bits == 8:
+        return list(bytearray(_little_endian_bytes(states)))
+    if numpy is not None:
+        return _unpack_block_states_numpy(states, bits, spanning)
+    mask = (1 << bits) - 1
+    if not spanning:
+        shifts = range(0, per_long * bits, bits)
+        indexes = [(word >> shift) & mask for word in states for shift in shifts]
+        del indexes[4096:]
+        return indexes
+    # Join each group of bits longs, which holds exactly 64 indexes, into
+    # a single integer, and unpack it like a long of the 1.16 layout.
+    words = [word & _LONG_MASK for word in states]
+    groups = []
+    for start in range(0, len(words), bits):
+        group = 0
+        for word in reversed(words[start:start + bits]):
+            group = (group << 64) | word
+        groups.append(group)
+    shifts = range(0, 64 * bits, bits)
+    return [(group >> shift) & mask for group in groups for shift in shifts]
+
+
 # Generic Chunk
 
 class Chunk(object):
@@ -141,16 +232,22 @@ class AnvilSection(object):
     def __init__(self, nbt, version):
         self.names = []
         self.indexes = []
+        # Block identifiers of the palette, for legacy sections only
+        self.ids = None
 
         # Is the section flattened ?
         # See https://minecraft.gamepedia.com/1.13/Flattening
+        # Decide by content rather than data version: flattened sections
+        # exist since MC 1.13 (1519), before the 1.13.2 version (1631).
 
-        if version == 0:
+        if 'Palette' in nbt:  # MC 1.13
+            self._init_index(nbt, version)
+        elif 'Blocks' in nbt:
             self._init_array(nbt)
-        elif version == 1631:  # MC 1.13
-            self._init_index(nbt)
         else:
-            raise NotImplemented
+            # Empty sections (e.g. with only light data) have no palette
+            self.names.append('air')
+            self.indexes = [0] * 4096
 
         # Section contains 4096 blocks whatever data version
 
@@ -161,24 +258,42 @@ class AnvilSection(object):
     # Contains an array of block numeric identifiers
 
     def _init_array(self, nbt):
-        bids = []
-        for bid in nbt['Blocks'].value:
-            try:
-                i = bids.index(bid)
-            except ValueError:
-                bids.append(bid)
-                i = len(bids) - 1
-            self.indexes.append(i)
+        blocks = nbt['Blocks'].value
+        add = bytes(nbt['Add'].value) if 'Add' in nbt else b''
+        if add.strip(b'\x00'):
+            # Add holds the high 4 bits of each block identifier
+            high = bytearray(4096)
+            high[0::2] = add.translate(_LOW_NIBBLES)
+            high[1::2] = add.translate(_HIGH_NIBBLES)
+            bids = [b | h << 8 for b, h in zip(blocks, high)]
+        else:
+            bids = bytearray(blocks)
 
+        # Palette in order of first appearance, and a lookup table from
+        # block identifier to palette index
+        palette = []
+        seen = set()
         for bid in bids:
-            bname = block_id_to_name(bid)
-            self.names.append(bname)
+            if bid not in seen:
+                seen.add(bid)
+                palette.append(bid)
+        lut = bytearray(4096) if len(palette) <= 256 else [0] * 4096
+        for i, bid in enumerate(palette):
+            lut[bid] = i
+        if isinstance(bids, bytearray):
+            self.indexes = list(bids.translate(bytes(lut[:256])))
+        else:
+            self.indexes = [lut[bid] for bid in bids]
+
+        for bid in palette:
+            self.names.append(block_ids.get(bid))
+        self.ids = palette
 
 
     # Decode modern section
     # Contains palette of block names and indexes
 
-    def _init_index(self, nbt):
+    def _init_index(self, nbt, version):
 
         for p in nbt['Palette']:
             name = p['Name'].value
@@ -190,38 +305,11 @@ class AnvilSection(object):
 
         # Block states are packed into an array of longs
         # with variable number of bits per block (min: 4)
+        # Since MC 1.16, indexes no longer span two longs
 
         nb = (len(self.names) - 1).bit_length()
         if nb < 4: nb = 4
-        assert nb == len(states) * 8 * 8 / 4096
-        m = pow(2, nb) - 1
-
-        j = 0
-        bl = 64
-        ll = states[0]
-
-        for i in range(0,4096):
-            if bl == 0:
-                j = j + 1
-                ll = states[j]
-                bl = 64
-
-            if nb <= bl:
-                self.indexes.append(ll & m)
-                ll = ll >> nb
-                bl = bl - nb
-            else:
-                j = j + 1
-                lh = states[j]
-                bh = nb - bl
-
-                lh = (lh & (pow(2, bh) - 1)) << bl
-                ll = (ll & (pow(2, bl) - 1))
-                self.indexes.append(lh & ll)
-
-                ll = states[j]
-                ll = ll >> bh
-                bl = 64 - bh
+        self.indexes = unpack_block_states(states, nb, spanning=version < 2529)
 
 
     def get_block(self, x, y, z):
@@ -240,40 +328,63 @@ class AnvilSection(object):
 # Chunck in Anvil new format
 
 class AnvilChunk(Chunk):
+    """
+    Chunk in Anvil format.
 
-    def __init__(self, nbt):
+    Sections are decoded when a block of the section is accessed for the
+    first time. If cache_size is given, at most that many decoded sections
+    are kept; the least recently used section is decoded again if needed.
+    Combined with the lazy parser, inspecting a chunk is cheap if only a
+    few sections are accessed.
+    """
+
+    def __init__(self, nbt, cache_size=None):
         Chunk.__init__(self, nbt)
 
         # Started to work on this class with MC version 1.13.2
         # so with the chunk data version 1631
         # Backported to first Anvil version (= 0) from examples
-        # Could work with other versions, but has to be tested first
+        # Extended to the block states layout of MC 1.16 (version 2529)
 
         try:
-            version = nbt['DataVersion'].value
-            if version < 1631 or version > 1631:
-                raise NotImplemented
+            self.version = nbt['DataVersion'].value
         except KeyError:
-            version = 0
+            self.version = 0
 
-        # Load all sections
+        # Keep the NBT of all sections, decode on first access
 
-        self.sections = {}
+        self.cache_size = cache_size
+        self._section_nbt = OrderedDict()
+        self._section_cache = OrderedDict()
         for s in self.chunk_data['Sections']:
-            self.sections[s['Y'].value] = AnvilSection(s, version)
+            self._section_nbt[s['Y'].value] = s
+
+
+    @property
+    def sections(self):
+        """Dictionary of all sections, keyed by Y index. This decodes all
+        sections."""
+        return OrderedDict((y, self.get_section(y)) for y in self._section_nbt)
 
 
     def get_section(self, y):
         """Get a section from Y index."""
-        if y in self.sections:
-            return self.sections[y]
-
-        return None
+        try:
+            section = self._section_cache.pop(y)
+        except KeyError:
+            if y not in self._section_nbt:
+                return None
+            section = AnvilSection(self._section_nbt[y], self.version)
+        # Most recently used section goes last
+        self._section_cache[y] = section
+        if self.cache_size is not None and len(self._section_cache) > self.cache_size:
+            self._section_cache.popitem(last=False)
+        return section
 
 
     def get_max_height(self):
         ymax = 0
-        for y in self.sections.keys():
+        for y in self._section_nbt.keys():
             if y > ymax: ymax = y
         return ymax * 16 + 15
 
@@ -289,11 +400,48 @@ class AnvilChunk(Chunk):
 
 
     def iter_block(self):
-        for s in self.sections.values():
-            for b in s.iter_block():
+        for y in self._section_nbt:
+            for b in self.get_section(y).iter_block():
                 yield b
 
 
+    def blocks_ndarray(self):
+        """
+        Return a tuple (blocks, palette) with all blocks of this chunk.
+        blocks is a NumPy array of uint16 with shape (height, 16, 16),
+        indexed as blocks[y, z, x], that contains indexes into palette, the
+        list of block names. Blocks in missing sections are air. Unknown
+        block identifiers of legacy sections are in palette as their
+        (integer) identifier.
+        Requires NumPy.
+        """
+        if numpy is None:
+            raise ImportError("NumPy is required for blocks_ndarray()")
+        palette = ['air']
+        palette_index = {'air': 0}
+        blocks = numpy.zeros((self.get_max_height() + 1, 16, 16), dtype=numpy.uint16)
+        for y in self._section_nbt:
+            if y < 0:
+                continue
+            section = self.get_section(y)
+            names = section.names
+            if section.ids is not None:
+                # Unknown legacy blocks have no name; keep them apart
+                names = [bid if name is None else name
+                         for name, bid in zip(names, section.ids)]
+            # Map the section palette to the chunk palette
+            lut = []
+            for name in names:
+                if name not in palette_index:
+                    palette_index[name] = len(palette)
+                    palette.append(name)
+                lut.append(palette_index[name])
+            lut = numpy.array(lut, dtype=numpy.uint16)
+            indexes = numpy.asarray(section.indexes, dtype=numpy.uint16)
+            blocks[16 * y:16 * y + 16] = lut[indexes].reshape(16, 16, 16)
+        return blocks, palette
+
+
 class BlockArray(object):
     """Convenience class for dealing with a Block/data byte array."""
     def __init__(self, blocksBytes=None, dataBytes=None):
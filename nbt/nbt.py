@@ -5,10 +5,17 @@ For more information about the NBT format:
 https://minecraft.gamepedia.com/NBT_format
 """
 
-from struct import Struct, error as StructError
+from struct import Struct, pack, error as StructError
 from gzip import GzipFile
+from io import BytesIO
+from array import array
 from collections import MutableMapping, MutableSequence, Sequence
 import sys
+try:
+    import numpy
+except ImportError:
+    # NumPy is optional, and only required for the as_numpy() methods.
+    numpy = None
 
 _PY3 = sys.version_info >= (3,)
 if _PY3:
@@ -16,6 +23,11 @@ if _PY3:
     basestring = str
 else:
     range = xrange
+_BYTES_TYPES = (bytes, bytearray, memoryview)
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("NumPy is required for this method")
 
 TAG_END = 0
 TAG_BYTE = 1
@@ -31,6 +43,16 @@ TAG_COMPOUND = 10
 TAG_INT_ARRAY = 11
 TAG_LONG_ARRAY = 12
 
+PARSER_STREAM = 'stream'
+"""Constant to select the default parser, which reads each tag from a file
+object."""
+PARSER_FAST = 'fast'
+"""Constant to select the single-pass parser, which reads the complete
+(uncompressed) data into memory and decodes it in one pass."""
+PARSER_LAZY = 'lazy'
+"""Constant to select the lazy parser, which reads the complete (uncompressed)
+data into memory, and only decodes a TAG_Compound when it is accessed."""
+
 
 class MalformedFileError(Exception):
     """Exception raised on parse error."""
@@ -40,11 +62,26 @@ class MalformedFileError(Exception):
 class TAG(object):
     """TAG, a variable with an intrinsic name."""
     id = None
+    # True once the tag is in the name index of a TAG_Compound
+    _indexed = False
+    # Number of times an indexed tag was renamed
+    _renames = 0
 
     def __init__(self, value=None, name=None):
-        self.name = name
+        self._name = name
         self.value = value
 
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        if self._indexed:
+            # Make TAG_Compound rebuild its index on the next lookup.
+            TAG._renames += 1
+        self._name = name
+
     # Parsers and Generators
     def _parse_buffer(self, buffer):
         raise NotImplementedError(self.__class__.__name__)
@@ -213,6 +250,14 @@ class TAG_Byte_Array(TAG, MutableSequence):
         # TODO: check type of value, or is this done by self.value already?
         self.value.insert(key, value)
 
+    def as_numpy(self):
+        """
+        Return the value as a NumPy array of signed bytes, which shares
+        memory with the value. Requires NumPy.
+        """
+        _require_numpy()
+        return numpy.frombuffer(self.value, dtype=numpy.int8)
+
     # Printing and Formatting of tree
     def valuestr(self):
         return "[%i byte(s)]" % len(self.value)
@@ -224,34 +269,93 @@ class TAG_Byte_Array(TAG, MutableSequence):
         return '[' + ",".join([str(x) for x in self.value]) + ']'
 
 
-class TAG_Int_Array(TAG, MutableSequence):
+def _array_typecode(itemsize):
+    """Return the array.array typecode for signed integers of the given
+    size in bytes, or None if there is no such typecode."""
+    for typecode in ('i', 'l', 'q'):
+        try:
+            if array(typecode).itemsize == itemsize:
+                return typecode
+        except ValueError:
+            # typecode 'q' is not available in Python 2
+            pass
+    return None
+
+
+class _TAG_Numeric_Array(TAG, MutableSequence):
     """
-    TAG_Int_Array, comparable to a collections.UserList with
-    an intrinsic name whose values must be integers
+    _TAG_Numeric_Array, comparable to a collections.UserList with
+    an intrinsic name whose values must be integers.
+
+    After parsing, the value is an array.array, which is much faster to
+    parse and render than a list. It is converted to a list when it is
+    modified through the methods of this tag. The value may also be set
+    to a list of integers.
     """
-    id = TAG_INT_ARRAY
+    item_fmt = None
+    """Struct format character of a single item"""
+    typecode = None
+    """array.array typecode of a single item, or None if not available"""
 
     def __init__(self, name=None, buffer=None):
         # TODO: add a value parameter as well
-        super(TAG_Int_Array, self).__init__(name=name)
+        super(_TAG_Numeric_Array, self).__init__(name=name)
         if buffer:
             self._parse_buffer(buffer)
 
     def update_fmt(self, length):
         """ Adjust struct format description to length given """
-        self.fmt = Struct(">" + str(length) + "i")
+        self.fmt = Struct(">" + str(length) + self.item_fmt)
+
+    @classmethod
+    def _from_bytes(cls, data):
+        """Return the value for the given big-endian data."""
+        if cls.typecode:
+            value = array(cls.typecode)
+            if _PY3:
+                value.frombytes(data)
+            elif isinstance(data, memoryview):
+                value.fromstring(data.tobytes())
+            else:
+                value.fromstring(data)
+            if sys.byteorder == 'little':
+                value.byteswap()
+            return value
+        fmt = Struct(">" + cls.item_fmt)
+        return list(Struct(">%d%s" % (len(data) // fmt.size, cls.item_fmt)).unpack(data))
+
+    def _to_bytes(self):
+        """Return the value as big-endian data."""
+        if self.typecode:
+            value = self.value
+            if not isinstance(value, array) or value.typecode != self.typecode:
+                value = array(self.typecode, value)
+            elif sys.byteorder == 'little':
+                value = array(self.typecode, value)
+            if sys.byteorder == 'little':
+                value.byteswap()
+            return value.tobytes() if _PY3 else value.tostring()
+        self.update_fmt(len(self.value))
+        return self.fmt.pack(*self.value)
+
+    def _as_list(self):
+        """Convert the value to a list, and return it."""
+        if not isinstance(self.value, list):
+            self.value = list(self.value)
+        return self.value
 
     # Parsers and Generators
     def _parse_buffer(self, buffer):
         length = TAG_Int(buffer=buffer).value
-        self.update_fmt(length)
-        self.value = list(self.fmt.unpack(buffer.read(self.fmt.size)))
+        size = length * Struct(">" + self.item_fmt).size
+        data = buffer.read(size)
+        if len(data) != size:
+            raise StructError()
+        self.value = self._from_bytes(data)
 
     def _render_buffer(self, buffer):
-        length = len(self.value)
-        self.update_fmt(length)
-        TAG_Int(length)._render_buffer(buffer)
-        buffer.write(self.fmt.pack(*self.value))
+        TAG_Int(len(self.value))._render_buffer(buffer)
+        buffer.write(self._to_bytes())
 
     # Mixin methods
     def __len__(self):
@@ -267,68 +371,56 @@ class TAG_Int_Array(TAG, MutableSequence):
         return self.value[key]
 
     def __setitem__(self, key, value):
-        self.value[key] = value
+        self._as_list()[key] = value
 
     def __delitem__(self, key):
-        del (self.value[key])
+        del (self._as_list()[key])
 
     def insert(self, key, value):
-        self.value.insert(key, value)
+        self._as_list().insert(key, value)
+
+    def as_numpy(self):
+        """
+        Return the value as a NumPy array of integers in native byte order.
+        If the value is an array.array, the NumPy array shares memory with
+        it. Requires NumPy.
+        """
+        _require_numpy()
+        dtype = numpy.dtype("i%d" % Struct(">" + self.item_fmt).size)
+        if isinstance(self.value, array):
+            return numpy.frombuffer(self.value, dtype=dtype)
+        return numpy.array(self.value, dtype=dtype)
+
+    # Printing and Formatting of tree
+    def __unicode__(self):
+        return unicode(list(self.value))
+
+    def __str__(self):
+        return str(list(self.value))
+
+
+class TAG_Int_Array(_TAG_Numeric_Array):
+    """
+    TAG_Int_Array, comparable to a collections.UserList with
+    an intrinsic name whose values must be integers
+    """
+    id = TAG_INT_ARRAY
+    item_fmt = "i"
+    typecode = _array_typecode(4)
 
     # Printing and Formatting of tree
     def valuestr(self):
         return "[%i int(s)]" % len(self.value)
 
 
-class TAG_Long_Array(TAG, MutableSequence):
+class TAG_Long_Array(_TAG_Numeric_Array):
     """
     TAG_Long_Array, comparable to a collections.UserList with
     an intrinsic name whose values must be integers
     """
     id = TAG_LONG_ARRAY
-
-    def __init__(self, name=None, buffer=None):
-        super(TAG_Long_Array, self).__init__(name=name)
-        if buffer:
-            self._parse_buffer(buffer)
-
-    def update_fmt(self, length):
-        """ Adjust struct format description to length given """
-        self.fmt = Struct(">" + str(length) + "q")
-
-    # Parsers and Generators
-    def _parse_buffer(self, buffer):
-        length = TAG_Int(buffer=buffer).value
-        self.update_fmt(length)
-        self.value = list(self.fmt.unpack(buffer.read(self.fmt.size)))
-
-    def _render_buffer(self, buffer):
-        length = len(self.value)
-        self.update_fmt(length)
-        TAG_Int(length)._render_buffer(buffer)
-        buffer.write(self.fmt.pack(*self.value))
-
-    # Mixin methods
-    def __len__(self):
-        return len(self.value)
-
-    def __iter__(self):
-        return iter(self.value)
-
-    def __contains__(self, item):
-        return item in self.value
-
-    def __getitem__(self, key):
-        return self.value[key]
-
-    def __setitem__(self, key, value):
-        self.value[key] = value
-
-    def __delitem__(self, key):
-        del (self.value[key])
-
-    def insert(self, key, value):
-        self.value.insert(key, value)
+    item_fmt = "q"
+    typecode = _array_typecode(8)
 
     # Printing and Formatting of tree
     def valuestr(self):
@@ -463,21 +555,130 @@ class TAG_List(TAG, MutableSequence):
         return '\n'.join(output)
 
 
+class _TagList(list):
+    """
+    The tags of a TAG_Compound, which also holds the index of their names.
+    Changes that may move or remove tags discard the index. Tags that are
+    appended are added to the index on the next lookup.
+    """
+    names = None
+    length = 0
+    renames = 0
+
+
+def _discards_names(method):
+    def wrapper(self, *args, **kwargs):
+        self.names = None
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+for _method in ('__setitem__', '__delitem__', '__setslice__', '__delslice__',
+                '__imul__', 'insert', 'pop', 'remove', 'clear', 'sort',
+                'reverse'):
+    if hasattr(list, _method):
+        setattr(_TagList, _method, _discards_names(getattr(list, _method)))
+
+
 class TAG_Compound(TAG, MutableMapping):
     """
     TAG_Compound, comparable to a collections.OrderedDict with an
     intrinsic name
+
+    Lookups by name use an index of the names in tags, which is built on
+    the first lookup and kept up to date when tags are changed, either
+    through the mapping methods, through the list methods of tags, or by
+    renaming a child. A list assigned to tags is converted on the next
+    lookup, so later changes to the original list are not seen.
     """
     id = TAG_COMPOUND
+    _lazy = None
 
     def __init__(self, buffer=None, name=None):
         # TODO: add a value parameter as well
         super(TAG_Compound, self).__init__()
-        self.tags = []
+        self.tags = _TagList()
         self.name = ""
         if buffer:
             self._parse_buffer(buffer)
 
+    # Lazy decoding
+    # A lazy compound has no tags attribute. Instead, it keeps the raw data
+    # and a list of (name, type, offset) entries of its children. Children
+    # are decoded when they are accessed by name or index; all children are
+    # decoded as soon as the tags attribute is accessed.
+    def _set_lazy(self, data, offset):
+        """Defer decoding of the payload at the given offset of data."""
+        del self.tags
+        self._lazy = (data, offset)
+        self._lazy_entries = None
+
+    def _lazy_skim(self):
+        """Record the name, type and offset of each child, skipping their
+        payloads. Return the offset after the payload of this compound."""
+        data, offset = self._lazy
+        entries = []
+        index = {}
+        try:
+            while True:
+                tagid = _FMT_TYPE.unpack_from(data, offset)[0]
+                offset += 1
+                if tagid == TAG_END:
+                    break
+                length = _FMT_STRING_LENGTH.unpack_from(data, offset)[0]
+                offset += 2
+                name = bytes(data[offset:offset + length]).decode("utf-8")
+                offset += length
+                index.setdefault(name, len(entries))
+                entries.append([name, tagid, offset, None])
+                offset = _skip_payload(data, offset, tagid)
+        except StructError:
+            raise MalformedFileError(
+                "Partial File Parse: file possibly truncated.")
+        self._lazy_entries = entries
+        self._lazy_index = index
+        return offset
+
+    def _lazy_child(self, i):
+        """Return the decoded child with the given index."""
+        if self._lazy_entries is None:
+            self._lazy_skim()
+        entry = self._lazy_entries[i]
+        if entry[3] is None:
+            name, tagid, offset = entry[:3]
+            data = self._lazy[0]
+            try:
+                tag, offset = _decode_leaf(data, offset, tagid, name)
+                if tagid == TAG_COMPOUND:
+                    tag._set_lazy(data, offset)
+                elif tagid == TAG_LIST:
+                    _decode_children(data, offset, tag)
+            except StructError:
+                raise MalformedFileError(
+                    "Partial File Parse: file possibly truncated.")
+            entry[3] = tag
+        return entry[3]
+
+    def __getattr__(self, name):
+        # Only called if the attribute is not found. For a lazy compound
+        # this is the case for tags.
+        if name == 'tags' and self._lazy is not None:
+            if self._lazy_entries is None:
+                self._lazy_skim()
+            self.tags = _TagList([self._lazy_child(i)
+                                  for i in range(len(self._lazy_entries))])
+            self._lazy = None
+            self._lazy_entries = self._lazy_index = None
+            return self.tags
+        raise AttributeError("%r object has no attribute %r" %
+                             (self.__class__.__name__, name))
+
+    def _lazy_keys(self):
+        if self._lazy_entries is None:
+            self._lazy_skim()
+        return [entry[0] for entry in self._lazy_entries]
+
     # Parsers and Generators
     def _parse_buffer(self, buffer):
         while True:
@@ -502,35 +703,74 @@ class TAG_Compound(TAG, MutableMapping):
             tag._render_buffer(buffer)
         buffer.write(b'\x00')  # write TAG_END
 
+    # Name index
+    def _names(self):
+        """Return the index of names in tags, which maps each name to the
+        position of the first child with that name."""
+        tags = self.tags
+        if tags.__class__ is not _TagList:
+            # tags was replaced by a plain list
+            tags = self.tags = _TagList(tags)
+        names = tags.names
+        start = tags.length
+        if names is None or tags.renames != TAG._renames:
+            names = tags.names = {}
+            tags.renames = TAG._renames
+            start = 0
+        for i in range(start, len(tags)):
+            tag = tags[i]
+            tag._indexed = True
+            names.setdefault(tag.name, i)
+        tags.length = len(tags)
+        return names
+
+    def _lookup(self, key):
+        """Return the position in tags of the child with the given name,
+        or None if no such child exists."""
+        return self._names().get(key)
+
     # Mixin methods
     def __len__(self):
+        if self._lazy is not None:
+            return len(self._lazy_keys())
         return len(self.tags)
 
     def __iter__(self):
+        if self._lazy is not None:
+            for key in self._lazy_keys():
+                yield key
+            return
         for key in self.tags:
             yield key.name
 
     def __contains__(self, key):
+        if self._lazy is not None and isinstance(key, basestring):
+            self._lazy_keys()
+            return key in self._lazy_index
         if isinstance(key, int):
             return key <= len(self.tags)
         elif isinstance(key, basestring):
-            for tag in self.tags:
-                if tag.name == key:
-                    return True
-            return False
+            return self._lookup(key) is not None
         elif isinstance(key, TAG):
             return key in self.tags
         return False
 
     def __getitem__(self, key):
-        if isinstance(key, int):
-            return self.tags[key]
-        elif isinstance(key, basestring):
-            for tag in self.tags:
-                if tag.name == key:
-                    return tag
-            else:
+        if self._lazy is not None:
+            if isinstance(key, int):
+                return self._lazy_child(key)
+            elif isinstance(key, basestring):
+                self._lazy_keys()
+                if key not in self._lazy_index:
+                    raise KeyError("Tag %s does not exist" % key)
+                return self._lazy_child(self._lazy_index[key])
+        if isinstance(key, basestring):
+            i = self._lookup(key)
+            if i is None:
                 raise KeyError("Tag %s does not exist" % key)
+            return self.tags[i]
+        elif isinstance(key, int):
+            return self.tags[key]
         else:
             raise TypeError(
                 "key needs to be either name of tag, or index of tag, "
@@ -542,23 +782,42 @@ class TAG_Compound(TAG, MutableMapping):
             # Just try it. The proper error will be raised if it doesn't work.
             self.tags[key] = value
         elif isinstance(key, basestring):
-            value.name = key
-            for i, tag in enumerate(self.tags):
-                if tag.name == key:
-                    self.tags[i] = value
-                    return
-            self.tags.append(value)
+            names = self._names()
+            tags = self.tags
+            i = names.get(key)
+            oldname = value.name
+            if i is not None:
+                # replace the existing tag
+                value.name = key
+                tags[i] = value
+            elif oldname in names and tags[names[oldname]] is value:
+                # value is already a child: rename it
+                i = names.pop(oldname)
+                value._name = key
+            else:
+                value.name = key
+                tags.append(value)
+                i = len(tags) - 1
+                tags.length = len(tags)
+            value._indexed = True
+            names[key] = i
+            tags.names = names
 
     def __delitem__(self, key):
         if isinstance(key, int):
             del (self.tags[key])
         elif isinstance(key, basestring):
-            self.tags.remove(self.__getitem__(key))
+            i = self._lookup(key)
+            if i is None:
+                raise KeyError("Tag %s does not exist" % key)
+            del (self.tags[i])
         else:
             raise ValueError(
                 "key needs to be either name of tag, or index of tag")
 
     def keys(self):
+        if self._lazy is not None:
+            return self._lazy_keys()
         return [tag.name for tag in self.tags]
 
     def iteritems(self):
@@ -592,28 +851,453 @@ TAGLIST = {TAG_END: _TAG_End, TAG_BYTE: TAG_Byte, TAG_SHORT: TAG_Short,
            TAG_LONG_ARRAY: TAG_Long_Array}
 
 
+# == Single-pass Parser ==#
+# Decode NBT from a bytes-like object (bytes, bytearray or memoryview) and an
+# integer offset, without the intermediate TAG objects (type ids, names and
+# lengths) and read() calls of the stream parser.
+
+_FMT_TYPE = Struct(">b")
+_FMT_STRING_LENGTH = Struct(">H")
+_FMT_ARRAY_LENGTH = Struct(">i")
+_FMT_LIST_HEADER = Struct(">bi")
+
+_FIXED_SIZES = dict((tagid, cls.fmt.size) for tagid, cls in TAGLIST.items()
+                    if issubclass(cls, _TAG_Numeric))
+_ARRAY_ITEM_SIZES = {TAG_BYTE_ARRAY: 1, TAG_INT_ARRAY: 4, TAG_LONG_ARRAY: 8}
+
+_FORMAT_CHARS = {TAG_BYTE: "b", TAG_SHORT: "h", TAG_INT: "i", TAG_LONG: "q",
+                 TAG_FLOAT: "f", TAG_DOUBLE: "d"}
+
+_NUMERIC_TAGS = dict((tagid, (cls, cls.fmt)) for tagid, cls in TAGLIST.items()
+                     if issubclass(cls, _TAG_Numeric))
+
+
+def _decode_leaf(data, offset, tagid, name=None):
+    """
+    Decode the payload of a tag at the given offset.
+    Return the tag and the offset after the payload. For a TAG_Compound
+    or TAG_List, only an empty tag is created; the caller is responsible
+    for decoding the children.
+    """
+    if tagid in _NUMERIC_TAGS:
+        cls, fmt = _NUMERIC_TAGS[tagid]
+        return cls(fmt.unpack_from(data, offset)[0], name), offset + fmt.size
+    elif tagid == TAG_STRING:
+        length = _FMT_STRING_LENGTH.unpack_from(data, offset)[0]
+        offset += 2
+        end = offset + length
+        if end > len(data):
+            raise StructError("string of %d bytes exceeds buffer" % length)
+        return TAG_String(bytes(data[offset:end]).decode("utf-8"), name), end
+    elif tagid == TAG_BYTE_ARRAY:
+        length = _FMT_ARRAY_LENGTH.unpack_from(data, offset)[0]
+        offset += 4
+        end = offset + length
+        if length < 0 or end > len(data):
+            raise StructError("array of %d bytes exceeds buffer" % length)
+        tag = TAG_Byte_Array(name=name)
+        tag.value = bytearray(data[offset:end])
+        return tag, end
+    elif tagid == TAG_INT_ARRAY or tagid == TAG_LONG_ARRAY:
+        length = _FMT_ARRAY_LENGTH.unpack_from(data, offset)[0]
+        offset += 4
+        end = offset + length * _ARRAY_ITEM_SIZES[tagid]
+        if length < 0 or end > len(data):
+            raise StructError("array of %d items exceeds buffer" % length)
+        tag = TAGLIST[tagid](name=name)
+        tag.value = tag._from_bytes(memoryview(data)[offset:end])
+        return tag, end
+    elif tagid == TAG_COMPOUND:
+        tag = TAG_Compound()
+        if name is not None:
+            tag.name = name
+        return tag, offset
+    elif tagid == TAG_LIST:
+        return TAG_List(name=name), offset
+    raise ValueError("Unrecognised tag type %d" % tagid)
+
+
+def _skip_payload(data, offset, tagid):
+    """
+    Return the offset after the payload of a tag at the given offset,
+    without decoding it. Strings and arrays are skipped using their length
+    prefix, as well as lists of numeric tags.
+    """
+    # stack of [type, remaining] for lists, and None for compounds
+    stack = []
+    while True:
+        if tagid in _FIXED_SIZES:
+            offset += _FIXED_SIZES[tagid]
+        elif tagid == TAG_STRING:
+            offset += 2 + _FMT_STRING_LENGTH.unpack_from(data, offset)[0]
+        elif tagid in _ARRAY_ITEM_SIZES:
+            length = _FMT_ARRAY_LENGTH.unpack_from(data, offset)[0]
+            if length < 0:
+                raise StructError("negative array length %d" % length)
+            offset += 4 + length * _ARRAY_ITEM_SIZES[tagid]
+        elif tagid == TAG_LIST:
+            itemid, length = _FMT_LIST_HEADER.unpack_from(data, offset)
+            offset += 5
+            if length <= 0:
+                pass
+            elif itemid in _FIXED_SIZES:
+                offset += length * _FIXED_SIZES[itemid]
+            else:
+                stack.append([itemid, length])
+        elif tagid == TAG_COMPOUND:
+            stack.append(None)
+        else:
+            raise ValueError("Unrecognised tag type %d" % tagid)
+        # find the next payload to skip
+        while stack:
+            frame = stack[-1]
+            if frame is None:
+                tagid = _FMT_TYPE.unpack_from(data, offset)[0]
+                offset += 1
+                if tagid == TAG_END:
+                    stack.pop()
+                    continue
+                offset += 2 + _FMT_STRING_LENGTH.unpack_from(data, offset)[0]
+                break
+            elif frame[1] > 0:
+                frame[1] -= 1
+                tagid = frame[0]
+                break
+            else:
+                stack.pop()
+        else:
+            if offset > len(data):
+                raise StructError("payload exceeds buffer")
+            return offset
+
+
+def _decode_children(data, offset, container):
+    """
+    Decode the payload of a TAG_Compound or TAG_List at the given offset and
+    add all children to container. Return the offset after the payload.
+
+    Nested compounds and lists are handled with an explicit stack instead
+    of recursion.
+    """
+    stack = []
+    remaining = None
+    if container.id == TAG_LIST:
+        container.tagID, remaining = _FMT_LIST_HEADER.unpack_from(data, offset)
+        offset += 5
+    while True:
+        if remaining is None:
+            # container is a TAG_Compound
+            tagid = _FMT_TYPE.unpack_from(data, offset)[0]
+            offset += 1
+            if tagid == TAG_END:
+                if not stack:
+                    return offset
+                container, remaining = stack.pop()
+                continue
+            length = _FMT_STRING_LENGTH.unpack_from(data, offset)[0]
+            offset += 2
+            end = offset + length
+            if end > len(data):
+                raise StructError("name of %d bytes exceeds buffer" % length)
+            name = bytes(data[offset:end]).decode("utf-8")
+            offset = end
+        else:
+            # container is a TAG_List
+            if remaining <= 0:
+                if not stack:
+                    return offset
+                container, remaining = stack.pop()
+                continue
+            remaining -= 1
+            tagid = container.tagID
+            name = None
+        tag, offset = _decode_leaf(data, offset, tagid, name)
+        container.tags.append(tag)
+        if tagid == TAG_COMPOUND:
+            stack.append((container, remaining))
+            container, remaining = tag, None
+        elif tagid == TAG_LIST:
+            stack.append((container, remaining))
+            tag.tagID, length = _FMT_LIST_HEADER.unpack_from(data, offset)
+            offset += 5
+            container, remaining = tag, length
+
+
+# == Single-pass Encoder ==#
+# Encode a tree of tags into a single bytearray, with the cached Structs of
+# the parser, instead of the intermediate TAG objects and small write()
+# calls of _render_buffer().
+
+_FMT_NAMED_TAG = Struct(">bH")
+
+_SPOOL_SIZE = 65536
+"""Number of bytes after which a _SpoolBuffer is passed on."""
+
+
+class _SpoolBuffer(bytearray):
+    """Buffer that is passed to a callback and emptied each time it holds
+    more than _SPOOL_SIZE bytes, checked after each child of a compound."""
+    def __init__(self, callback):
+        bytearray.__init__(self)
+        self.callback = callback
+
+    def spool(self):
+        self.callback(self)
+        del self[:]
+
+
+def _encode_payload(buffer, tag):
+    """Append the payload of tag to buffer, a bytearray."""
+    tagid = tag.id
+    if tagid in _NUMERIC_TAGS:
+        buffer.extend(_NUMERIC_TAGS[tagid][1].pack(tag.value))
+    elif tagid == TAG_STRING:
+        value = tag.value.encode("utf-8")
+        buffer.extend(_FMT_STRING_LENGTH.pack(len(value)))
+        buffer.extend(value)
+    elif tagid == TAG_BYTE_ARRAY:
+        buffer.extend(_FMT_ARRAY_LENGTH.pack(len(tag.value)))
+        buffer.extend(tag.value)
+    elif tagid == TAG_INT_ARRAY or tagid == TAG_LONG_ARRAY:
+        buffer.extend(_FMT_ARRAY_LENGTH.pack(len(tag.value)))
+        buffer.extend(tag._to_bytes())
+    elif tagid == TAG_LIST:
+        _encode_list(buffer, tag)
+    elif tagid == TAG_COMPOUND:
+        _encode_compound(buffer, tag)
+    else:
+        raise ValueError("Unrecognised tag type %d" % tagid)
+
+
+def _encode_list(buffer, tag):
+    """Append the payload of a TAG_List to buffer."""
+    itemid = tag.tagID
+    buffer.extend(_FMT_LIST_HEADER.pack(itemid or 0, len(tag.tags)))
+    for i, item in enumerate(tag.tags):
+        if item.id != itemid:
+            raise ValueError(
+                "List element %d(%s) has type %d != container type %d" %
+                (i, item, item.id, itemid))
+    if itemid in _NUMERIC_TAGS and tag.tags:
+        # All items at once. The struct module caches the compiled format.
+        fmt = ">%d%s" % (len(tag.tags), _FORMAT_CHARS[itemid])
+        buffer.extend(pack(fmt, *[item.value for item in tag.tags]))
+    else:
+        for item in tag.tags:
+            _encode_payload(buffer, item)
+
+
+def _encode_compound(buffer, tag):
+    """Append the payload of a TAG_Compound to buffer. Children of a lazy
+    compound that were not decoded are copied from the original data."""
+    spool = getattr(buffer, "spool", None)
+    if tag._lazy is not None:
+        if tag._lazy_entries is None:
+            tag._lazy_skim()
+        data = tag._lazy[0]
+        for name, tagid, offset, child in tag._lazy_entries:
+            if child is None:
+                # name, type and payload are unchanged
+                start = offset - 3 - len(name.encode("utf-8"))
+                buffer.extend(data[start:_skip_payload(data, offset, tagid)])
+            else:
+                _encode_named(buffer, child)
+            if spool is not None and len(buffer) >= _SPOOL_SIZE:
+                spool()
+    else:
+        for child in tag.tags:
+            _encode_named(buffer, child)
+            if spool is not None and len(buffer) >= _SPOOL_SIZE:
+                spool()
+    buffer.append(TAG_END)
+
+
+def _encode_named(buffer, tag):
+    """Append the type, name and payload of tag to buffer."""
+    name = tag.name.encode("utf-8")
+    buffer.extend(_FMT_NAMED_TAG.pack(tag.id, len(name)))
+    buffer.extend(name)
+    _encode_payload(buffer, tag)
+
+
+# == Path Extraction ==#
+
+def _decode_value(data, offset, tagid):
+    """
+    Decode the payload of a tag at the given offset as plain Python value.
+    Return the value and the offset after the payload.
+    """
+    if tagid in _NUMERIC_TAGS:
+        fmt = _NUMERIC_TAGS[tagid][1]
+        return fmt.unpack_from(data, offset)[0], offset + fmt.size
+    elif tagid == TAG_STRING:
+        length = _FMT_STRING_LENGTH.unpack_from(data, offset)[0]
+        offset += 2
+        if offset + length > len(data):
+            raise StructError("string of %d bytes exceeds buffer" % length)
+        return bytes(data[offset:offset + length]).decode("utf-8"), offset + length
+    elif tagid == TAG_BYTE_ARRAY:
+        length = _FMT_ARRAY_LENGTH.unpack_from(data, offset)[0]
+        offset += 4
+        if length < 0 or offset + length > len(data):
+            raise StructError("array of %d bytes exceeds buffer" % length)
+        return bytearray(data[offset:offset + length]), offset + length
+    elif tagid == TAG_INT_ARRAY or tagid == TAG_LONG_ARRAY:
+        length = _FMT_ARRAY_LENGTH.unpack_from(data, offset)[0]
+        offset += 4
+        end = offset + length * _ARRAY_ITEM_SIZES[tagid]
+        if length < 0 or end > len(data):
+            raise StructError("array of %d items exceeds buffer" % length)
+        return list(TAGLIST[tagid]._from_bytes(memoryview(data)[offset:end])), end
+    elif tagid == TAG_LIST:
+        itemid, length = _FMT_LIST_HEADER.unpack_from(data, offset)
+        offset += 5
+        if itemid in _NUMERIC_TAGS and length > 0:
+            fmt = Struct(">%d%s" % (length, _FORMAT_CHARS[itemid]))
+            return list(fmt.unpack_from(data, offset)), offset + fmt.size
+        value = []
+        for i in range(length):
+            item, offset = _decode_value(data, offset, itemid)
+            value.append(item)
+        return value, offset
+    elif tagid == TAG_COMPOUND:
+        value = {}
+        while True:
+            itemid = _FMT_TYPE.unpack_from(data, offset)[0]
+            offset += 1
+            if itemid == TAG_END:
+                return value, offset
+            name, offset = _decode_value(data, offset, TAG_STRING)
+            value[name], offset = _decode_value(data, offset, itemid)
+    raise ValueError("Unrecognised tag type %d" % tagid)
+
+
+def _extract_payload(data, offset, tagid, node, results):
+    """
+    Walk the payload of a tag at the given offset, and store the values of
+    the paths in node in results. node is a dict, mapping path components
+    to child nodes, and None to a (path, wildcard) tuple for the requested
+    path ending at this tag. Return the offset after the payload.
+    """
+    if None in node:
+        value, end = _decode_value(data, offset, tagid)
+        path, wildcard = node[None]
+        if wildcard:
+            results[path].append(value)
+        else:
+            results[path] = value
+        if len(node) == 1:
+            return end
+    if tagid == TAG_COMPOUND:
+        while True:
+            itemid = _FMT_TYPE.unpack_from(data, offset)[0]
+            offset += 1
+            if itemid == TAG_END:
+                return offset
+            name, offset = _decode_value(data, offset, TAG_STRING)
+            children = [node[key] for key in (name, '*') if key in node]
+            end = None
+            for child in children:
+                end = _extract_payload(data, offset, itemid, child, results)
+            offset = end if end is not None else \
+                _skip_payload(data, offset, itemid)
+    elif tagid == TAG_LIST:
+        itemid, length = _FMT_LIST_HEADER.unpack_from(data, offset)
+        if not any(key == '*' or key.isdigit() for key in node if key):
+            return _skip_payload(data, offset, tagid)
+        offset += 5
+        for i in range(length):
+            children = [node[key] for key in (str(i), '*') if key in node]
+            end = None
+            for child in children:
+                end = _extract_payload(data, offset, itemid, child, results)
+            offset = end if end is not None else \
+                _skip_payload(data, offset, itemid)
+        return offset
+    else:
+        # path continues below a tag without children: it does not exist
+        return _skip_payload(data, offset, tagid)
+
+
+def extract(data, paths):
+    """
+    Return the values of the given paths in uncompressed NBT data, as a dict
+    mapping each path to a plain Python value. Only the requested tags are
+    decoded; all other payloads are skipped using their length prefixes.
+
+    data is a bytes-like object (bytes, bytearray or memoryview) with a
+    complete NBT file, for example the result of RegionFile.get_blockdata().
+    A path contains the names of compounds, separated by slashes, and
+    starts below the root compound, e.g. "Level/xPos". A list element is
+    specified by its index, and "*" matches all elements of a list or
+    compound, e.g. "Level/Sections/*/Y". For a path with a "*", the value is
+    a list of all matching values, otherwise a path that is not present in
+    the data is not included in the result.
+
+    Compounds are returned as dict, lists and arrays as list (a TAG_Byte_Array
+    as bytearray) and strings as unicode string.
+    """
+    if not _PY3 and isinstance(data, memoryview):
+        # Python 2 can not decode or str() a memoryview
+        data = data.tobytes()
+    tree = {}
+    results = {}
+    for path in paths:
+        node = tree
+        keys = path.split("/")
+        for key in keys:
+            node = node.setdefault(key, {})
+        node[None] = (path, '*' in keys)
+        if '*' in keys:
+            results[path] = []
+    try:
+        if _FMT_TYPE.unpack_from(data, 0)[0] != TAG_COMPOUND:
+            raise MalformedFileError("First record is not a Compound Tag")
+        name, offset = _decode_value(data, 1, TAG_STRING)
+        _extract_payload(data, offset, TAG_COMPOUND, tree, results)
+    except StructError:
+        raise MalformedFileError("Partial File Parse: file possibly truncated.")
+    return results
+
+
 class NBTFile(TAG_Compound):
     """Represent an NBT file object."""
 
-    def __init__(self, filename=None, buffer=None, fileobj=None):
+    def __init__(self, filename=None, buffer=None, fileobj=None,
+                 parser=PARSER_STREAM):
         """
         Create a new NBTFile object.
         Specify either a filename, file object or data buffer.
         If filename of file object is specified, data should be GZip-compressed.
         If a data buffer is specified, it is assumed to be uncompressed.
+        The data buffer may be a file object or a bytes-like object (bytes,
+        bytearray or memoryview).
 
         If filename is specified, the file is closed after reading and writing.
         If file object is specified, the caller is responsible for closing the
         file.
+
+        parser selects how the data is decoded: PARSER_STREAM reads tag by
+        tag from the file object, PARSER_FAST reads all data at once and
+        decodes it in a single pass, which is considerably faster.
+        PARSER_LAZY reads all data at once, but only decodes a compound when
+        one of its children is accessed, which is faster still if only a
+        few tags are used. The data is kept in memory as long as not all
+        compounds are decoded.
         """
         super(NBTFile, self).__init__()
         self.filename = filename
+        self.parser = parser
         self.type = TAG_Byte(self.id)
         closefile = True
         # make a file object
         if filename:
             self.filename = filename
             self.file = GzipFile(filename, 'rb')
+        elif isinstance(buffer, _BYTES_TYPES):
+            self.file = None
+            self.parse_file(buffer=buffer)
+            return
         elif buffer:
             if hasattr(buffer, 'name'):
                 self.filename = buffer.name
@@ -640,8 +1324,13 @@ class NBTFile(TAG_Compound):
 
     def parse_file(self, filename=None, buffer=None, fileobj=None):
         """Completely parse a file, extracting all tags."""
+        data = None
         if filename:
             self.file = GzipFile(filename, 'rb')
+        elif isinstance(buffer, _BYTES_TYPES):
+            data = buffer
+            if self.parser == PARSER_STREAM:
+                self.file = BytesIO(buffer)
         elif buffer:
             if hasattr(buffer, 'name'):
                 self.filename = buffer.name
@@ -650,6 +1339,19 @@ class NBTFile(TAG_Compound):
             if hasattr(fileobj, 'name'):
                 self.filename = fileobj.name
             self.file = GzipFile(fileobj=fileobj)
+        if self.parser != PARSER_STREAM:
+            try:
+                if data is None and self.file:
+                    # Note: read() may raise an IOError, for example if the
+                    # file is a corrupt gzip.GzipFile
+                    data = self.file.read()
+                    self.file.close()
+                if data is not None:
+                    self._parse_data(data)
+                    return
+            except StructError:
+                raise MalformedFileError(
+                    "Partial File Parse: file possibly truncated.")
         if self.file:
             try:
                 type = TAG_Byte(buffer=self.file)
@@ -670,6 +1372,45 @@ class NBTFile(TAG_Compound):
                 "filename or a file object"
             )
 
+    def _parse_data(self, data):
+        """Parse a bytes-like object, using the single-pass parser."""
+        if not _PY3 and isinstance(data, memoryview):
+            # Python 2 can not decode or str() a memoryview
+            data = data.tobytes()
+        if _FMT_TYPE.unpack_from(data, 0)[0] != self.id:
+            raise MalformedFileError("First record is not a Compound Tag")
+        length = _FMT_STRING_LENGTH.unpack_from(data, 1)[0]
+        if 3 + length > len(data):
+            raise StructError("name of %d bytes exceeds buffer" % length)
+        name = bytes(data[3:3 + length]).decode("utf-8")
+        if self.parser == PARSER_LAZY:
+            # Skimming the root compound validates the structure of the
+            # whole file, so that a malformed file is detected right away.
+            if not isinstance(data, bytes):
+                # Keep a copy, as a bytearray or memoryview may be changed
+                # after parsing, while children are decoded on access.
+                data = bytes(data)
+            self._set_lazy(data, 3 + length)
+            self._lazy_skim()
+        else:
+            _decode_children(data, 3 + length, self)
+        self.name = name
+
+    def render(self, callback=None):
+        """
+        Return the uncompressed NBT data of this file as a bytearray.
+        Parts of a file read with the lazy parser that were not accessed are
+        copied from the original data.
+
+        If callback is given, the data is rendered in pieces: callback is
+        called with the data rendered so far each time it exceeds 64 KiB,
+        and only the remaining data is returned. The piece passed to
+        callback is reused afterwards, so callback must consume or copy it.
+        """
+        buffer = bytearray() if callback is None else _SpoolBuffer(callback)
+        _encode_named(buffer, self)
+        return buffer
+
     def write_file(self, filename=None, buffer=None, fileobj=None):
         """Write this NBT file to a file."""
         closefile = True
@@ -691,9 +1432,11 @@ class NBTFile(TAG_Compound):
                 "filename or a file object"
             )
         # Render tree to file
-        TAG_Byte(self.id)._render_buffer(self.file)
-        TAG_String(self.name)._render_buffer(self.file)
-        self._render_buffer(self.file)
+        data = self.render()
+        if not _PY3:
+            # Python 2 GzipFile rejects a bytearray
+            data = bytes(data)
+        self.file.write(data)
         # make sure the file is complete
         try:
             self.file.flush()
@@ -5,14 +5,26 @@ For more information about the region file format:
 https://minecraft.gamepedia.com/Region_file_format
 """
 
-from .nbt import NBTFile, MalformedFileError
-from struct import pack, unpack
-from collections import Mapping
+from .nbt import NBTFile, MalformedFileError, PARSER_STREAM
+from struct import pack, Struct, error as StructError
+from collections import Mapping, OrderedDict
+from contextlib import contextmanager
+import os
+import re
 import zlib
+import tempfile
+import shutil
 import gzip
 from io import BytesIO
 import time
-from os import SEEK_END
+import sys
+from os import SEEK_END, fstat
+from mmap import mmap as _MemoryMap, ACCESS_READ
+try:
+    import xxhash
+except ImportError:
+    # xxhash is optional, and only required for the 'xxh64' checksum
+    xxhash = None
 
 # constants
 
@@ -44,6 +56,14 @@ STATUS_CHUNK_OK = 0
 STATUS_CHUNK_NOT_CREATED = 1
 """Constant indicating an normal status: the chunk does not exist"""
 
+_HEADER_FORMAT = Struct(">1024I")
+"""Format of each of the two tables in the region header: 1024 locations
+(offset in sectors << 8 | length in sectors) and 1024 timestamps."""
+_CHUNK_HEADER_FORMAT = Struct(">IB")
+"""Format of the chunk header: length and compression."""
+_MAX_COALESCED_READ = 16 * SECTOR_LENGTH
+"""Chunk headers within this many bytes from each other are read at once."""
+
 COMPRESSION_NONE = 0
 """Constant indicating that the chunk is not compressed."""
 COMPRESSION_GZIP = 1
@@ -163,6 +183,210 @@ class Location(object):
     def __str__(self):
         return "%s(x=%s, y=%s, z=%s)" % (self.__class__.__name__, self.x, self.y, self.z)
 
+ALLOCATE_FIRST_FIT = 'first-fit'
+"""Constant for :attr:`RegionFile.allocation`: write a chunk in the first free
+space that is large enough."""
+ALLOCATE_BEST_FIT = 'best-fit'
+"""Constant for :attr:`RegionFile.allocation`: write a chunk in the smallest
+free space that is large enough, or at the end of the file."""
+
+_FREE_RUN = re.compile(b'\x00+')
+
+_CURVE_BITS = 22
+"""Number of bits of a chunk coordinate in the space-filling curves. This
+covers the 30 million block limit of a Minecraft world."""
+
+def _zcurve_key(x, z):
+    """Return the position of chunk x,z along a Z-order curve."""
+    x += 1 << (_CURVE_BITS - 1)
+    z += 1 << (_CURVE_BITS - 1)
+    key = 0
+    for i in range(_CURVE_BITS):
+        key |= ((x >> i) & 1) << (2*i) | ((z >> i) & 1) << (2*i + 1)
+    return key
+
+def _hilbert_key(x, z):
+    """Return the position of chunk x,z along a Hilbert curve."""
+    n = 1 << _CURVE_BITS
+    x += n >> 1
+    z += n >> 1
+    key = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        rz = 1 if z & s else 0
+        key += s * s * ((3 * rx) ^ rz)
+        # Rotate the quadrant, so the curve is continuous
+        if rz == 0:
+            if rx == 1:
+                x = n - 1 - x
+                z = n - 1 - z
+            x, z = z, x
+        s >>= 1
+    return key
+
+_CURVE_KEYS = {'zcurve': _zcurve_key, 'hilbert': _hilbert_key}
+
+
+class _SectorMap(object):
+    """
+    Map of the sectors in use in a region file. It is built once from the
+    metadata, and updated for each chunk that is written or unlinked.
+    """
+    def __init__(self, sectorsize):
+        self.counts = [1, 1] + [0] * max(sectorsize - 2, 0)
+        """Number of chunks (or header tables) using each sector."""
+        self.used = bytearray(b'\x01\x01') + bytearray(max(sectorsize - 2, 0))
+        """1 for each sector in use, 0 for each free sector."""
+        self.extents = {}
+        """First and last + 1 sector of each chunk, by chunk x,z."""
+        self.clipped = False
+        """True if a chunk extends beyond the end of the file."""
+
+    def __len__(self):
+        return len(self.used)
+
+    def resize(self, sectorsize):
+        """Extend with free sectors, or remove sectors at the end."""
+        extra = sectorsize - len(self.used)
+        if extra > 0:
+            self.counts.extend([0] * extra)
+            self.used.extend(bytearray(extra))
+        elif extra < 0:
+            del self.counts[sectorsize:]
+            del self.used[sectorsize:]
+
+    def add(self, key, start, end):
+        """Mark sectors start up to end as used by chunk key."""
+        self.remove(key)
+        if end > len(self.used):
+            self.resize(end)
+        for s in range(start, end):
+            self.counts[s] += 1
+            self.used[s] = 1
+        self.extents[key] = (start, end)
+
+    def remove(self, key):
+        """Mark the sectors of chunk key as no longer used by it."""
+        start, end = self.extents.pop(key, (0, 0))
+        for s in range(start, min(end, len(self.counts))):
+            self.counts[s] -= 1
+            if self.counts[s] == 0:
+                self.used[s] = 0
+
+    def is_free(self, sector):
+        return sector >= len(self.used) or not self.used[sector]
+
+    def fits(self, start, nsectors):
+        """Return True if nsectors sectors from start are free."""
+        return start >= 2 and not any(self.used[start:start+nsectors])
+
+    def trailing_free(self):
+        """Return the number of free sectors at the end."""
+        return len(self.used) - len(self.used.rstrip(b'\x00'))
+
+    def find(self, nsectors, preferred=None, allocation=ALLOCATE_FIRST_FIT):
+        """
+        Return the first sector of nsectors consecutive free sectors.
+        Sectors beyond the end are free. The preferred sector is returned
+        if possible.
+        """
+        if preferred and self.fits(preferred, nsectors):
+            return preferred
+        end = len(self.used) - self.trailing_free()
+        if allocation == ALLOCATE_BEST_FIT:
+            best, bestlength = end, None
+            for run in _FREE_RUN.finditer(self.used, 2, end):
+                length = run.end() - run.start()
+                if length >= nsectors and (bestlength is None or length < bestlength):
+                    best, bestlength = run.start(), length
+                    if length == nsectors:
+                        break
+            return best
+        elif allocation != ALLOCATE_FIRST_FIT:
+            raise ValueError("Unknown allocation %r" % (allocation,))
+        sector = self.used.find(b'\x00' * nsectors, 2, end)
+        return end if sector == -1 else sector
+
+
+def _crc32(data):
+    return zlib.crc32(data) & 0xffffffff
+
+def _xxh64(data):
+    return xxhash.xxh64(data).intdigest()
+
+CHECKSUMS = {'crc32': _crc32}
+"""Functions to compute a checksum of the compressed data of a chunk, by name,
+for :meth:`RegionFile.get_manifest`. 'xxh64' is available if the xxhash
+package is installed."""
+if xxhash is not None:
+    CHECKSUMS['xxh64'] = _xxh64
+
+
+class ChunkCache(object):
+    """
+    Least recently used cache of decoded chunks (NBTFile objects), shared by
+    one or more region files.
+
+    The cache holds at most max_size bytes, counted as the size of the
+    uncompressed NBT data of each chunk. The cached NBTFile objects are
+    returned as is, so changes to them are visible to the next reader,
+    until the chunk is written or unlinked.
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        """Maximum size of all cached chunks in bytes of uncompressed NBT data."""
+        self.size = 0
+        """Size of all cached chunks in bytes of uncompressed NBT data."""
+        self.hits = 0
+        """Number of lookups that returned a cached chunk."""
+        self.misses = 0
+        """Number of lookups for a chunk that was not cached."""
+        self.evictions = 0
+        """Number of chunks removed from the cache to stay within max_size."""
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Return the NBTFile cached for key, or None."""
+        try:
+            entry = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        # Most recently used chunk goes last
+        self._entries[key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, nbt, size):
+        """Cache nbt for key, with the given size of its NBT data in bytes."""
+        self.invalidate(key)
+        if size > self.max_size:
+            return
+        self._entries[key] = (nbt, size)
+        self.size += size
+        while self.size > self.max_size:
+            self.size -= self._entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """Remove the chunk for key from the cache, if it is cached."""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        """Remove all chunks from the cache."""
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+
 class RegionFile(object):
     """A convenience class for extracting NBT files from the Minecraft Beta Region Format."""
     
@@ -190,19 +414,46 @@ class RegionFile(object):
     """Constant indicating an normal status: the chunk does not exist.
     Deprecated. Use :const:`nbt.region.STATUS_CHUNK_NOT_CREATED` instead."""
     
-    def __init__(self, filename=None, fileobj=None, chunkclass = None):
+    def __init__(self, filename=None, fileobj=None, chunkclass = None, parser = PARSER_STREAM, mmap = False, \
+                 cache = None):
         """
         Read a region file by filename or file object. 
         If a fileobj is specified, it is not closed after use; it is the callers responibility to close it.
+        parser is the default NBT parser for get_nbt(); see :class:`nbt.nbt.NBTFile`.
+        If mmap is True, the file given by filename is opened read-only and
+        memory mapped. This is faster for reading many chunks, but
+        writing to the region file raises an IOError.
+        cache is an optional :class:`ChunkCache` for the chunks returned by
+        get_nbt().
         """
         self.file = None
         self.filename = None
         self._closefile = False
+        self._mmap = None
+        self.readonly = False
+        """True if the region file is opened read-only."""
         self.chunkclass = chunkclass
+        self.parser = parser
+        self.cache = cache
+        """Optional :class:`ChunkCache` used by get_nbt()."""
+        self.allocation = ALLOCATE_FIRST_FIT
+        """Where write_blockdata() writes a chunk that does not fit in its
+        current sectors: ALLOCATE_FIRST_FIT or ALLOCATE_BEST_FIT."""
+        self.compression = COMPRESSION_ZLIB
+        """Compression used to write chunks, unless given to write_blockdata(),
+        write_many() or write_chunk(): COMPRESSION_ZLIB, COMPRESSION_GZIP or
+        COMPRESSION_NONE."""
+        self.compression_level = zlib.Z_DEFAULT_COMPRESSION
+        """Compression level used to write chunks, from 1 (fastest) to 9
+        (smallest), or zlib.Z_DEFAULT_COMPRESSION (-1, equivalent to 6)."""
+        self.compression_strategy = zlib.Z_DEFAULT_STRATEGY
+        """zlib strategy used to write chunks, e.g. zlib.Z_FILTERED or
+        zlib.Z_HUFFMAN_ONLY."""
+        self._sector_map = None
+        self._batch = None
+        self._closed_stat = None
         if filename:
-            self.filename = filename
-            self.file = open(filename, 'r+b') # open for read and write in binary mode
-            self._closefile = True
+            self._open_file(filename, mmap)
         elif fileobj:
             if hasattr(fileobj, 'name'):
                 self.filename = fileobj.name
@@ -263,6 +514,9 @@ class RegionFile(object):
 
     def get_size(self):
         """ Returns the file size in bytes. """
+        self._reopen()
+        if self._mmap is not None:
+            return len(self._mmap)
         # seek(0,2) jumps to 0-bytes from the end of the file.
         # Python 2.6 support: seek does not yet return the position.
         self.file.seek(0, SEEK_END)
@@ -276,24 +530,84 @@ class RegionFile(object):
         sectors, remainder = divmod(bsize, sectorlength)
         return sectors if remainder == 0 else sectors + 1
     
+    def _open_file(self, filename, mmap):
+        """Open the file by filename, read-only and memory mapped if mmap is True."""
+        self.filename = filename
+        if mmap:
+            self.file = open(filename, 'rb')
+            self._closefile = True
+            self.readonly = True
+            try:
+                self._mmap = _MemoryMap(self.file.fileno(), 0, access=ACCESS_READ)
+            except ValueError:
+                # An empty file can not be mapped
+                pass
+        else:
+            self.file = open(filename, 'r+b') # open for read and write in binary mode
+            self._closefile = True
+
+    def _reopen(self):
+        """
+        Open the file again after close(), for a region file that was created
+        by filename. The metadata is kept if the size and modification time of
+        the file did not change since it was closed, and is read again otherwise.
+        This is done automatically when the region file is read or written.
+        """
+        if not self._closefile or not self.file.closed:
+            return
+        self._open_file(self.filename, self.readonly)
+        st = fstat(self.file.fileno())
+        if self._closed_stat != (st.st_size, st.st_mtime):
+            if self.cache is not None:
+                for x, z in self.metadata:
+                    self.cache.invalidate(self._cache_key(x, z))
+            self._init_header()
+            self._parse_header()
+            self._parse_chunk_headers()
+
     def close(self):
         """
         Clean up resources after use.
         
-        Note that the instance is no longer readable nor writable after calling close().
-        The method is automatically called by garbage collectors, but made public to
-        allow explicit cleanup.
+        A region file opened by filename is opened again when it is read or
+        written after calling close(); other instances are no longer readable
+        nor writable. The method is automatically called by garbage collectors,
+        but made public to allow explicit cleanup.
         """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
         if self._closefile:
             try:
+                if not self.file.closed:
+                    self.file.flush()
+                    st = fstat(self.file.fileno())
+                    self._closed_stat = (st.st_size, st.st_mtime)
                 self.file.close()
-            except IOError:
+            except (IOError, OSError):
                 pass
 
     def __del__(self):
         self.close()
         # Parent object() has no __del__ method, otherwise it should be called here.
 
+    def _read_at(self, offset, length):
+        """Return length bytes of the file, starting at offset. Less bytes
+        are returned if the end of the file is reached. For a memory mapped
+        file, this is a memoryview of the data, instead of a copy."""
+        if self._mmap is None and self.file.closed:
+            self._reopen()
+        if self._mmap is not None:
+            if sys.version_info >= (3,):
+                return memoryview(self._mmap)[offset:offset + length]
+            return self._mmap[offset:offset + length]
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def _check_writable(self):
+        if self.readonly:
+            raise IOError("Region file %s is opened read-only" % self.filename)
+
     def _init_file(self):
         """Initialise the file header. This will erase any data previously in the file."""
         header_length = 2*SECTOR_LENGTH
@@ -302,8 +616,10 @@ class RegionFile(object):
         self.file.seek(0)
         self.file.write(header_length*b'\x00')
         self.size = header_length
+        self._sector_map = None
 
     def _init_header(self):
+        self._sector_map = None
         for x in range(32):
             for z in range(32):
                 self.metadata[x,z] = ChunkMetadata(x, z)
@@ -313,6 +629,7 @@ class RegionFile(object):
         # update the file size, needed when parse_header is called after
         # we have unlinked a chunk or writed a new one
         self.size = self.get_size()
+        self._sector_map = None
 
         if self.size == 0:
             # Some region files seems to have 0 bytes of size, and
@@ -322,16 +639,14 @@ class RegionFile(object):
         elif self.size < 2*SECTOR_LENGTH:
             raise NoRegionHeader('The region file is %d bytes, too small in size to have a header.' % self.size)
         
-        for index in range(0, SECTOR_LENGTH, 4):
-            x = int(index//4) % 32
-            z = int(index//4)//32
-            m = self.metadata[x, z]
-            
-            self.file.seek(index)
-            offset, length = unpack(">IB", b"\0" + self.file.read(4))
+        header = self._read_at(0, 2*SECTOR_LENGTH)
+        locations = _HEADER_FORMAT.unpack_from(header, 0)
+        timestamps = _HEADER_FORMAT.unpack_from(header, SECTOR_LENGTH)
+        for i in range(1024):
+            m = self.metadata[i % 32, i // 32]
+            offset, length = locations[i] >> 8, locations[i] & 0xFF
             m.blockstart, m.blocklength = offset, length
-            self.file.seek(index + SECTOR_LENGTH)
-            m.timestamp = unpack(">I", self.file.read(4))[0]
+            m.timestamp = timestamps[i]
             
             if offset == 0 and length == 0:
                 m.status = STATUS_CHUNK_NOT_CREATED
@@ -356,30 +671,53 @@ class RegionFile(object):
                         m.status = STATUS_CHUNK_OVERLAPPING
 
     def _parse_chunk_headers(self):
-        for x in range(32):
-            for z in range(32):
-                m = self.metadata[x, z]
-                if m.status not in (STATUS_CHUNK_OK, STATUS_CHUNK_OVERLAPPING, \
-                                    STATUS_CHUNK_MISMATCHED_LENGTHS):
-                    # skip to next if status is NOT_CREATED, OUT_OF_FILE, IN_HEADER,
-                    # ZERO_LENGTH or anything else.
-                    continue
-                try:
-                    self.file.seek(m.blockstart*SECTOR_LENGTH) # offset comes in sectors of 4096 bytes
-                    length = unpack(">I", self.file.read(4))
-                    m.length = length[0] # unpack always returns a tuple, even unpacking one element
-                    compression = unpack(">B",self.file.read(1))
-                    m.compression = compression[0]
-                except IOError:
-                    m.status = STATUS_CHUNK_OUT_OF_FILE
-                    continue
-                if m.blockstart*SECTOR_LENGTH + m.length + 4 > self.size:
-                    m.status = STATUS_CHUNK_OUT_OF_FILE
-                elif m.length <= 1: # chunk can't be zero length
-                    m.status = STATUS_CHUNK_ZERO_LENGTH
-                elif m.length + 4 > m.blocklength * SECTOR_LENGTH:
-                    # There are not enough sectors allocated for the whole block
-                    m.status = STATUS_CHUNK_MISMATCHED_LENGTHS
+        chunks = []
+        for m in self.metadata.values():
+            if m.status not in (STATUS_CHUNK_OK, STATUS_CHUNK_OVERLAPPING, \
+                                STATUS_CHUNK_MISMATCHED_LENGTHS):
+                # skip to next if status is NOT_CREATED, OUT_OF_FILE, IN_HEADER,
+                # ZERO_LENGTH or anything else.
+                continue
+            chunks.append(m)
+        # Read the chunk headers in file order, with one read for each run
+        # of chunks that are close to each other.
+        chunks.sort(key=lambda m: m.blockstart)
+        i = 0
+        while i < len(chunks):
+            start = chunks[i].blockstart*SECTOR_LENGTH # offset comes in sectors of 4096 bytes
+            j = i + 1
+            while j < len(chunks) and \
+                    chunks[j].blockstart*SECTOR_LENGTH + 5 - start <= _MAX_COALESCED_READ:
+                j += 1
+            run = chunks[i:j]
+            try:
+                data = self._read_at(start, run[-1].blockstart*SECTOR_LENGTH + 5 - start)
+            except IOError:
+                data = None
+            for m in run:
+                self._parse_chunk_header(m, data, start)
+            i = j
+
+    def _parse_chunk_header(self, m, data, start):
+        """Set the length and compression of a chunk from its header, which
+        is read from data at the position of the chunk relative to start.
+        If data is None, the header is read from file instead."""
+        position = m.blockstart*SECTOR_LENGTH
+        try:
+            if data is None:
+                data = self._read_at(position, 5)
+                start = position
+            m.length, m.compression = _CHUNK_HEADER_FORMAT.unpack_from(data, position - start)
+        except (IOError, StructError):
+            m.status = STATUS_CHUNK_OUT_OF_FILE
+            return
+        if m.blockstart*SECTOR_LENGTH + m.length + 4 > self.size:
+            m.status = STATUS_CHUNK_OUT_OF_FILE
+        elif m.length <= 1: # chunk can't be zero length
+            m.status = STATUS_CHUNK_ZERO_LENGTH
+        elif m.length + 4 > m.blocklength * SECTOR_LENGTH:
+            # There are not enough sectors allocated for the whole block
+            m.status = STATUS_CHUNK_MISMATCHED_LENGTHS
 
     def _sectors(self, ignore_chunk=None):
         """
@@ -401,6 +739,26 @@ class RegionFile(object):
                     sectors[b].append(m)
         return sectors
 
+    def _get_sector_map(self):
+        """
+        Return the map of used sectors, with the same sectors as _sectors().
+        The map is built on first use, and kept up to date by
+        write_blockdata() and unlink_chunk().
+        """
+        if self._sector_map is None:
+            sectorsize = self._bytes_to_sector(self.size)
+            sectormap = _SectorMap(sectorsize)
+            for m in self.metadata.values():
+                if m.is_created() and m.blocklength and m.blockstart:
+                    blockend = m.blockstart + max(m.blocklength, m.requiredblocks())
+                    if blockend > sectorsize:
+                        # Sectors beyond the end of the file are free
+                        sectormap.clipped = True
+                        blockend = sectorsize
+                    sectormap.add((m.x, m.z), max(m.blockstart, 2), max(blockend, 2))
+            self._sector_map = sectormap
+        return self._sector_map
+
     def _locate_free_sectors(self, ignore_chunk=None):
         """Return a list of booleans, indicating the free sectors."""
         sectors = self._sectors(ignore_chunk=ignore_chunk)
@@ -510,21 +868,58 @@ class RegionFile(object):
         """
         return self.metadata[x,z].timestamp
 
-    def chunk_count(self):
-        """Return the number of defined chunks. This includes potentially corrupt chunks."""
-        return len(self.get_metadata())
+    def get_manifest(self, checksum=None):
+        """
+        Return a dictionary of (timestamp, blockstart, length, checksum)
+        tuples by chunk x,z, for each chunk that is defined in the region
+        file. Pass a tuple to is_changed() later to find out if the chunk
+        was written since.
+        If checksum is a name in CHECKSUMS, the compressed data of each chunk
+        is read to compute its checksum. Otherwise, or if the data of a chunk
+        can not be read, the checksum in the tuple is None.
+        """
+        if checksum is not None and checksum not in CHECKSUMS:
+            raise ValueError("Unknown checksum %r. Choose from: %s" % (checksum, ", ".join(sorted(CHECKSUMS))))
+        return dict(((m.x, m.z), (m.timestamp, m.blockstart, m.length, self._checksum(m, checksum))) \
+                    for m in self.get_metadata())
+
+    def _checksum(self, m, checksum):
+        """Return the checksum of the compressed data of the chunk with
+        metadata m, or None."""
+        if checksum is None:
+            return None
+        try:
+            self._check_chunk(m)
+        except RegionFileFormatError:
+            return None
+        return CHECKSUMS[checksum](self._get_rawdata(m))
 
-    def get_blockdata(self, x, z):
+    def is_changed(self, x, z, entry, checksum=None):
         """
-        Return the decompressed binary data representing a chunk.
-        
-        May raise a RegionFileFormatError().
-        If decompression of the data succeeds, all available data is returned, 
-        even if it is shorter than what is specified in the header (e.g. in case
-        of a truncated while and non-compressed data).
+        Return True if chunk x,z is defined and differs from entry, a tuple
+        from get_manifest(), or if entry is None. The timestamp, location and
+        length are compared first. Timestamps are in seconds, so a chunk that
+        is written twice in the same second to the same sectors is only
+        detected if the entry has a checksum, computed with the given checksum
+        name; this reads the compressed data of the chunk.
         """
-        # read metadata block
         m = self.metadata[x, z]
+        if not m.is_created():
+            return False
+        if entry is None or tuple(entry[:3]) != (m.timestamp, m.blockstart, m.length):
+            return True
+        if checksum is None or entry[3] is None:
+            return False
+        return self._checksum(m, checksum) != entry[3]
+
+    def chunk_count(self):
+        """Return the number of defined chunks. This includes potentially corrupt chunks."""
+        return len(self.get_metadata())
+
+    def _check_chunk(self, m):
+        """Raise a RegionFileFormatError if the header of the chunk with metadata m
+        shows that its data can not be read."""
+        x, z = m.x, m.z
         if m.status == STATUS_CHUNK_NOT_CREATED:
             raise InconceivedChunk("Chunk %d,%d is not present in region" % (x,z))
         elif m.status == STATUS_CHUNK_IN_HEADER:
@@ -540,6 +935,19 @@ class RegionFile(object):
         elif m.blockstart * SECTOR_LENGTH + 5 >= self.size:
             raise RegionHeaderError('Chunk %d,%d is partially/completely outside the file' % (x,z))
 
+    def get_blockdata(self, x, z):
+        """
+        Return the decompressed binary data representing a chunk.
+        
+        May raise a RegionFileFormatError().
+        If decompression of the data succeeds, all available data is returned, 
+        even if it is shorter than what is specified in the header (e.g. in case
+        of a truncated while and non-compressed data).
+        """
+        # read metadata block
+        m = self.metadata[x, z]
+        self._check_chunk(m)
+
         # status is STATUS_CHUNK_OK, STATUS_CHUNK_MISMATCHED_LENGTHS, STATUS_CHUNK_OVERLAPPING
         # or STATUS_CHUNK_OUT_OF_FILE.
         # The chunk is always read, but in case of an error, the exception may be different 
@@ -548,11 +956,10 @@ class RegionFile(object):
         err = None
         try:
             # offset comes in sectors of 4096 bytes + length bytes + compression byte
-            self.file.seek(m.blockstart * SECTOR_LENGTH + 5)
             # Do not read past the length of the file.
             # The length in the file includes the compression byte, hence the -1.
             length = min(m.length - 1, self.size - (m.blockstart * SECTOR_LENGTH + 5))
-            chunk = self.file.read(length)
+            chunk = self._read_at(m.blockstart * SECTOR_LENGTH + 5, length)
             
             if (m.compression == COMPRESSION_GZIP):
                 # Python 3.1 and earlier do not yet support gzip.decompress(chunk)
@@ -561,7 +968,10 @@ class RegionFile(object):
                 f.close()
             elif (m.compression == COMPRESSION_ZLIB):
                 chunk = zlib.decompress(chunk)
-            elif m.compression != COMPRESSION_NONE:
+            elif m.compression == COMPRESSION_NONE:
+                # Do not return a view of the memory mapped file
+                chunk = bytes(chunk)
+            else:
                 raise ChunkDataError('Unknown chunk compression/format (%s)' % m.compression)
             
             return chunk
@@ -582,17 +992,24 @@ class RegionFile(object):
             else:
                 raise ChunkDataError(err)
 
-    def get_nbt(self, x, z):
+    def get_nbt(self, x, z, parser=None):
         """
         Return a NBTFile of the specified chunk.
         Raise InconceivedChunk if the chunk is not included in the file.
+        parser overrides the default NBT parser of this region file.
         """
-        # TODO: cache results?
+        use_cache = self.cache is not None and parser in (None, self.parser)
+        if use_cache:
+            key = self._cache_key(x, z)
+            nbt = self.cache.get(key)
+            if nbt is not None:
+                return nbt
         data = self.get_blockdata(x, z) # This may raise a RegionFileFormatError.
-        data = BytesIO(data)
         err = None
         try:
-            nbt = NBTFile(buffer=data)
+            nbt = NBTFile(buffer=data, parser=parser or self.parser)
+            if use_cache:
+                self.cache.put(key, nbt, len(data))
             if self.loc.x != None:
                 x += self.loc.x*32
             if self.loc.z != None:
@@ -615,113 +1032,276 @@ class RegionFile(object):
         """
         return self.get_nbt(x, z)
 
-    def write_blockdata(self, x, z, data, compression=COMPRESSION_ZLIB):
-        """
-        Compress the data, write it to file, and add pointers in the header so it 
-        can be found as chunk(x,z).
-        """
+    def _cache_key(self, x, z):
+        """Return the key of chunk x,z in the chunk cache."""
+        return (self.filename or id(self), x, z)
+
+    def _compression_policy(self, compression, level, strategy):
+        """Return the (compression, level, strategy) to write a chunk with,
+        taking the attributes of the region file for arguments that are None."""
+        if compression is None:
+            compression = self.compression
+        if level is None:
+            level = self.compression_level
+        if strategy is None:
+            strategy = self.compression_strategy
+        return compression, level, strategy
+
+    @staticmethod
+    def _compressor(compression, level=zlib.Z_DEFAULT_COMPRESSION, strategy=zlib.Z_DEFAULT_STRATEGY):
+        """Return a zlib compressobj for the given compression type, or None
+        for COMPRESSION_NONE."""
         if compression == COMPRESSION_GZIP:
-            # Python 3.1 and earlier do not yet support `data = gzip.compress(data)`.
-            compressed_file = BytesIO()
-            f = gzip.GzipFile(fileobj=compressed_file)
-            f.write(data)
-            f.close()
-            compressed_file.seek(0)
-            data = compressed_file.read()
-            del compressed_file
+            wbits = 16 + zlib.MAX_WBITS # gzip header and trailer
         elif compression == COMPRESSION_ZLIB:
-            data = zlib.compress(data) # use zlib compression, rather than Gzip
-        elif compression != COMPRESSION_NONE:
+            wbits = zlib.MAX_WBITS
+        elif compression == COMPRESSION_NONE:
+            return None
+        else:
             raise ValueError("Unknown compression type %d" % compression)
-        length = len(data)
-
+        return zlib.compressobj(level, zlib.DEFLATED, wbits, zlib.DEF_MEM_LEVEL, strategy)
+
+    @classmethod
+    def _compress(cls, data, compression, level=zlib.Z_DEFAULT_COMPRESSION, strategy=zlib.Z_DEFAULT_STRATEGY):
+        """Return data compressed with the given compression type."""
+        compressor = cls._compressor(compression, level, strategy)
+        if compressor is None:
+            return bytes(data) # e.g. a bytearray from NBTFile.render()
+        return compressor.compress(bytes(data)) + compressor.flush()
+
+    def _required_sectors(self, data):
+        """Return the number of sectors for compressed chunk data."""
         # 5 extra bytes are required for the chunk block header
-        nsectors = self._bytes_to_sector(length + 5)
-
+        nsectors = self._bytes_to_sector(len(data) + 5)
         if nsectors >= 256:
             raise ChunkDataError("Chunk is too large (%d sectors exceeds 255 maximum)" % (nsectors))
+        return nsectors
+
+    def write_blockdata(self, x, z, data, compression=None, level=None, strategy=None):
+        """
+        Compress the data, write it to file, and add pointers in the header so it 
+        can be found as chunk(x,z).
+        compression, level and strategy default to the compression,
+        compression_level and compression_strategy attributes.
+        """
+        compression, level, strategy = self._compression_policy(compression, level, strategy)
+        self._store_blockdata(x, z, self._compress(data, compression, level, strategy), compression)
+
+    def _store_blockdata(self, x, z, data, compression, timestamp=None):
+        """Write compressed data of a chunk, or add it to the current batch."""
+        self._check_writable()
+        self._required_sectors(data)
+        if self._batch is not None:
+            self._batch.pop((x, z), None)
+            self._batch[x, z] = (data, compression, timestamp)
+        else:
+            self._write_blocks({(x, z): (data, compression, timestamp)})
+
+    def write_many(self, chunks, compression=None, level=None, strategy=None):
+        """
+        Compress and write the data of many chunks at once. chunks is a
+        dictionary of uncompressed data by chunk x,z. Sectors are allocated
+        for all chunks before writing, the data is written in order of its
+        location in the file, and the header is written once.
+        compression, level and strategy are as for write_blockdata().
+        """
+        self._check_writable()
+        compression, level, strategy = self._compression_policy(compression, level, strategy)
+        blocks = OrderedDict()
+        for (x, z), data in chunks.items():
+            blocks[x, z] = (self._compress(data, compression, level, strategy), compression, None)
+        self._write_blocks(blocks)
+
+    @contextmanager
+    def batch(self):
+        """
+        Return a context manager that collects the chunks written with
+        write_blockdata() or write_chunk(), and writes them at once at the
+        end of the with block, like write_many(). Chunks written in the batch
+        can not be read before the end of the with block. If the with block
+        raises an exception, the collected chunks are not written.
+        """
+        if self._batch is not None:
+            # Nested batch: write with the outer batch
+            yield self
+            return
+        self._batch = OrderedDict()
+        try:
+            yield self
+            blocks = self._batch
+        finally:
+            self._batch = None
+        self._write_blocks(blocks)
+
+    def _write_blocks(self, blocks):
+        """
+        Write compressed chunk data. blocks is a dictionary of
+        (data, compression, timestamp) tuples by chunk x,z. If timestamp is
+        None, the current time is used.
+        """
+        if not blocks:
+            return
+        self._reopen()
+        if self.cache is not None:
+            # Also drops chunks that were read again during a batch
+            for x, z in blocks:
+                self.cache.invalidate(self._cache_key(x, z))
+        nsectors = dict((key, self._required_sectors(block[0])) for key, block in blocks.items())
 
         # Ensure file has a header
         if self.size < 2*SECTOR_LENGTH:
             self._init_file()
 
-        # search for a place where to write the chunk:
-        current = self.metadata[x, z]
-        free_sectors = self._locate_free_sectors(ignore_chunk=current)
-        sector = self._find_free_location(free_sectors, nsectors, preferred=current.blockstart)
-
-        # If file is smaller than sector*SECTOR_LENGTH (it was truncated), pad it with zeroes.
-        if self.size < sector*SECTOR_LENGTH:
-            # jump to end of file
-            self.file.seek(0, SEEK_END)
-            self.file.write((sector*SECTOR_LENGTH - self.size) * b"\x00")
-            assert self.file.tell() == sector*SECTOR_LENGTH
-
-        # write out chunk to region
-        self.file.seek(sector*SECTOR_LENGTH)
-        self.file.write(pack(">I", length + 1)) #length field
-        self.file.write(pack(">B", compression)) #compression field
-        self.file.write(data) #compressed data
-
-        # Write zeros up to the end of the chunk
-        remaining_length = SECTOR_LENGTH * nsectors - length - 5
-        self.file.write(remaining_length * b"\x00")
-
-        #seek to header record and write offset and length records
-        self.file.seek(4 * (x + 32*z))
-        self.file.write(pack(">IB", sector, nsectors)[1:])
+        # search for a place where to write the chunks. Chunks that still
+        # fit in their current location stay there.
+        sectormap = self._get_sector_map()
+        for key in blocks:
+            sectormap.remove(key)
+        sectors = {}
+        for key in blocks:
+            preferred = self.metadata[key].blockstart
+            if preferred and sectormap.fits(preferred, nsectors[key]):
+                sectors[key] = preferred
+                sectormap.add(key, preferred, preferred + nsectors[key])
+        for key in blocks:
+            if key not in sectors:
+                sectors[key] = sectormap.find(nsectors[key], allocation=self.allocation)
+                sectormap.add(key, sectors[key], sectors[key] + nsectors[key])
+
+        # write out chunks to region, in order of location, with a single
+        # write for adjacent chunks.
+        oldsize = self.size
+        runs = []
+        for key in sorted(blocks, key=lambda key: sectors[key]):
+            data, compression, timestamp = blocks[key]
+            sector = sectors[key]
+            parts = [pack(">IB", len(data) + 1, compression), data,
+                     (SECTOR_LENGTH * nsectors[key] - len(data) - 5) * b"\x00"]
+            if runs and runs[-1][1] == sector:
+                runs[-1][1] += nsectors[key]
+                runs[-1][2].extend(parts)
+            else:
+                runs.append([sector, sector + nsectors[key], parts])
+        for sector, end, parts in runs:
+            if self.size < sector*SECTOR_LENGTH:
+                # File is smaller than sector*SECTOR_LENGTH (it was truncated), pad it with zeroes.
+                parts.insert(0, (sector*SECTOR_LENGTH - self.size) * b"\x00")
+                self.file.seek(self.size)
+            else:
+                self.file.seek(sector*SECTOR_LENGTH)
+            self.file.write(b"".join(parts))
+            self.size = max(end*SECTOR_LENGTH, self.size)
 
-        #write timestamp
-        self.file.seek(SECTOR_LENGTH + 4 * (x + 32*z))
-        timestamp = int(time.time())
-        self.file.write(pack(">I", timestamp))
-
-        # Update free_sectors with newly written block
-        # This is required for calculating file truncation and zeroing freed blocks.
-        free_sectors.extend((sector + nsectors - len(free_sectors)) * [True])
-        for s in range(sector, sector + nsectors):
-            free_sectors[s] = False
-        
         # Check if file should be truncated:
-        truncate_count = list(reversed(free_sectors)).index(False)
+        truncate_count = sectormap.trailing_free()
         if truncate_count > 0:
-            self.size = SECTOR_LENGTH * (len(free_sectors) - truncate_count)
+            sectormap.resize(len(sectormap) - truncate_count)
+            self.size = SECTOR_LENGTH * len(sectormap)
             self.file.truncate(self.size)
-            free_sectors = free_sectors[:-truncate_count]
-        
+
         # Calculate freed sectors
-        for s in range(current.blockstart, min(current.blockstart + current.blocklength, len(free_sectors))):
-            if free_sectors[s]:
-                # zero sector s
-                self.file.seek(SECTOR_LENGTH*s)
-                self.file.write(SECTOR_LENGTH*b'\x00')
-        
-        # update file size and header information
-        self.size = max((sector + nsectors)*SECTOR_LENGTH, self.size)
+        freed = set()
+        for key in blocks:
+            current = self.metadata[key]
+            for s in range(current.blockstart, min(current.blockstart + current.blocklength, len(sectormap))):
+                if sectormap.is_free(s):
+                    freed.add(s)
+        freed = sorted(freed)
+        while freed:
+            # zero the run of sectors starting at freed[0]
+            count = 1
+            while count < len(freed) and freed[count] == freed[0] + count:
+                count += 1
+            self.file.seek(SECTOR_LENGTH*freed[0])
+            self.file.write(count*SECTOR_LENGTH*b'\x00')
+            del freed[:count]
+
+        # update header information, and write the header
+        now = int(time.time())
+        for key, (data, compression, timestamp) in blocks.items():
+            current = self.metadata[key]
+            current.blockstart = sectors[key]
+            current.blocklength = nsectors[key]
+            current.status = STATUS_CHUNK_OK
+            current.timestamp = now if timestamp is None else timestamp
+            current.length = len(data) + 1
+            current.compression = compression
+        if len(blocks) == 1:
+            for x, z in blocks:
+                self._write_header_entry(x, z)
+        else:
+            self._write_header()
         assert self.get_size() == self.size
-        current.blockstart = sector
-        current.blocklength = nsectors
-        current.status = STATUS_CHUNK_OK
-        current.timestamp = timestamp
-        current.length = length + 1
-        current.compression = COMPRESSION_ZLIB
 
-        # self.parse_header()
-        # self.parse_chunk_headers()
+        if sectormap.clipped and self.size > oldsize:
+            # Chunks beyond the old end of the file now use sectors in the file
+            self._sector_map = None
+
+    def _write_header_entry(self, x, z):
+        """Write the location and timestamp of chunk x,z to the header."""
+        m = self.metadata[x, z]
+        self.file.seek(4 * (x + 32*z))
+        self.file.write(pack(">IB", m.blockstart, m.blocklength)[1:])
+        self.file.seek(SECTOR_LENGTH + 4 * (x + 32*z))
+        self.file.write(pack(">I", m.timestamp))
+
+    def _write_header(self):
+        """Write the location and timestamp of all chunks to the header."""
+        locations = [0] * 1024
+        timestamps = [0] * 1024
+        for (x, z), m in self.metadata.items():
+            locations[x + 32*z] = m.blockstart << 8 | m.blocklength
+            timestamps[x + 32*z] = m.timestamp
+        self.file.seek(0)
+        self.file.write(_HEADER_FORMAT.pack(*locations) + _HEADER_FORMAT.pack(*timestamps))
 
-    def write_chunk(self, x, z, nbt_file):
+    def write_chunk(self, x, z, nbt_file, compression=None, level=None, strategy=None):
         """
         Pack the NBT file as binary data, and write to file in a compressed format.
+        The data is compressed while it is rendered, so the uncompressed data is
+        not kept in memory, and rendering stops as soon as the chunk is too large.
+        compression, level and strategy are as for write_blockdata().
         """
-        data = BytesIO()
-        nbt_file.write_file(buffer=data) # render to buffer; uncompressed
-        self.write_blockdata(x, z, data.getvalue())
+        compression, level, strategy = self._compression_policy(compression, level, strategy)
+        compressor = self._compressor(compression, level, strategy)
+        parts = []
+        maxsize = 255 * SECTOR_LENGTH - 5
+        def spool(data):
+            # Python 2 zlib rejects a bytearray
+            parts.append(bytes(data) if compressor is None else compressor.compress(bytes(data)))
+            # Stop early rather than compress the rest of a chunk that can not be stored
+            if sum(len(part) for part in parts) > maxsize:
+                raise ChunkDataError("Chunk is too large (more than 255 sectors)")
+        spool(nbt_file.render(spool))
+        if compressor is not None:
+            parts.append(compressor.flush())
+        self._store_blockdata(x, z, b"".join(parts), compression)
+
+    def copy_chunk_raw(self, src_region, sx, sz, dx, dz):
+        """
+        Copy chunk sx,sz of src_region to chunk dx,dz of this region file,
+        without decompressing it. The compressed data, compression type and
+        timestamp are copied as is. The NBT data is not changed, so copying a
+        chunk to other coordinates leaves the old coordinates in its data.
+
+        May raise a RegionFileFormatError if the chunk can not be read from
+        src_region. The compressed data itself is not checked.
+        """
+        m = src_region.metadata[sx, sz]
+        src_region._check_chunk(m)
+        if m.compression not in (COMPRESSION_GZIP, COMPRESSION_ZLIB, COMPRESSION_NONE):
+            raise ChunkDataError('Unknown chunk compression/format (%s)' % m.compression)
+        self._store_blockdata(dx, dz, src_region._get_rawdata(m), m.compression, m.timestamp)
 
     def unlink_chunk(self, x, z):
         """
         Remove a chunk from the header of the region file.
         Fragmentation is not a problem, chunks are written to free sectors when possible.
         """
+        self._check_writable()
+        self._reopen()
+        if self.cache is not None:
+            self.cache.invalidate(self._cache_key(x, z))
         # This function fails for an empty file. If that is the case, just return.
         if self.size < 2*SECTOR_LENGTH:
             return
@@ -734,16 +1314,17 @@ class RegionFile(object):
 
         # Check if file should be truncated:
         current = self.metadata[x, z]
-        free_sectors = self._locate_free_sectors(ignore_chunk=current)
-        truncate_count = list(reversed(free_sectors)).index(False)
+        sectormap = self._get_sector_map()
+        sectormap.remove((x, z))
+        truncate_count = sectormap.trailing_free()
         if truncate_count > 0:
-            self.size = SECTOR_LENGTH * (len(free_sectors) - truncate_count)
+            sectormap.resize(len(sectormap) - truncate_count)
+            self.size = SECTOR_LENGTH * len(sectormap)
             self.file.truncate(self.size)
-            free_sectors = free_sectors[:-truncate_count]
         
         # Calculate freed sectors
-        for s in range(current.blockstart, min(current.blockstart + current.blocklength, len(free_sectors))):
-            if free_sectors[s]:
+        for s in range(current.blockstart, min(current.blockstart + current.blocklength, len(sectormap))):
+            if sectormap.is_free(s):
                 # zero sector s
                 self.file.seek(SECTOR_LENGTH*s)
                 self.file.write(SECTOR_LENGTH*b'\x00')
@@ -751,6 +1332,82 @@ class RegionFile(object):
         # update the header
         self.metadata[x, z] = ChunkMetadata(x, z)
 
+    def _get_rawdata(self, m):
+        """Return the data of the chunk with metadata m as stored in the
+        file, without decompressing it."""
+        # Do not read past the length of the file.
+        length = min(m.length - 1, self.size - (m.blockstart * SECTOR_LENGTH + 5))
+        return bytes(self._read_at(m.blockstart * SECTOR_LENGTH + 5, length))
+
+    def compact(self, order=None):
+        """
+        Rewrite the region file without unused sectors, and return the number
+        of bytes reclaimed.
+
+        The chunks are written to a new file in the same directory, which
+        replaces the region file when it is complete, so the region file is
+        never partially compacted. The compressed data of the chunks is
+        copied without decompressing it. Chunks that can not be read are not
+        copied. By default the chunks keep their order in the file. If order
+        is 'zcurve' or 'hilbert', the chunks are ordered along that
+        space-filling curve instead.
+        The region file must be opened by filename.
+        """
+        self._check_writable()
+        if not self._closefile:
+            raise ValueError("compact() requires a region file opened by filename")
+        self._reopen()
+        if order in _CURVE_KEYS:
+            curve_key = _CURVE_KEYS[order]
+            sortkey = lambda m: curve_key(m.x, m.z)
+        elif order in (None, 'disk'):
+            sortkey = lambda m: m.blockstart
+        else:
+            raise ValueError("Unknown order %r" % (order,))
+        chunks = [m for m in self.get_metadata() if m.status in \
+                  (STATUS_CHUNK_OK, STATUS_CHUNK_OVERLAPPING, STATUS_CHUNK_MISMATCHED_LENGTHS)]
+        chunks.sort(key=sortkey)
+
+        oldsize = self.size
+        locations = [0] * 1024
+        timestamps = [0] * 1024
+        directory, basename = os.path.split(os.path.abspath(self.filename))
+        fd, tempname = tempfile.mkstemp(prefix=basename + '.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(2*SECTOR_LENGTH*b'\x00')
+                sector = 2
+                for m in chunks:
+                    data = self._get_rawdata(m)
+                    nsectors = self._bytes_to_sector(len(data) + 5)
+                    if nsectors >= 256:
+                        continue
+                    f.write(pack(">IB", len(data) + 1, m.compression))
+                    f.write(data)
+                    f.write((SECTOR_LENGTH * nsectors - len(data) - 5) * b"\x00")
+                    locations[m.x + 32*m.z] = sector << 8 | nsectors
+                    timestamps[m.x + 32*m.z] = m.timestamp
+                    sector += nsectors
+                f.seek(0)
+                f.write(_HEADER_FORMAT.pack(*locations) + _HEADER_FORMAT.pack(*timestamps))
+                f.flush()
+                os.fsync(f.fileno())
+            shutil.copymode(self.filename, tempname)
+            self.close()
+            # os.replace() is atomic, also on Windows; Python 2 only has os.rename().
+            getattr(os, 'replace', os.rename)(tempname, self.filename)
+        except BaseException:
+            if os.path.exists(tempname):
+                os.remove(tempname)
+            raise
+        finally:
+            if self.file.closed:
+                self._open_file(self.filename, False)
+        self._init_header()
+        self._parse_header()
+        self._parse_chunk_headers()
+        return oldsize - self.size
+
     def _classname(self):
         """Return the fully qualified class name."""
         if self.__class__.__module__ in (None,):
@@ -6,9 +6,18 @@ https://minecraft.gamepedia.com/Level_format
 """
 
 import os, glob, re
+import json
+from collections import OrderedDict
+from functools import reduce
+try:
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+except ImportError:
+    # Python 2 without the futures backport: work in the current process
+    ProcessPoolExecutor = None
 from . import region
 from . import chunk
-from .region import InconceivedChunk, Location
+from .region import InconceivedChunk, Location, _CURVE_KEYS
+from .nbt import PARSER_STREAM
 
 class UnknownWorldFormat(Exception):
     """Unknown or invalid world folder."""
@@ -16,6 +25,80 @@ class UnknownWorldFormat(Exception):
         self.msg = msg
 
 
+ORDERS = (None, 'disk', 'zcurve', 'hilbert')
+"""Valid values of the order argument of the iteration methods of WorldFolder.
+None is the order of the region files and region header, 'disk' the order of
+the chunk data in each region file, and 'zcurve' and 'hilbert' the order of
+chunk coordinates along a Z-order or Hilbert space-filling curve."""
+
+
+def _check_order(order):
+    if order not in ORDERS:
+        raise ValueError("Unknown order %r. Choose from: %s" % (order, ", ".join(map(repr, ORDERS))))
+
+def _iter_nbt(regionfile, boundingbox=None, order=None, since=None):
+    """
+    Yield each readable NBT in the region file. If a boundingbox is given,
+    chunks outside the bounding box are skipped based on the region header,
+    without reading their data. See ORDERS for the valid values of order.
+    If since is a ChunkManifest, chunks that did not change are skipped.
+    """
+    rx, rz = regionfile.loc.x or 0, regionfile.loc.z or 0
+    metadata = regionfile.get_metadata()
+    if order == 'disk':
+        metadata.sort(key=lambda m: m.blockstart)
+    elif order in _CURVE_KEYS:
+        curve_key = _CURVE_KEYS[order]
+        metadata.sort(key=lambda m: curve_key(32*rx + m.x, 32*rz + m.z))
+    for m in metadata:
+        if boundingbox is not None and \
+                not boundingbox.contains(32*rx + m.x, None, 32*rz + m.z):
+            continue
+        if since is not None and not since._is_changed(regionfile, rx, rz, m.x, m.z):
+            continue
+        try:
+            yield regionfile.get_nbt(m.x, m.z)
+        except region.RegionFileFormatError:
+            pass
+
+
+# Functions called in worker processes by call_for_each_region() and
+# call_for_each_nbt(). They must be defined at module level to be pickled.
+
+def _reduce_results(results, reducer):
+    """Return results, combined to a single result if a reducer is given."""
+    if reducer is None or len(results) < 2:
+        return results
+    return [reduce(reducer, results)]
+
+def _call_for_region(callback_function, filename, x, z, chunkclass, parser, reducer, boundingbox):
+    """Call callback_function for the region file, and return a list with the result."""
+    regionfile = region.RegionFile(filename, chunkclass=chunkclass, parser=parser)
+    regionfile.loc = Location(x=x, z=z)
+    try:
+        return [callback_function(regionfile)]
+    finally:
+        regionfile.close()
+
+def _call_for_nbt(callback_function, filename, x, z, chunkclass, parser, reducer, boundingbox):
+    """Call callback_function for each NBT in the region file, and return a
+    list with the results."""
+    regionfile = region.RegionFile(filename, chunkclass=chunkclass, parser=parser)
+    regionfile.loc = Location(x=x, z=z)
+    try:
+        results = [callback_function(nbt) for nbt in _iter_nbt(regionfile, boundingbox)]
+    finally:
+        regionfile.close()
+    return _reduce_results(results, reducer)
+
+def _call_for_batch(worker, callback_function, tasks, reducer, boundingbox):
+    """Call worker for each region in tasks, and return a list with all results."""
+    results = []
+    for task in tasks:
+        results.extend(worker(callback_function, *task, reducer=reducer, boundingbox=boundingbox))
+    return _reduce_results(results, reducer)
+
+
 class _BaseWorldFolder(object):
     """
     Abstract class, representing either a McRegion or Anvil world folder.
@@ -26,11 +109,42 @@ class _BaseWorldFolder(object):
     extension = ''
     chunkclass = chunk.Chunk
 
-    def __init__(self, world_folder):
-        """Initialize a WorldFolder."""
+    def __init__(self, world_folder, parser=PARSER_STREAM, max_open_regions=64, \
+                 max_cached_regions=1024, chunk_cache_size=None):
+        """
+        Initialize a WorldFolder.
+        parser is the NBT parser used for chunks; see :class:`nbt.nbt.NBTFile`.
+
+        Region files returned by get_region() are cached. At most
+        max_open_regions of them keep their file open; the least recently
+        used region file is closed, but keeps its metadata, and is opened
+        again when needed. At most max_cached_regions region files are
+        cached. None means no limit.
+
+        If chunk_cache_size is given, get_nbt() and get_chunk() keep recently
+        read chunks in a :class:`nbt.region.ChunkCache` of that many bytes of
+        uncompressed NBT data, available as the chunk_cache attribute.
+        Changes to a cached NBT are visible to the next reader.
+        """
         self.worldfolder = world_folder
+        self.parser = parser
+        self.max_open_regions = max_open_regions
+        self.max_cached_regions = max_cached_regions
         self.regionfiles = {}
-        self.regions     = {}
+        self.regions     = OrderedDict()
+        """Cached RegionFile objects, least recently used first."""
+        self._open_regions = OrderedDict()
+        self._pinned = {}
+        """Number of iterations in progress over each cached region file,
+        by region x,z. These region files are not closed by get_region()."""
+        self.region_hits = 0
+        """Number of calls to get_region() for a cached region file."""
+        self.region_misses = 0
+        """Number of calls to get_region() that opened a new region file."""
+        self.chunk_cache = None
+        """Optional :class:`nbt.region.ChunkCache` of the chunks of get_nbt()."""
+        if chunk_cache_size is not None:
+            self.chunk_cache = region.ChunkCache(chunk_cache_size)
         self.chunks  = None
         # os.listdir triggers an OSError for non-existant directories or permission errors.
         # This is needed, because glob.glob silently returns no files.
@@ -75,35 +189,96 @@ class _BaseWorldFolder(object):
         return len(self.regionfiles) > 0
 
     def get_region(self, x,z):
-        """Get a region using x,z coordinates of a region. Cache results."""
-        if (x,z) not in self.regions:
+        """
+        Get a region using x,z coordinates of a region. Cache results.
+        A region file that is no longer among the most recently used region
+        files may be closed by a later call, and is opened again when it is
+        used; see the max_open_regions and max_cached_regions arguments of
+        the constructor.
+        """
+        if (x,z) in self.regions:
+            self.region_hits += 1
+            # Most recently used region goes last
+            regionfile = self.regions.pop((x,z))
+            regionfile._reopen()
+        else:
+            self.region_misses += 1
             if (x,z) in self.regionfiles:
-                self.regions[(x,z)] = region.RegionFile(self.regionfiles[(x,z)])
+                regionfile = region.RegionFile(self.regionfiles[(x,z)], parser=self.parser, \
+                                               cache=self.chunk_cache)
             else:
                 # Return an empty RegionFile object
                 # TODO: this does not yet allow for saving of the region file
                 # TODO: this currently fails with a ValueError!
                 # TODO: generate the correct name, and create the file
                 # and add the fie to self.regionfiles
-                self.regions[(x,z)] = region.RegionFile()
-            self.regions[(x,z)].loc = Location(x=x,z=z)
-        return self.regions[(x,z)]
-
-    def iter_regions(self):
+                regionfile = region.RegionFile()
+            regionfile.loc = Location(x=x,z=z)
+        self.regions[(x,z)] = regionfile
+        self._open_regions.pop((x,z), None)
+        self._open_regions[(x,z)] = regionfile
+        if self.max_open_regions is not None:
+            for key in self._evictable(self._open_regions, self.max_open_regions, (x,z)):
+                self._open_regions.pop(key).close()
+        if self.max_cached_regions is not None:
+            for key in self._evictable(self.regions, self.max_cached_regions, (x,z)):
+                evicted = self.regions.pop(key)
+                if self._open_regions.pop(key, None) is not None:
+                    evicted.close()
+        return regionfile
+
+    def _evictable(self, regions, limit, keep):
+        """Return the keys of the least recently used regions beyond limit,
+        except keep and the region files that are being iterated over."""
+        excess = len(regions) - max(limit, 1)
+        if excess <= 0:
+            return []
+        keys = [key for key in regions if key != keep and key not in self._pinned]
+        return keys[:excess]
+
+    def close(self):
+        """Close all cached region files."""
+        for regionfile in self._open_regions.values():
+            regionfile.close()
+        self._open_regions.clear()
+        self.regions.clear()
+
+    def _region_coords(self, boundingbox=None, order=None):
+        """Return the x,z coordinates of all region files, or of the region
+        files that overlap with the bounding box, in the given order."""
+        coords = list(self.regionfiles.keys())
+        if boundingbox is not None:
+            coords = [(x, z) for x, z in coords if \
+                      boundingbox.intersects(32*x, 32*x + 31, None, None, 32*z, 32*z + 31)]
+        if order in _CURVE_KEYS:
+            # Each region file is an aligned 32x32 square of chunks, so the
+            # curve passes through all its chunks before the next region.
+            curve_key = _CURVE_KEYS[order]
+            coords.sort(key=lambda xz: curve_key(32*xz[0], 32*xz[1]))
+        return coords
+
+    def iter_regions(self, boundingbox=None, order=None):
         """
         Return an iterable list of all region files. Use this function if you only
         want to loop through each region files once, and do not want to cache the results.
+        If a boundingbox is given, only region files with chunks inside the
+        bounding box are returned. The bounding box is in chunk coordinates.
+        If order is 'zcurve' or 'hilbert', the region files are returned in
+        the order of a space-filling curve. See ORDERS.
         """
-        # TODO: Implement BoundingBox
-        # TODO: Implement sort order
-        for x,z in self.regionfiles.keys():
+        _check_order(order)
+        for x,z in self._region_coords(boundingbox, order):
             close_after_use = False
-            if (x,z) in self.regions:
-                regionfile = self.regions[(x,z)]
+            pinned = (x,z) in self.regions
+            if pinned:
+                regionfile = self.get_region(x,z)
+                # Do not close the region file while it is in use
+                self._pinned[(x,z)] = self._pinned.get((x,z), 0) + 1
             else:
                 # It is not yet cached.
                 # Get file, but do not cache later.
-                regionfile = region.RegionFile(self.regionfiles[(x,z)], chunkclass = self.chunkclass)
+                regionfile = region.RegionFile(self.regionfiles[(x,z)], chunkclass = self.chunkclass, parser = self.parser, \
+                                               cache = self.chunk_cache)
                 regionfile.loc = Location(x=x,z=z)
                 close_after_use = True
             try:
@@ -111,8 +286,13 @@ class _BaseWorldFolder(object):
             finally:
                 if close_after_use:
                     regionfile.close()
+                if pinned:
+                    self._pinned[(x,z)] -= 1
+                    if not self._pinned[(x,z)]:
+                        del self._pinned[(x,z)]
 
-    def call_for_each_region(self, callback_function, boundingbox=None):
+    def call_for_each_region(self, callback_function, boundingbox=None, workers=None, \
+                             chunksize=1, ordered=True, reducer=None):
         """
         Return an iterable that calls callback_function for each region file 
         in the world. This is equivalent to:
@@ -121,11 +301,58 @@ class _BaseWorldFolder(object):
                 yield callback_function(the_region)
         ````
         
-        This function is threaded. It uses pickle to pass values between threads.
-        See [What can be pickled and unpickled?](https://docs.python.org/library/pickle.html#what-can-be-pickled-and-unpickled) in the Python documentation
+        This function uses multiple processes. Each worker process opens the
+        region files by filename, and uses pickle to pass values between
+        processes. callback_function must be defined at module level, and see
+        [What can be pickled and unpickled?](https://docs.python.org/library/pickle.html#what-can-be-pickled-and-unpickled) in the Python documentation
         for limitation on the output of `callback_function()`.
+        
+        workers is the number of worker processes, by default the number of
+        processors. If workers is 0, or concurrent.futures is not available,
+        all work is done in the current process.
+        chunksize is the number of region files passed to a worker at once.
+        If ordered is False, results are returned as soon as they are
+        available, instead of in the order of the region files.
+        If reducer is given, it is called as reducer(result1, result2) to
+        combine two results, and the combined result of all region files is
+        returned instead of an iterable. It is None if there are no results.
+        If a boundingbox is given, only region files with chunks inside the
+        bounding box are passed to callback_function.
         """
-        raise NotImplemented()
+        return self._call_for_each(_call_for_region, callback_function, \
+                                   workers, chunksize, ordered, reducer, boundingbox)
+
+    def _call_for_each(self, worker, callback_function, workers, chunksize, ordered, reducer, boundingbox=None):
+        """Call worker for each region file, in batches of chunksize region
+        files, and return the results (or combined result)."""
+        tasks = [(self.regionfiles[x, z], x, z, self.chunkclass, self.parser) \
+                 for x, z in self._region_coords(boundingbox)]
+        batches = [tasks[i:i+chunksize] for i in range(0, len(tasks), chunksize)]
+        results = self._iter_batches(worker, callback_function, batches, workers, ordered, reducer, boundingbox)
+        if reducer is None:
+            return results
+        combined = None
+        for i, result in enumerate(results):
+            combined = result if i == 0 else reducer(combined, result)
+        return combined
+
+    def _iter_batches(self, worker, callback_function, batches, workers, ordered, reducer, boundingbox):
+        if workers == 0 or ProcessPoolExecutor is None:
+            for batch in batches:
+                for result in _call_for_batch(worker, callback_function, batch, reducer, boundingbox):
+                    yield result
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_call_for_batch, worker, callback_function, batch, reducer, boundingbox) \
+                       for batch in batches]
+            try:
+                for future in (futures if ordered else as_completed(futures)):
+                    for result in future.result():
+                        yield result
+            finally:
+                # Do not start pending work if the caller stops early
+                for future in futures:
+                    future.cancel()
 
     def get_nbt(self,x,z):
         """
@@ -149,18 +376,86 @@ class _BaseWorldFolder(object):
         raise NotImplemented()
         # TODO: implement
 
-    def iter_nbt(self):
+    def _create_region(self, x, z):
+        """Create an empty region file x,z in the world folder, and return
+        its file name."""
+        directory = os.path.join(self.worldfolder, 'region')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filename = os.path.join(directory, 'r.%d.%d.%s' % (x, z, self.extension))
+        open(filename, 'ab').close()
+        self.regionfiles[(x,z)] = filename
+        # Forget a previously returned empty RegionFile object
+        self.regions.pop((x,z), None)
+        self._open_regions.pop((x,z), None)
+        return filename
+
+    def copy_chunks(self, source, boundingbox=None, overwrite=True):
+        """
+        Copy the chunks of the source world folder to this world folder, with
+        :meth:`nbt.region.RegionFile.copy_chunk_raw`: the compressed data is
+        copied without decompressing it. Missing region files are created.
+        If a boundingbox is given, only the chunks inside it are copied.
+        If overwrite is False, chunks that already exist in this world are
+        kept, which merges the source world into this one.
+        Chunks that can not be read from the source are skipped.
+        Return the number of chunks copied.
+        """
+        if source.extension != self.extension:
+            raise ValueError("Can not copy chunks from a %s world to a %s world" % (source.type, self.type))
+        copied = 0
+        for srcregion in source.iter_regions(boundingbox):
+            rx, rz = srcregion.loc.x, srcregion.loc.z
+            if (rx,rz) not in self.regionfiles:
+                self._create_region(rx, rz)
+            dstregion = self.get_region(rx, rz)
+            # Write the chunks of a region file at once
+            with dstregion.batch():
+                for m in srcregion.get_metadata():
+                    if boundingbox is not None and \
+                            not boundingbox.contains(32*rx + m.x, None, 32*rz + m.z):
+                        continue
+                    if not overwrite and dstregion.metadata[m.x, m.z].is_created():
+                        continue
+                    try:
+                        dstregion.copy_chunk_raw(srcregion, m.x, m.z, m.x, m.z)
+                    except region.RegionFileFormatError:
+                        continue
+                    copied += 1
+        return copied
+
+    def iter_nbt(self, boundingbox=None, order=None, since=None):
         """
         Return an iterable list of all NBT. Use this function if you only
         want to loop through the chunks once, and don't need the block or data arrays.
+        If a boundingbox is given, only chunks inside the bounding box are
+        read. The bounding box is in chunk coordinates.
+        If order is 'disk', the chunks of each region file are read in the
+        order of their data in the file, which gives sequential reads. If
+        order is 'zcurve' or 'hilbert', neighbouring chunks are mostly
+        returned close after each other. See ORDERS.
+        If since is a :class:`ChunkManifest` from get_manifest(), only the
+        chunks that were written after it was made are returned.
         """
-        # TODO: Implement BoundingBox
-        # TODO: Implement sort order
-        for region in self.iter_regions():
-            for c in region.iter_chunks():
+        for region in self.iter_regions(boundingbox, order):
+            for c in _iter_nbt(region, boundingbox, order, since):
                 yield c
 
-    def call_for_each_nbt(self, callback_function, boundingbox=None):
+    def get_manifest(self, checksum=None):
+        """
+        Return a :class:`ChunkManifest` of the chunks in the world, to pass
+        later as the since argument of iter_nbt() or iter_chunks().
+        If checksum is a name in :data:`nbt.region.CHECKSUMS`, the compressed
+        data of all chunks is read to compute a checksum, which also detects
+        changes that keep the timestamp and location of a chunk.
+        """
+        manifest = ChunkManifest(checksum)
+        for regionfile in self.iter_regions():
+            manifest.regions[regionfile.loc.x, regionfile.loc.z] = regionfile.get_manifest(checksum)
+        return manifest
+
+    def call_for_each_nbt(self, callback_function, boundingbox=None, workers=None, \
+                          chunksize=1, ordered=True, reducer=None):
         """
         Return an iterable that calls callback_function for each NBT structure 
         in the world. This is equivalent to:
@@ -169,11 +464,16 @@ class _BaseWorldFolder(object):
                 yield callback_function(the_nbt)
         ````
         
-        This function is threaded. It uses pickle to pass values between threads.
-        See [What can be pickled and unpickled?](https://docs.python.org/library/pickle.html#what-can-be-pickled-and-unpickled) in the Python documentation
-        for limitation on the output of `callback_function()`.
+        This function uses multiple processes, in the same way as
+        :meth:`call_for_each_region`, and accepts the same arguments.
+        Results are passed back per region file. If a reducer is given, the
+        results of each region file are already combined in the worker
+        process, which reduces the amount of data to pickle.
+        If a boundingbox is given, only chunks inside the bounding box are
+        read.
         """
-        raise NotImplemented()
+        return self._call_for_each(_call_for_nbt, callback_function, \
+                                   workers, chunksize, ordered, reducer, boundingbox)
 
     def get_chunk(self,x,z):
         """
@@ -188,22 +488,28 @@ class _BaseWorldFolder(object):
         list frequently and want to cache the result.
         Use iter_chunks() if you only want to loop through the chunks once or have a
         very large world.
+        If a boundingbox is given, only chunks inside the bounding box are
+        returned, and the result is not cached.
         """
+        if boundingbox is not None:
+            return list(self.iter_chunks(boundingbox))
         if self.chunks == None:
             self.chunks = list(self.iter_chunks())
         return self.chunks
 
-    def iter_chunks(self):
+    def iter_chunks(self, boundingbox=None, order=None, since=None):
         """
         Return an iterable list of all chunks. Use this function if you only
         want to loop through the chunks once or have a very large world.
         Use get_chunks() if you access the chunk list frequently and want to cache
         the results. Use iter_nbt() if you are concerned about speed and don't want
         to parse the block data.
+        If a boundingbox is given, only chunks inside the bounding box are
+        read. The bounding box is in chunk coordinates.
+        order is the order of the chunks, and since a manifest to return only
+        changed chunks; see iter_nbt().
         """
-        # TODO: Implement BoundingBox
-        # TODO: Implement sort order
-        for c in self.iter_nbt():
+        for c in self.iter_nbt(boundingbox, order, since):
             yield self.chunkclass(c)
 
     def chunk_count(self):
@@ -291,6 +597,25 @@ class BoundingBox(object):
                 self.minz = z
             if self.maxz is None or z > self.maxz:
                 self.maxz = z
+    def contains(self, x, y, z):
+        """
+        Return True if the point x,y,z is inside the bounding box. A coordinate
+        that is None, or a bound that is None, is not checked.
+        """
+        return self.intersects(x, x, y, y, z, z)
+    def intersects(self, minx, maxx, miny, maxy, minz, maxz):
+        """
+        Return True if the box from minx,miny,minz to maxx,maxy,maxz (inclusive)
+        overlaps with the bounding box. A coordinate that is None, or a bound
+        that is None, is not checked.
+        """
+        for low, high, boxlow, boxhigh in ((minx, maxx, self.minx, self.maxx),
+                (miny, maxy, self.miny, self.maxy), (minz, maxz, self.minz, self.maxz)):
+            if high is not None and boxlow is not None and high < boxlow:
+                return False
+            if low is not None and boxhigh is not None and low > boxhigh:
+                return False
+        return True
     def lenx(self):
         if self.maxx is None or self.minx is None:
             return 0
@@ -306,3 +631,52 @@ class BoundingBox(object):
     def __repr__(self):
         return "%s(%s,%s,%s,%s,%s,%s)" % (self.__class__.__name__,self.minx,self.maxx,
                 self.miny,self.maxy,self.minz,self.maxz)
+
+
+class ChunkManifest(object):
+    """
+    The timestamp, location, length and optional checksum of each chunk of
+    a world at some point in time, to find the chunks that changed since.
+    Create one with :meth:`_BaseWorldFolder.get_manifest`, and store it
+    between runs with save() and load().
+
+    To process only the changes of a world in each run, make the manifest
+    for the next run before iterating over the changed chunks::
+
+        manifest = world.get_manifest()
+        for nbt in world.iter_nbt(since=ChunkManifest.load(filename)):
+            ...
+        manifest.save(filename)
+    """
+    def __init__(self, checksum=None):
+        self.checksum = checksum
+        """Name of the checksum in :data:`nbt.region.CHECKSUMS`, or None."""
+        self.regions = {}
+        """Manifest of each region file by region x,z, as returned by
+        :meth:`nbt.region.RegionFile.get_manifest`."""
+
+    def _is_changed(self, regionfile, rx, rz, x, z):
+        """Return True if chunk x,z of region file rx,rz changed."""
+        entry = self.regions.get((rx, rz), {}).get((x, z))
+        return regionfile.is_changed(x, z, entry, self.checksum)
+
+    def save(self, filename):
+        """Write the manifest to a JSON file."""
+        regions = {}
+        for (rx, rz), chunks in self.regions.items():
+            regions["%d,%d" % (rx, rz)] = dict(("%d,%d" % (x, z), list(entry)) \
+                                               for (x, z), entry in chunks.items())
+        with open(filename, 'w') as f:
+            json.dump({'checksum': self.checksum, 'regions': regions}, f, sort_keys=True)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a manifest from a JSON file written by save()."""
+        with open(filename) as f:
+            data = json.load(f)
+        manifest = cls(data['checksum'])
+        for rxz, chunks in data['regions'].items():
+            rx, rz = map(int, rxz.split(','))
+            manifest.regions[rx, rz] = dict((tuple(map(int, xz.split(','))), tuple(entry)) \
+                                            for xz, entry in chunks.items())
+        return manifest
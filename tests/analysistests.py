@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+import sys,os
+import tempfile, shutil
+import pickle
+
+import unittest
+
+# Search parent directory first, to make sure we test the local nbt module,
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir) # insert ../ just after ./
+
+from nbt.world import WorldFolder
+from nbt.analysis import map_reduce, Counter, Histogram, TopK, MAP_REGION, MAP_NBT
+
+from worldtests import generate_world
+
+# Mappers for the worker processes must be defined at module level
+
+def tag_names(nbt):
+    return [tag.name for tag in nbt.tags]
+
+def chunk_x(nbt):
+    return [nbt.loc.x]
+
+def region_size(regionfile):
+    return [(regionfile.get_size(), regionfile.loc.x, regionfile.loc.z)]
+
+def interrupt(nbt):
+    raise KeyboardInterrupt()
+
+
+### Actual Test Classes ###
+
+class AccumulatorTest(unittest.TestCase):
+    """Test adding values to and merging of accumulators."""
+
+    def testCounter(self):
+        counter = Counter()
+        counter.update(['a', 'b', 'a'])
+        counter.add('c')
+        other = counter.new()
+        self.assertEqual(len(other), 0)
+        other.update({'a': 5})
+        counter.merge(pickle.loads(pickle.dumps(other)))
+        self.assertEqual(dict(counter), {'a': 7, 'b': 1, 'c': 1})
+
+    def testHistogram(self):
+        histogram = Histogram(binsize=10, origin=5)
+        histogram.update([5, 14, 15, -6, -5])
+        other = histogram.new()
+        other.add(24.5)
+        histogram.merge(other)
+        self.assertEqual(histogram.result(), [(-15, 1), (-5, 1), (5, 2), (15, 2)])
+        self.assertEqual(histogram.total(), 6)
+        self.assertRaises(ValueError, histogram.merge, Histogram(binsize=5))
+
+    def testTopK(self):
+        topk = TopK(3)
+        topk.update([5, 1, 8])
+        other = topk.new()
+        other.update([7, 2, 9])
+        topk.merge(other)
+        self.assertEqual(topk.result(), [9, 8, 7])
+        topk = TopK(2, key=len)
+        topk.update(['aaa', 'b', 'cc'])
+        self.assertEqual(topk.result(), ['aaa', 'cc'])
+
+
+class MapReduceTest(unittest.TestCase):
+    """Test map_reduce() over a world folder."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.world = WorldFolder(generate_world(self.tempdir, [(0, 0), (-1, 0), (2, 3)]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testCounter(self):
+        expected = Counter()
+        for nbt in self.world.iter_nbt():
+            expected.update(tag_names(nbt))
+        for workers in (0, 2):
+            counter = map_reduce(self.world, tag_names, Counter(), level=MAP_NBT, workers=workers)
+            self.assertEqual(counter, expected)
+            self.assertTrue(counter.complete)
+
+    def testHistogram(self):
+        histogram = map_reduce(self.world, chunk_x, Histogram(binsize=32), level=MAP_NBT, workers=2)
+        self.assertEqual(histogram.result(), [(-32, 13), (0, 13), (64, 13)])
+
+    def testTopK(self):
+        topk = map_reduce(self.world, region_size, TopK(2), level=MAP_REGION, workers=0)
+        self.assertEqual([(x, z) for size, x, z in topk.result()], [(2, 3), (0, 0)])
+
+    def testProgress(self):
+        progress = []
+        map_reduce(self.world, chunk_x, Counter(), level=MAP_NBT, workers=0, \
+                   progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+
+    def testInterrupt(self):
+        counter = Counter()
+        counter.add('before')
+        result = map_reduce(self.world, interrupt, counter, level=MAP_NBT, workers=0)
+        self.assertIs(result, counter)
+        self.assertFalse(result.complete)
+        self.assertEqual(dict(result), {'before': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+"""
+Benchmarks of performance sensitive parts of the NBT library.
+
+These benchmarks are not part of the test suite. Run all benchmarks with
+`python benchmarks.py`, or only some by giving their names as arguments,
+e.g. `python benchmarks.py compound_lookup`.
+"""
+
+import sys, os
+import timeit
+import time
+import tempfile, shutil
+from io import BytesIO
+from struct import pack, unpack
+
+# Search parent directory first, to make sure we benchmark the local nbt
+# module, not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir)  # insert ../ just after ./
+
+from nbt.nbt import NBTFile, TAG_Compound, TAG_Byte, TAG_Int, TAG_String, TAG_Byte_Array, TAG_Long_Array
+from nbt import chunk
+from nbt import region
+from nbt.region import RegionFile
+
+REGIONTESTFILE = os.path.join(os.path.dirname(__file__), 'regiontest.mca')
+SCOREBOARDFILE = os.path.join(os.path.dirname(__file__), 'world_test', 'data', 'scoreboard.dat')
+
+
+def measure(function, repeat=5, number=None):
+    """Return the best time in seconds of a call to function.
+    If number is not specified, it is chosen so that a measurement takes
+    at least 0.2 seconds."""
+    timer = timeit.Timer(function)
+    if number is None:
+        number = 1
+        while timer.timeit(number) < 0.2:
+            number *= 10
+    return min(timer.repeat(repeat, number)) / number
+
+def report(label, seconds):
+    """Print the result of a measurement."""
+    if seconds < 1e-3:
+        print("  %-45s %10.2f us" % (label, 1e6 * seconds))
+    else:
+        print("  %-45s %10.2f ms" % (label, 1e3 * seconds))
+
+
+### Benchmarks ###
+
+def _linear_lookup(compound, key):
+    """Lookup by name as done before TAG_Compound had an index."""
+    if isinstance(key, int):
+        return compound.tags[key]
+    for tag in compound.tags:
+        if tag.name == key:
+            return tag
+    raise KeyError(key)
+
+def _linear_insert(compound, key, value):
+    """Insertion by name as done before TAG_Compound had an index."""
+    value.name = key
+    for i, tag in enumerate(compound.tags):
+        if tag.name == key:
+            compound.tags[i] = value
+            return
+    compound.tags.append(value)
+
+def benchmark_compound_lookup():
+    """Lookup, missing keys and new keys by name in TAG_Compound."""
+    for size in (10, 100, 500, 1000):
+        keys = ["key%04d" % i for i in range(size)]
+        missing = ["missing%04d" % i for i in range(size)]
+        compound = TAG_Compound()
+        for key in keys:
+            compound.tags.append(TAG_Int(0, name=key))
+        def lookup_all():
+            for key in keys:
+                compound[key]
+        def linear_lookup_all():
+            for key in keys:
+                _linear_lookup(compound, key)
+        def miss_all():
+            for key in missing:
+                key in compound
+        def linear_miss_all():
+            for key in missing:
+                try:
+                    _linear_lookup(compound, key)
+                except KeyError:
+                    pass
+        def insert_all():
+            c = TAG_Compound()
+            for key in keys:
+                c[key] = TAG_Int(0)
+        def linear_insert_all():
+            c = TAG_Compound()
+            for key in keys:
+                _linear_insert(c, key, TAG_Int(0))
+        print("compound of %d keys:" % size)
+        report("lookup (linear scan)", measure(linear_lookup_all) / size)
+        report("lookup (index)", measure(lookup_all) / size)
+        report("missing key (linear scan)", measure(linear_miss_all) / size)
+        report("missing key (index)", measure(miss_all) / size)
+        report("insert (linear scan)", measure(linear_insert_all) / size)
+        report("insert (index)", measure(insert_all) / size)
+    scoreboard = NBTFile(SCOREBOARDFILE)
+    scores = scoreboard['data']['PlayerScores']
+    def scoreboard_lookup():
+        for score in scores:
+            score['Objective'], score['Score'], score['Name']
+    print("scoreboard.dat:")
+    report("lookup of 3 keys in %d scores" % len(scores), measure(scoreboard_lookup))
+
+def _loop_unpack(states, nb):
+    """Unpacking of block states as done before unpack_block_states()."""
+    indexes = []
+    m = pow(2, nb) - 1
+    j = 0
+    bl = 64
+    ll = states[0]
+    for i in range(0,4096):
+        if bl == 0:
+            j = j + 1
+            ll = states[j]
+            bl = 64
+        if nb <= bl:
+            indexes.append(ll & m)
+            ll = ll >> nb
+            bl = bl - nb
+        else:
+            j = j + 1
+            lh = states[j]
+            bh = nb - bl
+            lh = (lh & (pow(2, bh) - 1)) << bl
+            ll = (ll & (pow(2, bl) - 1))
+            indexes.append(lh | ll)
+            ll = states[j]
+            ll = ll >> bh
+            bl = 64 - bh
+    return indexes
+
+def benchmark_block_states():
+    """Unpacking the palette indexes of a section."""
+    numpy = chunk.numpy
+    def generate_states(length):
+        tag = TAG_Long_Array()
+        tag.value = [(i * 2654435761) & 0x7FFFFFFFFFFFFFFF for i in range(length)]
+        tag.value = tag._from_bytes(tag._to_bytes())
+        return tag
+    for bits in (4, 5, 9):
+        tag = generate_states((4096 * bits + 63) // 64)
+        print("%d bits per block:" % bits)
+        report("loop", measure(lambda: _loop_unpack(tag.value, bits)))
+        chunk.numpy = None
+        report("unpack_block_states", measure(lambda: chunk.unpack_block_states(tag.value, bits)))
+        chunk.numpy = numpy
+        if numpy is not None:
+            report("unpack_block_states (NumPy)", measure(lambda: chunk.unpack_block_states(tag.value, bits)))
+        if 64 % bits:
+            tag = generate_states((4096 + 64 // bits - 1) // (64 // bits))
+            chunk.numpy = None
+            report("unpack_block_states (1.16 layout)", measure(lambda: chunk.unpack_block_states(tag.value, bits, False)))
+            chunk.numpy = numpy
+            if numpy is not None:
+                report("unpack_block_states (1.16 layout, NumPy)", measure(lambda: chunk.unpack_block_states(tag.value, bits, False)))
+
+def _index_init_array(blocks):
+    """Decoding of a legacy section as done before the lookup table."""
+    bids = []
+    indexes = []
+    for bid in blocks:
+        try:
+            i = bids.index(bid)
+        except ValueError:
+            bids.append(bid)
+            i = len(bids) - 1
+        indexes.append(i)
+    return bids, indexes
+
+def benchmark_legacy_section():
+    """Decoding a section with legacy block identifiers."""
+    for size in (2, 10, 40):
+        section = TAG_Compound()
+        section.tags.append(TAG_Byte_Array(name='Blocks'))
+        section['Blocks'].value = bytearray((i * 7919 // 13) % size for i in range(4096))
+        print("section with %d block types:" % size)
+        report("list.index", measure(lambda: _index_init_array(section['Blocks'].value)))
+        report("lookup table", measure(lambda: chunk.AnvilSection(section, 0)))
+        section.tags.append(TAG_Byte_Array(name='Add'))
+        section['Add'].value = bytearray(i % 3 for i in range(2048))
+        report("lookup table (with Add)", measure(lambda: chunk.AnvilSection(section, 0)))
+
+class _UnbufferedHeaderRegionFile(RegionFile):
+    """Reading of the region header as done before a single read was used."""
+    def _parse_header(self):
+        self.size = self.get_size()
+        for index in range(0, region.SECTOR_LENGTH, 4):
+            m = self.metadata[(index//4) % 32, (index//4)//32]
+            self.file.seek(index)
+            offset, length = unpack(">IB", b"\0" + self.file.read(4))
+            m.blockstart, m.blocklength = offset, length
+            self.file.seek(index + region.SECTOR_LENGTH)
+            m.timestamp = unpack(">I", self.file.read(4))[0]
+            if offset == 0 and length == 0:
+                m.status = region.STATUS_CHUNK_NOT_CREATED
+            elif length == 0:
+                m.status = region.STATUS_CHUNK_ZERO_LENGTH
+            elif offset < 2 and offset != 0:
+                m.status = region.STATUS_CHUNK_IN_HEADER
+            elif region.SECTOR_LENGTH * offset + 5 > self.size:
+                m.status = region.STATUS_CHUNK_OUT_OF_FILE
+            else:
+                m.status = region.STATUS_CHUNK_OK
+        for chunks in self._sectors()[2:]:
+            if len(chunks) > 1:
+                for m in chunks:
+                    if m.status not in (region.STATUS_CHUNK_ZERO_LENGTH, region.STATUS_CHUNK_IN_HEADER,
+                                        region.STATUS_CHUNK_OUT_OF_FILE):
+                        m.status = region.STATUS_CHUNK_OVERLAPPING
+
+    def _parse_chunk_headers(self):
+        for x in range(32):
+            for z in range(32):
+                m = self.metadata[x, z]
+                if m.status not in (region.STATUS_CHUNK_OK, region.STATUS_CHUNK_OVERLAPPING,
+                                    region.STATUS_CHUNK_MISMATCHED_LENGTHS):
+                    continue
+                self.file.seek(m.blockstart*region.SECTOR_LENGTH)
+                m.length = unpack(">I", self.file.read(4))[0]
+                m.compression = unpack(">B", self.file.read(1))[0]
+                self._parse_chunk_header(m, pack(">IB", m.length, m.compression), m.blockstart*region.SECTOR_LENGTH)
+
+def benchmark_region_open():
+    """Opening a region file and parsing its header."""
+    def open_region(cls):
+        cls(REGIONTESTFILE).close()
+    report("seek and read per entry", measure(lambda: open_region(_UnbufferedHeaderRegionFile)))
+    report("single header read", measure(lambda: open_region(RegionFile)))
+
+def benchmark_region_read():
+    """Reading the data of all chunks in a region file."""
+    def read_region(**kwargs):
+        regionfile = RegionFile(REGIONTESTFILE, **kwargs)
+        for m in regionfile.get_metadata():
+            try:
+                regionfile.get_blockdata(m.x, m.z)
+            except region.RegionFileFormatError:
+                pass
+        regionfile.close()
+    report("read", measure(read_region))
+    report("memory mapped", measure(lambda: read_region(mmap=True)))
+
+class _ListScanRegionFile(RegionFile):
+    """Writing of chunks as done before the sector map, which located free
+    sectors by scanning a list of all sectors for each write."""
+    def write_blockdata(self, x, z, data, compression=region.COMPRESSION_NONE):
+        length = len(data)
+        nsectors = self._bytes_to_sector(length + 5)
+        if self.size < 2*region.SECTOR_LENGTH:
+            self._init_file()
+        current = self.metadata[x, z]
+        free_sectors = self._locate_free_sectors(ignore_chunk=current)
+        sector = self._find_free_location(free_sectors, nsectors, preferred=current.blockstart)
+        if self.size < sector*region.SECTOR_LENGTH:
+            self.file.seek(0, os.SEEK_END)
+            self.file.write((sector*region.SECTOR_LENGTH - self.size) * b"\x00")
+        self.file.seek(sector*region.SECTOR_LENGTH)
+        self.file.write(pack(">IB", length + 1, compression))
+        self.file.write(data)
+        self.file.write((region.SECTOR_LENGTH * nsectors - length - 5) * b"\x00")
+        self.file.seek(4 * (x + 32*z))
+        self.file.write(pack(">IB", sector, nsectors)[1:])
+        self.file.seek(region.SECTOR_LENGTH + 4 * (x + 32*z))
+        timestamp = int(time.time())
+        self.file.write(pack(">I", timestamp))
+        free_sectors.extend((sector + nsectors - len(free_sectors)) * [True])
+        for s in range(sector, sector + nsectors):
+            free_sectors[s] = False
+        truncate_count = list(reversed(free_sectors)).index(False)
+        if truncate_count > 0:
+            self.size = region.SECTOR_LENGTH * (len(free_sectors) - truncate_count)
+            self.file.truncate(self.size)
+            free_sectors = free_sectors[:-truncate_count]
+        for s in range(current.blockstart, min(current.blockstart + current.blocklength, len(free_sectors))):
+            if free_sectors[s]:
+                self.file.seek(region.SECTOR_LENGTH*s)
+                self.file.write(region.SECTOR_LENGTH*b'\x00')
+        self.size = max((sector + nsectors)*region.SECTOR_LENGTH, self.size)
+        current.blockstart = sector
+        current.blocklength = nsectors
+        current.status = region.STATUS_CHUNK_OK
+        current.timestamp = timestamp
+        current.length = length + 1
+        current.compression = compression
+
+def benchmark_region_write():
+    """Writing all 1024 chunks of a region file, and rewriting them with
+    different sizes."""
+    sizes = [1 + (i * 7) % 3 for i in range(1024)]
+    filename = os.path.join(tempfile.mkdtemp(), 'r.0.0.mca')
+    def new_region(cls=RegionFile):
+        open(filename, 'wb').close()
+        return cls(filename)
+    def write_region(cls, allocation=region.ALLOCATE_FIRST_FIT):
+        regionfile = new_region(cls)
+        regionfile.allocation = allocation
+        for sizes_pass in (sizes, sizes[1:] + sizes[:1]):
+            for i, nsectors in enumerate(sizes_pass):
+                data = (region.SECTOR_LENGTH * nsectors - 5) * b"\x01"
+                regionfile.write_blockdata(i % 32, i // 32, data, region.COMPRESSION_NONE)
+        regionfile.close()
+    report("scan list of sectors", measure(lambda: write_region(_ListScanRegionFile), repeat=3))
+    report("sector map (first fit)", measure(lambda: write_region(RegionFile), repeat=3))
+    report("sector map (best fit)", measure(lambda: write_region(RegionFile, region.ALLOCATE_BEST_FIT), repeat=3))
+    def write_region_many():
+        regionfile = new_region()
+        for sizes_pass in (sizes, sizes[1:] + sizes[:1]):
+            regionfile.write_many(dict(((i % 32, i // 32), (region.SECTOR_LENGTH * nsectors - 5) * b"\x01") \
+                                       for i, nsectors in enumerate(sizes_pass)), region.COMPRESSION_NONE)
+        regionfile.close()
+    report("write_many", measure(write_region_many, repeat=3))
+    shutil.rmtree(os.path.dirname(filename))
+
+def benchmark_render():
+    """Encoding NBT data, of bigtest.nbt and of the chunks in a region file."""
+    from nbt.nbt import PARSER_LAZY
+    def render_buffer(nbtfile):
+        # As done by write_file() before render()
+        output = BytesIO()
+        TAG_Byte(nbtfile.id)._render_buffer(output)
+        TAG_String(nbtfile.name)._render_buffer(output)
+        nbtfile._render_buffer(output)
+        return output.getvalue()
+    bigtest = NBTFile(os.path.join(os.path.dirname(__file__), 'bigtest.nbt'))
+    regionfile = RegionFile(REGIONTESTFILE)
+    chunks = list(regionfile.iter_chunks())
+    lazy = [regionfile.get_nbt(nbt.loc.x, nbt.loc.z, parser=PARSER_LAZY) for nbt in chunks]
+    regionfile.close()
+    report("bigtest.nbt, _render_buffer", measure(lambda: render_buffer(bigtest)))
+    report("bigtest.nbt, render", measure(bigtest.render))
+    report("%d chunks, _render_buffer" % len(chunks), measure(lambda: [render_buffer(c) for c in chunks]))
+    report("%d chunks, render" % len(chunks), measure(lambda: [c.render() for c in chunks]))
+    report("%d lazy chunks, render" % len(lazy), measure(lambda: [c.render() for c in lazy]))
+
+def benchmark_write_chunk():
+    """Writing a large chunk, compressing it at once or while it is rendered."""
+    try:
+        import tracemalloc
+    except ImportError:
+        tracemalloc = None  # Python 2
+    level = NBTFile()
+    for i in range(2000):
+        array = TAG_Byte_Array(name="%d" % i)
+        array.value = bytearray(j % 256 for j in range(1000))
+        level.tags.append(array)
+    def write_at_once(regionfile):
+        regionfile.write_blockdata(0, 0, level.render())
+    def write_streaming(regionfile):
+        regionfile.write_chunk(0, 0, level)
+    for label, write in (("render, then compress", write_at_once), ("compress while rendering", write_streaming)):
+        regionfile = RegionFile(fileobj=BytesIO())
+        report(label, measure(lambda: write(regionfile)))
+        if tracemalloc is not None:
+            tracemalloc.start()
+            write(regionfile)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("  %-45s %10d kB" % ("  peak memory", peak // 1024))
+
+def benchmark_compression():
+    """Writing the chunks of a region file with different compression
+    settings: throughput of uncompressed data and total compressed size."""
+    import zlib
+    regionfile = RegionFile(REGIONTESTFILE)
+    chunks = dict(((nbt.loc.x, nbt.loc.z), bytes(nbt.render())) for nbt in regionfile.iter_chunks())
+    regionfile.close()
+    total = sum(len(data) for data in chunks.values())
+    settings = [("none", region.COMPRESSION_NONE, None, None)]
+    for level in (1, 3, 6, 9):
+        settings.append(("zlib level %d" % level, region.COMPRESSION_ZLIB, level, None))
+    settings.append(("zlib level 6, filtered", region.COMPRESSION_ZLIB, 6, zlib.Z_FILTERED))
+    settings.append(("zlib huffman only", region.COMPRESSION_ZLIB, None, zlib.Z_HUFFMAN_ONLY))
+    settings.append(("gzip level 6", region.COMPRESSION_GZIP, 6, None))
+    print("  %-30s %10s %10s %8s" % ("", "MB/s", "bytes", "ratio"))
+    for label, compression, level, strategy in settings:
+        regionfile = RegionFile(fileobj=BytesIO())
+        def write():
+            regionfile.write_many(chunks, compression, level, strategy)
+        seconds = measure(write, repeat=3)
+        size = sum(m.length - 1 for m in regionfile.get_metadata())
+        print("  %-30s %10.1f %10d %8.3f" % (label, total / seconds / 1e6, size, float(size) / total))
+
+def benchmark_copy_chunks():
+    """Copying the chunks of a region file to another region file."""
+    source = RegionFile(REGIONTESTFILE)
+    coords = [(nbt.loc.x, nbt.loc.z) for nbt in source.iter_chunks()]
+    def copy_nbt():
+        dest = RegionFile(fileobj=BytesIO())
+        with dest.batch():
+            for x, z in coords:
+                dest.write_chunk(x, z, source.get_nbt(x, z))
+    def copy_raw():
+        dest = RegionFile(fileobj=BytesIO())
+        with dest.batch():
+            for x, z in coords:
+                dest.copy_chunk_raw(source, x, z, x, z)
+    report("parse and write %d chunks" % len(coords), measure(copy_nbt))
+    report("copy %d chunks raw" % len(coords), measure(copy_raw))
+    source.close()
+
+def benchmark_manifest():
+    """Iterating over the chunks of a world with 16 region files, all of them
+    or only those changed since a manifest."""
+    from nbt.world import WorldFolder
+    tempdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(tempdir, 'region'))
+    for i in range(16):
+        shutil.copy(REGIONTESTFILE, os.path.join(tempdir, 'region', 'r.%d.%d.mca' % (i % 4, i // 4)))
+    world = WorldFolder(tempdir)
+    manifest = world.get_manifest()
+    checksums = world.get_manifest('crc32')
+    report("all chunks", measure(lambda: list(world.iter_nbt()), repeat=3))
+    report("get_manifest()", measure(world.get_manifest, repeat=3))
+    report("get_manifest('crc32')", measure(lambda: world.get_manifest('crc32'), repeat=3))
+    report("no changed chunks", measure(lambda: list(world.iter_nbt(since=manifest)), repeat=3))
+    report("no changed chunks, crc32", measure(lambda: list(world.iter_nbt(since=checksums)), repeat=3))
+    world.close()
+    shutil.rmtree(tempdir)
+
+
+BENCHMARKS = [name[10:] for name in sorted(globals()) if name.startswith('benchmark_')]
+"""Names of all benchmarks."""
+
+def main(names):
+    for name in names or BENCHMARKS:
+        if name not in BENCHMARKS:
+            sys.stderr.write("Unknown benchmark %s. Choose from: %s\n" % (name, ", ".join(BENCHMARKS)))
+            return 64 # EX_USAGE
+        function = globals()['benchmark_' + name]
+        print("== %s: %s" % (name, function.__doc__))
+        function()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+import sys,os
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import unittest
+
+# Search parent directory first, to make sure we test the local nbt module,
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir) # insert ../ just after ./
+
+from nbt.nbt import NBTFile, TAG_Compound, TAG_List, TAG_Byte, TAG_Int, TAG_String, \
+    TAG_Byte_Array, TAG_Long_Array
+from nbt import chunk
+from nbt.chunk import AnvilChunk, unpack_block_states
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+### Helper Functions ###
+
+def pack_block_states(indexes, bits, spanning=True):
+    """Pack palette indexes in an array of signed longs. If spanning is
+    True, an index may span two longs."""
+    per_long = 64 // bits
+    value = 0
+    for i, index in enumerate(indexes):
+        if spanning:
+            value |= index << (i * bits)
+        else:
+            value |= index << (64 * (i // per_long) + bits * (i % per_long))
+    if spanning:
+        length = (len(indexes) * bits + 63) // 64
+    else:
+        length = (len(indexes) + per_long - 1) // per_long
+    states = []
+    for i in range(length):
+        long = (value >> (64 * i)) & 0xFFFFFFFFFFFFFFFF
+        states.append(long - 2**64 if long >= 2**63 else long)
+    return states
+
+def generate_section(y, names, indexes, version=1631):
+    """Return a section with given palette names and indexes."""
+    section = TAG_Compound()
+    section.tags.append(TAG_Byte(y, name='Y'))
+    palette = TAG_List(name='Palette', type=TAG_Compound)
+    for name in names:
+        block = TAG_Compound()
+        block.tags.append(TAG_String(name, name='Name'))
+        palette.tags.append(block)
+    section.tags.append(palette)
+    states = TAG_Long_Array(name='BlockStates')
+    bits = max(4, (len(names) - 1).bit_length())
+    states.value = pack_block_states(indexes, bits, spanning=version < 2529)
+    section.tags.append(states)
+    return section
+
+def generate_legacy_section(y, blocks):
+    """Return a section with given legacy block ids."""
+    section = TAG_Compound()
+    section.tags.append(TAG_Byte(y, name='Y'))
+    array = TAG_Byte_Array(name='Blocks')
+    array.value = bytearray(bid & 255 for bid in blocks)
+    section.tags.append(array)
+    if any(bid > 255 for bid in blocks):
+        add = TAG_Byte_Array(name='Add')
+        add.value = bytearray((blocks[i] >> 8) | (blocks[i + 1] >> 8) << 4 for i in range(0, 4096, 2))
+        section.tags.append(add)
+    return section
+
+def generate_chunk(sections, version=1631):
+    """Return the NBT of a chunk with the given sections."""
+    nbtfile = NBTFile()
+    if version:
+        nbtfile.tags.append(TAG_Int(version, name='DataVersion'))
+    level = TAG_Compound()
+    level.name = 'Level'
+    level.tags.append(TAG_Int(2, name='xPos'))
+    level.tags.append(TAG_Int(-3, name='zPos'))
+    sectionlist = TAG_List(name='Sections', type=TAG_Compound)
+    sectionlist.tags.extend(sections)
+    level.tags.append(sectionlist)
+    nbtfile.tags.append(level)
+    return nbtfile
+
+
+### Actual Test Classes ###
+
+class AnvilChunkTest(unittest.TestCase):
+    """Test reading blocks from a chunk in Anvil format."""
+
+    def setUp(self):
+        self.names = ['minecraft:air', 'minecraft:stone', 'minecraft:dirt']
+        # stone at the bottom layer, dirt at x=1, z=2 of all layers.
+        self.indexes = [0] * 4096
+        for i in range(256):
+            self.indexes[i] = 1
+        for y in range(16):
+            self.indexes[y * 256 + 2 * 16 + 1] = 2
+        self.chunk = AnvilChunk(generate_chunk([generate_section(1, self.names, self.indexes)]))
+
+    def testGetBlock(self):
+        self.assertEqual(self.chunk.get_coords(), (2, -3))
+        self.assertEqual(self.chunk.get_max_height(), 31)
+        self.assertEqual(self.chunk.get_block(0, 16, 0), 'stone')
+        self.assertEqual(self.chunk.get_block(1, 20, 2), 'dirt')
+        self.assertEqual(self.chunk.get_block(2, 20, 1), 'air')
+        self.assertIsNone(self.chunk.get_block(0, 0, 0))
+
+    def testLegacyGetBlock(self):
+        blocks = [0] * 4096
+        blocks[16 * 256 - 1] = 1
+        chunk = AnvilChunk(generate_chunk([generate_legacy_section(0, blocks)], version=None))
+        self.assertEqual(chunk.get_block(15, 15, 15), 'stone')
+        self.assertEqual(chunk.get_block(14, 15, 15), 'air')
+
+    def testLegacyPalette(self):
+        blocks = [(i * 7) % 5 for i in range(4096)]
+        blocks[100] = 999 # unknown block
+        blocks[101] = 2 + (1 << 8)
+        chunk = AnvilChunk(generate_chunk([generate_legacy_section(0, blocks)], version=None))
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            section = chunk.get_section(0)
+            # Unknown block ids are not reported
+            self.assertEqual(sys.stdout.getvalue(), '')
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(section.names, ['air', 'grass_block', 'cobblestone', 'stone', 'dirt', None, None])
+        self.assertEqual([section.names[i] for i in section.indexes[:3]], ['air', 'grass_block', 'cobblestone'])
+        self.assertEqual(section.indexes[100:102], [5, 6])
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def testBlocksNdarray(self):
+        blocks, palette = self.chunk.blocks_ndarray()
+        self.assertEqual(blocks.shape, (32, 16, 16))
+        self.assertEqual(blocks.dtype, numpy.uint16)
+        self.assertEqual(palette[blocks[0, 0, 0]], 'air')
+        self.assertEqual(palette[blocks[16, 5, 5]], 'stone')
+        self.assertEqual(palette[blocks[20, 2, 1]], 'dirt')
+        self.assertEqual(int((blocks == palette.index('stone')).sum()), 255)
+        self.assertEqual(int((blocks == palette.index('dirt')).sum()), 16)
+        for y in range(32):
+            for z in range(16):
+                for x in range(16):
+                    self.assertEqual(palette[blocks[y, z, x]], self.chunk.get_block(x, y, z) or 'air')
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def testBlocksNdarrayUnknownIds(self):
+        blocks = [0] * 4096
+        blocks[1] = 1
+        blocks[2] = 999
+        blocks[3] = 2 + (1 << 8)
+        chunk = AnvilChunk(generate_chunk([generate_legacy_section(0, blocks)], version=None))
+        array, palette = chunk.blocks_ndarray()
+        self.assertEqual([palette[i] for i in array[0, 0, :4]], ['air', 'stone', 999, 258])
+
+    def testFlattenedBefore1631(self):
+        # MC 1.13 and 1.13.1 have data versions 1519 to 1630
+        for version in (1519, 1628):
+            chunk = AnvilChunk(generate_chunk([generate_section(1, self.names, self.indexes, version)], version))
+            self.assertEqual(chunk.get_block(0, 16, 0), 'stone')
+            self.assertEqual(chunk.get_block(1, 20, 2), 'dirt')
+
+    def testPaletteSizes(self):
+        for version in (1631, 2566):
+            for size in (2, 17, 33, 300):
+                names = ['block%d' % i for i in range(size)]
+                indexes = [(i * 7) % size for i in range(4096)]
+                section = generate_section(0, names, indexes, version)
+                chunk = AnvilChunk(generate_chunk([section], version))
+                self.assertEqual(chunk.get_section(0).indexes, indexes)
+                self.assertEqual(chunk.get_block(15, 15, 15), names[indexes[4095]])
+
+    def testEmptySection(self):
+        section = TAG_Compound()
+        section.tags.append(TAG_Byte(-1, name='Y'))
+        chunk = AnvilChunk(generate_chunk([section], 1976))
+        self.assertEqual(chunk.get_section(-1).names, ['air'])
+        self.assertEqual(set(chunk.get_section(-1).indexes), set([0]))
+
+
+class LazySectionTest(unittest.TestCase):
+    """Test that sections of an AnvilChunk are only decoded when needed."""
+
+    def setUp(self):
+        names = ['minecraft:air', 'minecraft:stone']
+        sections = [generate_section(y, names, [y % 2] * 4096) for y in range(4)]
+        self.nbt = generate_chunk(sections)
+        self.decoded = []
+        self.init = chunk.AnvilSection.__init__
+        def init(section, nbt, version):
+            self.decoded.append(nbt['Y'].value)
+            self.init(section, nbt, version)
+        chunk.AnvilSection.__init__ = init
+
+    def tearDown(self):
+        chunk.AnvilSection.__init__ = self.init
+
+    def testNoAccess(self):
+        anvilchunk = AnvilChunk(self.nbt)
+        self.assertEqual(anvilchunk.get_coords(), (2, -3))
+        self.assertEqual(anvilchunk.get_max_height(), 63)
+        self.assertEqual(self.decoded, [])
+
+    def testGetBlock(self):
+        anvilchunk = AnvilChunk(self.nbt)
+        self.assertEqual(anvilchunk.get_block(0, 20, 0), 'stone')
+        self.assertEqual(anvilchunk.get_block(0, 30, 0), 'stone')
+        self.assertEqual(anvilchunk.get_block(0, 40, 0), 'air')
+        self.assertIsNone(anvilchunk.get_block(0, 70, 0))
+        self.assertIsNone(anvilchunk.get_section(4))
+        self.assertEqual(self.decoded, [1, 2])
+
+    def testCacheSize(self):
+        anvilchunk = AnvilChunk(self.nbt, cache_size=2)
+        for y in (0, 1, 0, 2, 0, 1):
+            anvilchunk.get_section(y)
+        self.assertEqual(self.decoded, [0, 1, 2, 1])
+
+    def testSections(self):
+        anvilchunk = AnvilChunk(self.nbt)
+        self.assertEqual(list(anvilchunk.sections.keys()), [0, 1, 2, 3])
+        self.assertIs(anvilchunk.sections[1], anvilchunk.get_section(1))
+        self.assertEqual(len(list(anvilchunk.iter_block())), 4 * 4096)
+        self.assertEqual(self.decoded, [0, 1, 2, 3])
+
+
+class UnpackBlockStatesTest(unittest.TestCase):
+    """Test unpacking of palette indexes from the block states of a section."""
+
+    def setUp(self):
+        self.numpy = chunk.numpy
+
+    def tearDown(self):
+        chunk.numpy = self.numpy
+
+    def check_unpack(self):
+        for bits in (4, 5, 6, 8, 9, 12, 13):
+            indexes = [(i * 2654435761) % (1 << bits) for i in range(4096)]
+            for spanning in (True, False):
+                states = pack_block_states(indexes, bits, spanning)
+                self.assertEqual(unpack_block_states(states, bits, spanning), indexes)
+                # As parsed from a file, the value is an array.array
+                tag = TAG_Long_Array()
+                tag.value = states
+                tag.value = tag._from_bytes(tag._to_bytes())
+                self.assertEqual(unpack_block_states(tag.value, bits, spanning), indexes)
+
+    def testUnpack(self):
+        self.check_unpack()
+
+    def testUnpackWithoutNumpy(self):
+        chunk.numpy = None
+        self.check_unpack()
+
+    def testWrongLength(self):
+        self.assertRaises(ValueError, unpack_block_states, [0] * 255, 4)
+        self.assertRaises(ValueError, unpack_block_states, [0] * 320, 5, False)
+        self.assertRaises(ValueError, unpack_block_states, [0] * 342, 5, True)
+
+
+if __name__ == '__main__':
+    unittest.main()
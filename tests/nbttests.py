@@ -3,6 +3,7 @@ import sys,os
 import tempfile, shutil
 from io import BytesIO
 from gzip import GzipFile
+from struct import error as StructError
 
 import unittest
 try:
@@ -17,7 +18,14 @@ parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
 if parentdir not in sys.path:
     sys.path.insert(1, parentdir)  # insert ../ just after ./
 
-from nbt.nbt import _TAG_Numeric, TAG_Int, MalformedFileError, NBTFile, TAGLIST
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from nbt.nbt import _TAG_Numeric, MalformedFileError, NBTFile, TAGLIST, \
+    TAG_Compound, TAG_List, TAG_String, TAG_Byte, TAG_Int, TAG_Byte_Array, TAG_Int_Array, TAG_Long_Array, \
+    PARSER_FAST, PARSER_LAZY, extract
 
 NBTTESTFILE = os.path.join(os.path.dirname(__file__), 'bigtest.nbt')
 
@@ -111,6 +119,152 @@ class TreeManipulationTest(unittest.TestCase):
     def tearDown(self):
         del self.nbtfile
 
+class CompoundIndexTest(unittest.TestCase):
+    """Test that lookups by name remain correct when the compound is modified."""
+
+    def setUp(self):
+        self.compound = TAG_Compound()
+        for i in range(10):
+            self.compound["key%d" % i] = TAG_Int(i)
+
+    def testLookup(self):
+        self.assertEqual(self.compound["key5"].value, 5)
+        self.assertEqual(self.compound[5].value, 5)
+        self.assertIn("key9", self.compound)
+        self.assertNotIn("key10", self.compound)
+        self.assertRaises(KeyError, self.compound.__getitem__, "key10")
+
+    def testReplace(self):
+        self.compound["key3"] = TAG_Int(33)
+        self.assertEqual(len(self.compound), 10)
+        self.assertEqual(self.compound["key3"].value, 33)
+        self.assertEqual(self.compound[3].value, 33)
+
+    def testRename(self):
+        self.compound["new"] = self.compound["key3"]
+        self.assertEqual(len(self.compound), 10)
+        self.assertEqual(self.compound.keys()[3], "new")
+        self.assertEqual(self.compound["new"].value, 3)
+        self.assertNotIn("key3", self.compound)
+
+    def testDelete(self):
+        del self.compound["key3"]
+        del self.compound[0]
+        self.assertEqual(len(self.compound), 8)
+        self.assertNotIn("key3", self.compound)
+        self.assertNotIn("key0", self.compound)
+        self.assertEqual(self.compound["key9"].value, 9)
+        self.assertRaises(KeyError, self.compound.__delitem__, "key3")
+
+    def testModifyTags(self):
+        self.compound.tags.append(TAG_Int(10, name="key10"))
+        self.assertEqual(self.compound["key10"].value, 10)
+        self.compound.tags.remove(self.compound["key2"])
+        self.assertNotIn("key2", self.compound)
+        self.assertEqual(self.compound["key5"].value, 5)
+        self.compound.tags = [TAG_Int(0, name="other")]
+        self.assertNotIn("key5", self.compound)
+        self.assertEqual(self.compound["other"].value, 0)
+
+    def testModifySameLength(self):
+        """The index is correct after changes that keep the number of tags."""
+        self.compound["key1"].name = "renamed"
+        self.assertIn("renamed", self.compound)
+        self.assertEqual(self.compound["renamed"].value, 1)
+        self.assertNotIn("key1", self.compound)
+        self.compound.tags.remove(self.compound["key2"])
+        self.compound.tags.append(TAG_Int(20, name="appended"))
+        self.assertIn("appended", self.compound)
+        self.assertEqual(self.compound["appended"].value, 20)
+        self.compound.tags[3] = TAG_Int(30, name="replaced")
+        self.assertIn("replaced", self.compound)
+        self.assertEqual(self.compound["replaced"].value, 30)
+
+    def testModifyTagsInPlace(self):
+        """The index is correct after list methods that move tags."""
+        self.compound.tags.insert(0, TAG_Int(-1, name="first"))
+        self.assertEqual(self.compound["first"].value, -1)
+        self.assertEqual(self.compound["key9"].value, 9)
+        self.compound.tags.reverse()
+        self.assertEqual(self.compound["key9"].value, 9)
+        self.compound.tags.sort(key=lambda tag: tag.value)
+        self.assertEqual(self.compound["key0"].value, 0)
+        self.compound.tags[2:5] = [TAG_Int(50, name="sliced")]
+        self.assertEqual(self.compound["sliced"].value, 50)
+        self.assertNotIn("key2", self.compound)
+        self.assertEqual(self.compound["key9"].value, 9)
+        self.compound.tags.pop(0)
+        self.assertNotIn("first", self.compound)
+        self.assertEqual(self.compound["key9"].value, 9)
+
+class ArrayTagTest(unittest.TestCase):
+    """Test the value of TAG_Int_Array and TAG_Long_Array."""
+
+    def arraytag(self, cls, value):
+        tag = cls()
+        tag.value = value
+        return tag
+
+    def roundtrip(self, tag, parser):
+        buffer = BytesIO()
+        tag._render_buffer(buffer)
+        data = buffer.getvalue()
+        if parser is None:
+            buffer.seek(0)
+            result = tag.__class__(buffer=buffer)
+        else:
+            nbtfile = NBTFile(buffer=b"\x0a\x00\x00" + bytes(bytearray([tag.id])) + \
+                    b"\x00\x01a" + data + b"\x00", parser=parser)
+            result = nbtfile["a"]
+        self.assertEqual(list(result.value), list(tag.value))
+        return result
+
+    def testRoundtrip(self):
+        values = [0, 1, -1, 2**31 - 1, -2**31, 123456]
+        for parser in (None, PARSER_FAST, PARSER_LAZY):
+            self.roundtrip(self.arraytag(TAG_Int_Array, values), parser)
+            self.roundtrip(self.arraytag(TAG_Long_Array, values + [2**63 - 1, -2**63]), parser)
+            self.roundtrip(self.arraytag(TAG_Long_Array, []), parser)
+
+    def testMutation(self):
+        tag = self.roundtrip(self.arraytag(TAG_Int_Array, [1, 2, 3]), PARSER_FAST)
+        tag[0] = 10
+        tag.insert(3, 4)
+        del tag[1]
+        self.assertEqual(tag.value, [10, 3, 4])
+        self.assertEqual(tag.valuestr(), "[3 int(s)]")
+        self.assertEqual(str(tag), "[10, 3, 4]")
+        self.roundtrip(tag, None)
+
+    def testOverflow(self):
+        tag = self.arraytag(TAG_Int_Array, [2**31])
+        self.assertRaises((OverflowError, StructError), tag._render_buffer, BytesIO())
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def testAsNumpy(self):
+        values = [0, 1, -1, 2**63 - 1, -2**63]
+        tag = self.roundtrip(self.arraytag(TAG_Long_Array, values), PARSER_FAST)
+        self.assertEqual(tag.as_numpy().dtype, numpy.int64)
+        self.assertEqual(tag.as_numpy().tolist(), values)
+        tag[0] = 5
+        self.assertEqual(tag.as_numpy().tolist(), [5] + values[1:])
+        tag = self.arraytag(TAG_Int_Array, [1, -2])
+        self.assertEqual(tag.as_numpy().dtype, numpy.int32)
+        self.assertEqual(tag.as_numpy().tolist(), [1, -2])
+        tag = TAG_Byte_Array()
+        tag.value = bytearray([1, 255])
+        self.assertEqual(tag.as_numpy().tolist(), [1, -1])
+        tag.as_numpy()[0] = 7
+        self.assertEqual(tag[0], 7)
+
+    def testTruncated(self):
+        data = b"\x0a\x00\x00\x0b\x00\x01a\x00\x00\x00\x02\x00\x00\x00\x01\x00"
+        for parser in (None, PARSER_FAST, PARSER_LAZY):
+            if parser is None:
+                self.assertRaises(MalformedFileError, NBTFile, buffer=BytesIO(data))
+            else:
+                self.assertRaises(MalformedFileError, NBTFile, buffer=data, parser=parser)
+
 class EmptyStringTest(unittest.TestCase):
 
     def setUp(self):
@@ -126,5 +280,208 @@ class EmptyStringTest(unittest.TestCase):
         self.nbtfile.write_file(buffer=buffer)
         self.assertEqual(buffer.getvalue(), self.golden_value)
 
+class FastParserTest(unittest.TestCase):
+    """Test that the single-pass parser gives the same result as the stream parser."""
+
+    def setUp(self):
+        self.data = GzipFile(NBTTESTFILE).read()
+
+    def assertEqualTree(self, tag1, tag2):
+        self.assertEqual(tag1.__class__, tag2.__class__)
+        self.assertEqual(tag1.name, tag2.name)
+        if isinstance(tag1, (TAG_Compound, TAG_List)):
+            if isinstance(tag1, TAG_List):
+                self.assertEqual(tag1.tagID, tag2.tagID)
+            self.assertEqual(len(tag1.tags), len(tag2.tags))
+            for child1, child2 in zip(tag1.tags, tag2.tags):
+                self.assertEqualTree(child1, child2)
+        else:
+            self.assertEqual(tag1.value, tag2.value)
+
+    def testReadBig(self):
+        stream = NBTFile(NBTTESTFILE)
+        fast = NBTFile(NBTTESTFILE, parser=PARSER_FAST)
+        self.assertEqual(fast.name, "Level")
+        self.assertEqualTree(stream, fast)
+
+    def testReadBytes(self):
+        stream = NBTFile(buffer=BytesIO(self.data))
+        for data in (self.data, bytearray(self.data), memoryview(self.data)):
+            self.assertEqualTree(stream, NBTFile(buffer=data, parser=PARSER_FAST))
+        self.assertEqualTree(stream, NBTFile(buffer=self.data))
+
+    def testWriteBig(self):
+        mynbt = NBTFile(buffer=self.data, parser=PARSER_FAST)
+        output = BytesIO()
+        mynbt.write_file(buffer=output)
+        self.assertEqual(self.data, output.getvalue())
+
+    def testTruncatedFile(self):
+        for length in (0, 1, 10, len(self.data) // 2, len(self.data) - 1):
+            self.assertRaises(MalformedFileError, NBTFile,
+                              buffer=self.data[:length], parser=PARSER_FAST)
+
+    def testNotCompound(self):
+        self.assertRaises(MalformedFileError, NBTFile,
+                          buffer=b"\x01\0\x01a\x01", parser=PARSER_FAST)
+
+class LazyParserTest(FastParserTest):
+    """Test that the lazy parser gives the same result as the stream parser."""
+
+    def testReadBig(self):
+        stream = NBTFile(NBTTESTFILE)
+        lazy = NBTFile(NBTTESTFILE, parser=PARSER_LAZY)
+        self.assertEqual(lazy.name, "Level")
+        self.assertEqual(lazy.keys(), stream.keys())
+        self.assertEqualTree(stream, lazy)
+
+    def testReadBytes(self):
+        stream = NBTFile(buffer=BytesIO(self.data))
+        for data in (self.data, bytearray(self.data), memoryview(self.data)):
+            self.assertEqualTree(stream, NBTFile(buffer=data, parser=PARSER_LAZY))
+
+    def testChangedBuffer(self):
+        """Changing the buffer after parsing does not change the tags."""
+        data = bytearray(self.data)
+        mynbt = NBTFile(buffer=data, parser=PARSER_LAZY)
+        data[:] = b'\0' * len(data)
+        self.assertEqual(mynbt["intTest"].value, 2147483647)
+
+    def testWriteBig(self):
+        mynbt = NBTFile(buffer=self.data, parser=PARSER_LAZY)
+        output = BytesIO()
+        mynbt.write_file(buffer=output)
+        self.assertEqual(self.data, output.getvalue())
+
+    def testTruncatedFile(self):
+        for length in (0, 1, 10, len(self.data) // 2, len(self.data) - 1):
+            self.assertRaises(MalformedFileError, NBTFile,
+                              buffer=self.data[:length], parser=PARSER_LAZY)
+
+    def testNotCompound(self):
+        self.assertRaises(MalformedFileError, NBTFile,
+                          buffer=b"\x01\0\x01a\x01", parser=PARSER_LAZY)
+
+    def testPartialAccess(self):
+        mynbt = NBTFile(buffer=self.data, parser=PARSER_LAZY)
+        nested = mynbt["nested compound test"]
+        self.assertEqual(len(nested), 2)
+        self.assertIn("egg", nested)
+        self.assertNotIn("spam", nested)
+        self.assertRaises(KeyError, nested.__getitem__, "spam")
+        self.assertEqual(nested["egg"]["name"].value, "Eggbert")
+        self.assertIs(nested["egg"], nested["egg"])
+        # other compounds are not decoded
+        self.assertNotIn("tags", mynbt.__dict__)
+        self.assertNotIn("tags", nested["ham"].__dict__)
+
+    def testModifyPartial(self):
+        mynbt = NBTFile(buffer=self.data, parser=PARSER_LAZY)
+        egg = mynbt["nested compound test"]["egg"]
+        egg["name"] = TAG_String("Humpty")
+        mynbt["new"] = TAG_String("value")
+        self.assertEqual(len(mynbt.tags), 12)
+        self.assertEqual(mynbt["nested compound test"]["egg"]["name"].value, "Humpty")
+        output = BytesIO()
+        mynbt.write_file(buffer=output)
+        copy = NBTFile(buffer=output.getvalue())
+        self.assertEqual(copy["nested compound test"]["egg"]["name"].value, "Humpty")
+        self.assertEqual(copy["new"].value, "value")
+
+class RenderTest(unittest.TestCase):
+    """Test that NBTFile.render() gives the same data as _render_buffer()."""
+
+    def setUp(self):
+        self.data = GzipFile(NBTTESTFILE).read()
+
+    def render_buffer(self, nbtfile):
+        output = BytesIO()
+        TAG_Byte(nbtfile.id)._render_buffer(output)
+        TAG_String(nbtfile.name)._render_buffer(output)
+        nbtfile._render_buffer(output)
+        return output.getvalue()
+
+    def testRenderBig(self):
+        mynbt = NBTFile(buffer=self.data)
+        self.assertEqual(bytes(mynbt.render()), self.data)
+        self.assertEqual(bytes(mynbt.render()), self.render_buffer(mynbt))
+
+    def testRenderArrays(self):
+        mynbt = NBTFile()
+        mynbt.name = "arrays"
+        for cls in (TAG_Byte_Array, TAG_Int_Array, TAG_Long_Array):
+            tag = cls(name=cls.__name__)
+            tag.value = [1, 2, 3, 127]
+            if cls is TAG_Byte_Array:
+                tag.value = bytearray(tag.value)
+            mynbt.tags.append(tag)
+        mynbt.tags.append(TAG_List(name="empty", type=TAG_Int))
+        mynbt.tags.append(TAG_String(u"\u00e9t\u00e9", name=u"na\u00efve"))
+        self.assertEqual(bytes(mynbt.render()), self.render_buffer(mynbt))
+
+    def testRenderLazy(self):
+        mynbt = NBTFile(buffer=self.data, parser=PARSER_LAZY)
+        self.assertEqual(bytes(mynbt.render()), self.data)
+        mynbt["nested compound test"]["egg"]["name"] = TAG_String("Humpty")
+        expected = self.render_buffer(NBTFile(buffer=BytesIO(mynbt.render())))
+        self.assertEqual(bytes(mynbt.render()), expected)
+        self.assertIn(b"Humpty", expected)
+
+    def testWrongListType(self):
+        mynbt = NBTFile()
+        mynbt.name = "list"
+        mylist = TAG_List(name="ints", type=TAG_Int)
+        mylist.tags.append(TAG_String("spam"))
+        mynbt.tags.append(mylist)
+        self.assertRaises(ValueError, mynbt.render)
+
+class ExtractTest(unittest.TestCase):
+    """Test extracting values by path from NBT data."""
+
+    def setUp(self):
+        self.data = GzipFile(NBTTESTFILE).read()
+
+    def testExtractValues(self):
+        result = extract(self.data, ["intTest", "stringTest", "doubleTest",
+                                     "nested compound test/egg/name"])
+        self.assertEqual(result["intTest"], 2147483647)
+        self.assertEqual(result["stringTest"], u"HELLO WORLD THIS IS A TEST STRING \xc5\xc4\xd6!")
+        self.assertAlmostEqual(result["doubleTest"], 0.49312871321823148)
+        self.assertEqual(result["nested compound test/egg/name"], "Eggbert")
+
+    def testExtractBytesLike(self):
+        paths = ["stringTest", "nested compound test/egg/name"]
+        expected = extract(self.data, paths)
+        for data in (bytearray(self.data), memoryview(self.data)):
+            self.assertEqual(extract(data, paths), expected)
+
+    def testExtractCollections(self):
+        result = extract(self.data, ["listTest (long)", "nested compound test",
+                                     "byteArrayTest (the first 1000 values of (n*n*255+n*7)%100, "
+                                     "starting with n=0 (0, 62, 34, 16, 8, ...))"])
+        self.assertEqual(result["listTest (long)"], [11, 12, 13, 14, 15])
+        self.assertEqual(result["nested compound test"],
+                         {"egg": {"name": "Eggbert", "value": 0.5},
+                          "ham": {"name": "Hampus", "value": 0.75}})
+        bytearraytest = result["byteArrayTest (the first 1000 values of (n*n*255+n*7)%100, "
+                               "starting with n=0 (0, 62, 34, 16, 8, ...))"]
+        self.assertEqual(list(bytearraytest), [(n*n*255+n*7)%100 for n in range(1000)])
+
+    def testExtractListElements(self):
+        result = extract(self.data, ["listTest (long)/1", "listTest (compound)/*/name",
+                                     "*/ham/value"])
+        self.assertEqual(result["listTest (long)/1"], 12)
+        self.assertEqual(result["listTest (compound)/*/name"],
+                         ["Compound tag #0", "Compound tag #1"])
+        self.assertEqual(result["*/ham/value"], [0.75])
+
+    def testExtractMissing(self):
+        result = extract(self.data, ["spam", "intTest/spam", "listTest (long)/9",
+                                     "listTest (long)/*/spam"])
+        self.assertEqual(result, {"listTest (long)/*/spam": []})
+
+    def testExtractTruncated(self):
+        self.assertRaises(MalformedFileError, extract, self.data[:100], ["doubleTest"])
+
 if __name__ == '__main__':
     unittest.main()
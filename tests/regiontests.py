@@ -24,8 +24,10 @@ if parentdir not in sys.path:
     sys.path.insert(1, parentdir) # insert ../ just after ./
 
 from nbt.region import RegionFile, RegionFileFormatError, NoRegionHeader, \
-    RegionHeaderError, ChunkHeaderError, ChunkDataError, InconceivedChunk
-from nbt.nbt import NBTFile, TAG_Compound, TAG_Byte_Array, TAG_Long, TAG_Int, TAG_String
+    RegionHeaderError, ChunkHeaderError, ChunkDataError, InconceivedChunk, ChunkCache, \
+    COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZLIB, ALLOCATE_BEST_FIT, CHECKSUMS, _zcurve_key
+from nbt.nbt import NBTFile, TAG_Compound, TAG_Byte_Array, TAG_Long, TAG_Int, TAG_String, \
+    PARSER_FAST
 
 REGIONTESTFILE = os.path.join(os.path.dirname(__file__), 'regiontest.mca')
 
@@ -382,6 +384,17 @@ class ReadWriteTest(unittest.TestCase):
         self.assertNotIn((8, 1), coords) # zero-length (in chunk)
         self.assertEqual(len(coords), 13)
 
+    def test018ReadChunkFastParser(self):
+        """
+        chunk 9,0 can be read with the single-pass parser, with the same result.
+        chunk 5,1 is not a valid NBT file for either parser.
+        """
+        nbt = self.region.get_nbt(9, 0)
+        fastnbt = self.region.get_nbt(9, 0, parser=PARSER_FAST)
+        self.assertEqual(fastnbt.keys(), nbt.keys())
+        self.assertEqual(fastnbt[0].value, nbt[0].value)
+        self.assertRaises(ChunkDataError, self.region.get_nbt, 5, 1, parser=PARSER_FAST)
+
     def test020ReadInHeader(self):
         """
         read chunk 14,0: supposedly located in the header. 
@@ -1106,6 +1119,51 @@ class RegionFileInitTest(unittest.TestCase):
         self.assertEqual(openfiles_before, openfiles_after)
 
 
+class MemoryMapTest(unittest.TestCase):
+    """Test reading a memory mapped region file."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'regiontest.mca')
+        shutil.copy(REGIONTESTFILE, self.filename)
+        self.region = RegionFile(self.filename, mmap=True)
+
+    def tearDown(self):
+        self.region.close()
+        shutil.rmtree(self.tempdir)
+
+    def testReadChunks(self):
+        region = RegionFile(self.filename)
+        self.assertTrue(self.region.readonly)
+        self.assertEqual(self.region.get_size(), region.get_size())
+        for x in range(32):
+            for z in range(32):
+                self.assertEqual(str(self.region.metadata[x, z]), str(region.metadata[x, z]))
+        for m in region.get_metadata():
+            try:
+                data = region.get_blockdata(m.x, m.z)
+            except RegionFileFormatError as e:
+                self.assertRaises(e.__class__, self.region.get_blockdata, m.x, m.z)
+            else:
+                self.assertEqual(self.region.get_blockdata(m.x, m.z), data)
+        self.assertEqual(self.region.get_nbt(6, 0).pretty_tree(), region.get_nbt(6, 0).pretty_tree())
+
+    def testWriteFails(self):
+        nbt = generate_compressed_level(minsize = 100, maxsize = 4000)
+        self.assertRaises(IOError, self.region.write_chunk, 0, 2, nbt)
+        self.assertRaises(IOError, self.region.unlink_chunk, 6, 0)
+        self.region.close()
+        with open(self.filename, 'rb') as f, open(REGIONTESTFILE, 'rb') as original:
+            self.assertEqual(f.read(), original.read())
+
+    def testEmptyFile(self):
+        filename = os.path.join(self.tempdir, 'empty.mca')
+        open(filename, 'wb').close()
+        region = RegionFile(filename, mmap=True)
+        self.assertEqual(region.chunk_count(), 0)
+        region.close()
+
+
 # TODO: write tests
 # class PartialHeaderFileTest(EmptyFileTest):
 #   """Test for file support with only a partial header file.
@@ -1271,6 +1329,441 @@ class LengthTest(unittest.TestCase):
         self.assertEqual(self.region.chunk_count(), 1)
 
 
+class ReadCountingFileWrapper(object):
+    """Wrapper around a file object that records the size of each read.
+    If sizes is given, reads of any other size raise an IOError."""
+    def __init__(self, stream, sizes=None):
+        self.__stream = stream
+        self.sizes = sizes
+        self.reads = []
+    def read(self, size = -1):
+        self.reads.append(size)
+        if self.sizes is not None and size not in self.sizes:
+            raise IOError("Attempt to read %d bytes" % size)
+        return self.__stream.read(size)
+    def __getattr__(self, name):
+        return getattr(self.__stream, name)
+
+class WriteCountingFileWrapper(object):
+    """Wrapper around a file object that records the offset and size of
+    each write."""
+    def __init__(self, stream):
+        self.__stream = stream
+        self.writes = []
+    def write(self, data):
+        self.writes.append((self.__stream.tell(), len(data)))
+        return self.__stream.write(data)
+    def __getattr__(self, name):
+        return getattr(self.__stream, name)
+
+
+class HeaderReadTest(unittest.TestCase):
+    """Test that the headers are read with few reads, and give the same
+    metadata if reads of more than a chunk header fail."""
+
+    def setUp(self):
+        self.stream = open(REGIONTESTFILE, 'rb')
+        region = RegionFile(fileobj=self.stream)
+        self.metadata = [str(region.metadata[x, z]) for x in range(32) for z in range(32)]
+
+    def tearDown(self):
+        self.stream.close()
+
+    def testReadCount(self):
+        wrapper = ReadCountingFileWrapper(self.stream)
+        region = RegionFile(fileobj=wrapper)
+        # One read of the region header, and one per group of chunk headers
+        self.assertEqual(wrapper.reads[0], 8192)
+        self.assertLess(len(wrapper.reads), 5)
+        self.assertEqual([str(region.metadata[x, z]) for x in range(32) for z in range(32)], self.metadata)
+
+    def testFailingCoalescedRead(self):
+        wrapper = ReadCountingFileWrapper(self.stream, sizes=(8192, 5))
+        region = RegionFile(fileobj=wrapper)
+        self.assertGreater(len(wrapper.reads), 5)
+        self.assertEqual([str(region.metadata[x, z]) for x in range(32) for z in range(32)], self.metadata)
+
+
+class ChunkCacheTest(unittest.TestCase):
+    """Test the cache of decoded chunks."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'regiontest.mca')
+        shutil.copy(REGIONTESTFILE, self.filename)
+        self.cache = ChunkCache(1 << 20)
+        self.region = RegionFile(self.filename, cache=self.cache)
+
+    def tearDown(self):
+        self.region.close()
+        shutil.rmtree(self.tempdir)
+
+    def testHit(self):
+        nbt = self.region.get_nbt(6, 0)
+        self.assertIs(self.region.get_nbt(6, 0), nbt)
+        self.assertEqual((self.cache.hits, self.cache.misses, len(self.cache)), (1, 1, 1))
+        self.assertEqual(self.cache.size, len(self.region.get_blockdata(6, 0)))
+        # A different parser is not cached
+        self.assertIsNot(self.region.get_nbt(6, 0, parser=PARSER_FAST), nbt)
+        self.assertEqual(self.cache.hits, 1)
+
+    def testEviction(self):
+        coords = [(nbt.loc.x, nbt.loc.z) for nbt in RegionFile(self.filename).iter_chunks()][:3]
+        sizes = [len(self.region.get_blockdata(x, z)) for x, z in coords]
+        self.cache.max_size = sum(sizes) - 1
+        for x, z in coords:
+            self.region.get_nbt(x, z)
+        self.assertNotIn(self.region._cache_key(*coords[0]), self.cache)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.size, sizes[1] + sizes[2])
+
+    def testInvalidation(self):
+        nbt = self.region.get_nbt(6, 0)
+        self.region.write_chunk(6, 0, nbt)
+        self.assertEqual(len(self.cache), 0)
+        self.assertIsNot(self.region.get_nbt(6, 0), nbt)
+        self.region.unlink_chunk(6, 0)
+        self.assertEqual(len(self.cache), 0)
+        self.assertRaises(InconceivedChunk, self.region.get_nbt, 6, 0)
+
+    def testBatchInvalidation(self):
+        nbt = self.region.get_nbt(6, 0)
+        changed = self.region.get_nbt(6, 0, parser=PARSER_FAST)
+        changed['marker'] = TAG_Int(1)
+        with self.region.batch():
+            self.region.write_chunk(6, 0, changed)
+            # Read before the chunk is written
+            self.assertIs(self.region.get_nbt(6, 0), nbt)
+        self.assertIn('marker', self.region.get_nbt(6, 0))
+
+
+class SectorAllocationTest(unittest.TestCase):
+    """Test the allocation of sectors for written chunks."""
+
+    def setUp(self):
+        self.region = RegionFile(fileobj=BytesIO())
+
+    def write(self, x, sectors):
+        """Write chunk x,0 of the given number of sectors uncompressed."""
+        self.region.write_blockdata(x, 0, (4096 * sectors - 5) * b'\x01', compression=COMPRESSION_NONE)
+
+    def assertSectorMap(self):
+        """The incrementally updated sector map is equal to _sectors()"""
+        free = self.region._locate_free_sectors()
+        used = self.region._get_sector_map().used
+        self.assertEqual(list(used), [0 if f else 1 for f in free])
+        self.assertEqual(len(used) * 4096, self.region.get_size())
+
+    def generate_holes(self):
+        # sector 2: chunk 0, 3-5: chunk 1, 6: chunk 2, 7-8: chunk 3, 9: chunk 4
+        for x, sectors in enumerate([1, 3, 1, 2, 1]):
+            self.write(x, sectors)
+        self.region.unlink_chunk(1, 0)
+        self.region.unlink_chunk(3, 0)
+        self.assertSectorMap()
+
+    def testFirstFit(self):
+        self.generate_holes()
+        self.write(5, 2)
+        self.assertEqual(self.region.metadata[5, 0].blockstart, 3)
+        self.write(6, 4)
+        self.assertEqual(self.region.metadata[6, 0].blockstart, 10)
+        self.assertSectorMap()
+
+    def testBestFit(self):
+        self.region.allocation = ALLOCATE_BEST_FIT
+        self.generate_holes()
+        self.write(5, 2)
+        self.assertEqual(self.region.metadata[5, 0].blockstart, 7)
+        self.write(6, 1)
+        self.assertEqual(self.region.metadata[6, 0].blockstart, 3)
+        self.assertSectorMap()
+
+    def testRandomWrites(self):
+        rand = random.Random(1234)
+        self.write(0, 1)
+        for i in range(200):
+            x = rand.randrange(32)
+            if rand.random() < 0.2:
+                self.region.unlink_chunk(x, 0)
+            else:
+                self.write(x, rand.randrange(1, 5))
+            self.assertSectorMap()
+        self.region._parse_header()
+        self.assertSectorMap()
+
+
+class WriteManyTest(unittest.TestCase):
+    """Test writing many chunks at once."""
+
+    def setUp(self):
+        self.chunks = dict(((x, z), (x + 1) * (4000 + 1000 * z) * b'\x01') \
+                           for x in range(4) for z in range(3))
+
+    def check_region(self, region):
+        for (x, z), data in self.chunks.items():
+            self.assertEqual(region.get_blockdata(x, z), data)
+            self.assertEqual(region.metadata[x, z].compression, COMPRESSION_NONE)
+        # The header in the file matches the metadata
+        copy = RegionFile(fileobj=BytesIO(region.file.getvalue()))
+        for m in region.get_metadata():
+            self.assertEqual(str(copy.metadata[m.x, m.z]), str(m))
+
+    def testWriteMany(self):
+        stream = BytesIO()
+        wrapper = WriteCountingFileWrapper(stream)
+        region = RegionFile(fileobj=wrapper)
+        region.write_many(self.chunks, compression=COMPRESSION_NONE)
+        self.check_region(region)
+        # The data of all chunks is written at once, and the header once
+        self.assertEqual(len(wrapper.writes), 3)
+        self.assertEqual(wrapper.writes[-1], (0, 8192))
+        self.assertEqual(sorted(m.blockstart for m in region.get_metadata())[0], 2)
+
+    def testRewrite(self):
+        region = RegionFile(fileobj=BytesIO())
+        region.write_many(self.chunks, compression=COMPRESSION_NONE)
+        # Grow some chunks and shrink others
+        for (x, z) in list(self.chunks):
+            if (x + z) % 2:
+                self.chunks[x, z] = self.chunks[x, z][:100]
+            else:
+                self.chunks[x, z] += 5000 * b'\x02'
+        region.write_many(self.chunks, compression=COMPRESSION_NONE)
+        self.check_region(region)
+        free = region._locate_free_sectors()
+        self.assertEqual(list(region._get_sector_map().used), [0 if f else 1 for f in free])
+
+    def testBatch(self):
+        region = RegionFile(fileobj=BytesIO())
+        with region.batch():
+            for (x, z), data in self.chunks.items():
+                region.write_blockdata(x, z, data, compression=COMPRESSION_NONE)
+            with region.batch():
+                region.write_blockdata(0, 0, self.chunks[0, 0], compression=COMPRESSION_NONE)
+            self.assertEqual(region.get_size(), 0)
+        self.check_region(region)
+
+    def testBatchException(self):
+        region = RegionFile(fileobj=BytesIO())
+        try:
+            with region.batch():
+                region.write_blockdata(0, 0, b'data')
+                raise KeyError()
+        except KeyError:
+            pass
+        self.assertEqual(region.get_size(), 0)
+        self.assertEqual(region.get_metadata(), [])
+        region.write_blockdata(0, 0, b'data')
+        self.assertEqual(region.get_blockdata(0, 0), b'data')
+
+
+class StreamingWriteTest(unittest.TestCase):
+    """Test compressing chunk data while it is rendered."""
+
+    def setUp(self):
+        self.level = generate_level(200000)
+        self.data = bytes(self.level.render())
+
+    def testRenderPieces(self):
+        pieces = []
+        rest = self.level.render(lambda data: pieces.append(bytes(data)))
+        self.assertTrue(len(pieces) >= 2)
+        self.assertEqual(b"".join(pieces) + bytes(rest), self.data)
+
+    def testWriteChunk(self):
+        region = RegionFile(fileobj=BytesIO())
+        region.write_chunk(1, 2, self.level)
+        self.assertEqual(region.get_blockdata(1, 2), self.data)
+        self.assertEqual(region.get_nbt(1, 2)["000001"].value, self.level["000001"].value)
+
+    def testTooLarge(self):
+        region = RegionFile(fileobj=BytesIO())
+        region.write_chunk(0, 0, self.level)
+        size = region.get_size()
+        level = NBTFile()
+        for i in range(1100):
+            array = TAG_Byte_Array(name="%d" % i)
+            array.value = bytearray(os.urandom(1000))
+            level.tags.append(array)
+        self.assertRaises(ChunkDataError, region.write_chunk, 0, 0, level)
+        self.assertEqual(region.get_size(), size)
+        self.assertEqual(region.get_blockdata(0, 0), self.data)
+
+
+class CompressionTest(unittest.TestCase):
+    """Test writing chunks with different compression settings."""
+
+    def setUp(self):
+        self.region = RegionFile(fileobj=BytesIO())
+        self.level = generate_level(20000)
+        self.data = bytes(self.level.render())
+        # compressible data
+        self.text = " ".join("block%d" % (i * 7 % 97) for i in range(5000)).encode()
+
+    def testCompressionTypes(self):
+        for x, compression in enumerate((COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZLIB)):
+            self.region.write_blockdata(x, 0, self.data, compression=compression)
+            self.region.write_chunk(x, 1, self.level, compression=compression)
+        copy = RegionFile(fileobj=BytesIO(self.region.file.getvalue()))
+        for region in (self.region, copy):
+            for x, compression in enumerate((COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZLIB)):
+                for z in (0, 1):
+                    self.assertEqual(region.metadata[x, z].compression, compression)
+                    self.assertEqual(region.get_blockdata(x, z), self.data)
+        self.assertEqual(self.region.metadata[0, 0].length, len(self.data) + 1)
+        self.assertRaises(ValueError, self.region.write_blockdata, 0, 0, self.data, compression=3)
+
+    def testDefaultPolicy(self):
+        self.region.compression = COMPRESSION_NONE
+        self.region.write_chunk(0, 0, self.level)
+        self.region.write_many({(1, 0): self.data})
+        for x in (0, 1):
+            self.assertEqual(self.region.metadata[x, 0].compression, COMPRESSION_NONE)
+            self.assertEqual(self.region.metadata[x, 0].length, len(self.data) + 1)
+        self.region.write_blockdata(2, 0, self.data, compression=COMPRESSION_ZLIB)
+        self.assertEqual(self.region.metadata[2, 0].compression, COMPRESSION_ZLIB)
+
+    def testLevelAndStrategy(self):
+        sizes = {}
+        for x, (level, strategy) in enumerate(((1, None), (9, None), (None, zlib.Z_HUFFMAN_ONLY))):
+            self.region.write_blockdata(x, 0, self.text, level=level, strategy=strategy)
+            self.assertEqual(self.region.get_blockdata(x, 0), self.text)
+            sizes[level, strategy] = self.region.metadata[x, 0].length
+        self.assertLess(sizes[9, None], sizes[1, None])
+        self.assertLess(sizes[1, None], sizes[None, zlib.Z_HUFFMAN_ONLY])
+        self.region.compression_level = 9
+        self.region.write_blockdata(0, 1, self.text)
+        self.assertEqual(self.region.metadata[0, 1].length, sizes[9, None])
+
+
+class CopyChunkRawTest(unittest.TestCase):
+    """Test copying compressed chunk data between region files."""
+
+    def setUp(self):
+        self.source = RegionFile(fileobj=BytesIO())
+        self.source.write_blockdata(0, 0, b'zlib data')
+        self.source.write_blockdata(1, 0, b'gzip data', compression=COMPRESSION_GZIP)
+        self.source.metadata[1, 0].timestamp = 1234
+        self.dest = RegionFile(fileobj=BytesIO())
+
+    def testCopy(self):
+        self.dest.copy_chunk_raw(self.source, 0, 0, 5, 6)
+        self.dest.copy_chunk_raw(self.source, 1, 0, 1, 0)
+        self.assertEqual(self.dest.get_blockdata(5, 6), b'zlib data')
+        self.assertEqual(self.dest.get_blockdata(1, 0), b'gzip data')
+        copy = self.dest.metadata[1, 0]
+        self.assertEqual((copy.compression, copy.timestamp), (COMPRESSION_GZIP, 1234))
+        self.assertEqual(self.dest._get_rawdata(copy), self.source._get_rawdata(self.source.metadata[1, 0]))
+        # The timestamp is written to the header
+        copy = RegionFile(fileobj=BytesIO(self.dest.file.getvalue()))
+        self.assertEqual(copy.get_timestamp(1, 0), 1234)
+
+    def testUnreadableChunk(self):
+        self.assertRaises(InconceivedChunk, self.dest.copy_chunk_raw, self.source, 2, 0, 2, 0)
+        region = RegionFile(REGIONTESTFILE)
+        # chunk 11,0 has unknown encoding
+        self.assertRaises(ChunkDataError, self.dest.copy_chunk_raw, region, 11, 0, 11, 0)
+        region.close()
+        self.assertEqual(self.dest.get_metadata(), [])
+
+
+class ManifestTest(unittest.TestCase):
+    """Test detecting changed chunks with the manifest of a region file."""
+
+    def setUp(self):
+        self.region = RegionFile(fileobj=BytesIO())
+        self.region.write_blockdata(0, 0, b'spam', compression=COMPRESSION_NONE)
+        self.region.write_blockdata(1, 0, b'ham', compression=COMPRESSION_NONE)
+
+    def testManifest(self):
+        manifest = self.region.get_manifest()
+        self.assertEqual(sorted(manifest.keys()), [(0, 0), (1, 0)])
+        m = self.region.metadata[0, 0]
+        self.assertEqual(manifest[0, 0], (m.timestamp, 2, 5, None))
+        for x, z in manifest:
+            self.assertFalse(self.region.is_changed(x, z, manifest[x, z]))
+        self.region.write_blockdata(1, 0, 5000 * b'ham', compression=COMPRESSION_NONE)
+        self.region.write_blockdata(2, 0, b'eggs', compression=COMPRESSION_NONE)
+        self.assertFalse(self.region.is_changed(0, 0, manifest[0, 0]))
+        self.assertTrue(self.region.is_changed(1, 0, manifest[1, 0]))
+        self.assertTrue(self.region.is_changed(2, 0, None))
+        self.assertFalse(self.region.is_changed(3, 0, None))
+        self.assertRaises(ValueError, self.region.get_manifest, 'md4')
+
+    def check_checksum(self, checksum):
+        manifest = self.region.get_manifest(checksum)
+        self.assertIsNotNone(manifest[0, 0][3])
+        # Change the data without changing the header
+        self.region.file.seek(self.region.metadata[0, 0].blockstart * 4096 + 5)
+        self.region.file.write(b'eggs')
+        self.assertEqual(self.region.get_blockdata(0, 0), b'eggs')
+        self.assertFalse(self.region.is_changed(0, 0, manifest[0, 0]))
+        self.assertTrue(self.region.is_changed(0, 0, manifest[0, 0], checksum))
+        self.assertFalse(self.region.is_changed(1, 0, manifest[1, 0], checksum))
+
+    def testCrc32(self):
+        self.check_checksum('crc32')
+        self.assertEqual(self.region.get_manifest('crc32')[0, 0][3], zlib.crc32(b'eggs') & 0xffffffff)
+
+    @unittest.skipIf('xxh64' not in CHECKSUMS, "xxhash is not installed")
+    def testXxh64(self):
+        self.check_checksum('xxh64')
+
+
+class CompactTest(unittest.TestCase):
+    """Test rewriting a region file without unused sectors."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'regiontest.mca')
+        shutil.copy(REGIONTESTFILE, self.filename)
+        self.region = RegionFile(self.filename)
+        self.chunks = {}
+        for m in self.region.get_metadata():
+            try:
+                self.chunks[m.x, m.z] = self.region.get_blockdata(m.x, m.z)
+            except RegionFileFormatError:
+                pass
+
+    def tearDown(self):
+        self.region.close()
+        shutil.rmtree(self.tempdir)
+
+    def check_region(self, region):
+        for (x, z), data in self.chunks.items():
+            self.assertEqual(region.get_blockdata(x, z), data)
+        statuses = set(m.status for m in region.get_metadata())
+        self.assertEqual(statuses, set([RegionFile.STATUS_CHUNK_OK]))
+        self.assertEqual(region._locate_free_sectors().count(True), 0)
+
+    def testCompact(self):
+        size = self.region.get_size()
+        self.region.unlink_chunk(*sorted(self.chunks)[0])
+        del self.chunks[sorted(self.chunks)[0]]
+        reclaimed = self.region.compact()
+        self.assertGreater(reclaimed, 0)
+        self.assertEqual(reclaimed, size - self.region.get_size())
+        self.assertEqual(self.region.get_size(), os.path.getsize(self.filename))
+        self.check_region(self.region)
+        self.check_region(RegionFile(self.filename))
+        self.assertEqual(os.listdir(self.tempdir), ['regiontest.mca'])
+        # The region file is still writable
+        self.region.write_blockdata(0, 0, b'data')
+        self.assertEqual(self.region.get_blockdata(0, 0), b'data')
+
+    def testOrder(self):
+        self.region.compact(order='zcurve')
+        self.check_region(self.region)
+        metadata = sorted(self.region.get_metadata(), key=lambda m: m.blockstart)
+        coords = [(m.x, m.z) for m in metadata]
+        self.assertEqual(coords, sorted(coords, key=lambda c: _zcurve_key(*c)))
+        self.assertRaises(ValueError, self.region.compact, order='random')
+
+    def testFileObject(self):
+        region = RegionFile(fileobj=BytesIO())
+        self.assertRaises(ValueError, region.compact)
+
 # TODO: check if metadata is updated after deleting or writing a chunk
 # TODO: in tests, replace region.header or region.chunk_headers with region.metadata
 
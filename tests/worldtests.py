@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+import sys,os
+import tempfile, shutil
+
+import unittest
+
+# Search parent directory first, to make sure we test the local nbt module,
+# not an installed nbt module.
+parentdir = os.path.realpath(os.path.join(os.path.dirname(__file__),os.pardir))
+if parentdir not in sys.path:
+    sys.path.insert(1, parentdir) # insert ../ just after ./
+
+from nbt.world import WorldFolder, AnvilWorldFolder, McRegionWorldFolder, BoundingBox, ChunkManifest
+from nbt import region
+from nbt.nbt import TAG_Int
+from nbt.region import RegionFile, _zcurve_key, _hilbert_key
+
+REGIONTESTFILE = os.path.join(os.path.dirname(__file__), 'regiontest.mca')
+
+### Helper Functions ###
+
+def generate_world(tempdir, regions):
+    """Create a world folder with a copy of regiontest.mca for each region
+    x,z, and return the path of the world folder."""
+    os.mkdir(os.path.join(tempdir, 'region'))
+    for x, z in regions:
+        shutil.copy(REGIONTESTFILE, os.path.join(tempdir, 'region', 'r.%d.%d.mca' % (x, z)))
+    return tempdir
+
+# Callbacks for the worker processes must be defined at module level
+
+def region_coords(regionfile):
+    return (regionfile.loc.x, regionfile.loc.z, regionfile.chunk_count())
+
+def nbt_coords(nbt):
+    return (nbt.loc.x, nbt.loc.z)
+
+def add(a, b):
+    return a + b
+
+def count(nbt):
+    return 1
+
+
+### Actual Test Classes ###
+
+class CallForEachTest(unittest.TestCase):
+    """Test calling a function for each region and NBT in a world."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.world = WorldFolder(generate_world(self.tempdir, [(0, 0), (-1, 0), (2, 3)]))
+        self.nbt_coords = sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testWorld(self):
+        self.assertIsInstance(self.world, AnvilWorldFolder)
+        # 3 regions with 13 readable chunks
+        self.assertEqual(len(self.nbt_coords), 3 * 13)
+
+    def testCallForEachRegion(self):
+        for workers in (0, 2):
+            results = list(self.world.call_for_each_region(region_coords, workers=workers))
+            self.assertEqual(sorted(results), [(-1, 0, 21), (0, 0, 21), (2, 3, 21)])
+
+    def testOrdered(self):
+        expected = [region_coords(r) for r in self.world.iter_regions()]
+        for chunksize in (1, 2, 5):
+            results = list(self.world.call_for_each_region(region_coords, workers=2, chunksize=chunksize))
+            self.assertEqual(results, expected)
+
+    def testUnordered(self):
+        results = self.world.call_for_each_nbt(nbt_coords, workers=2, ordered=False)
+        self.assertEqual(sorted(results), self.nbt_coords)
+
+    def testCallForEachNbt(self):
+        for workers in (0, 2):
+            results = list(self.world.call_for_each_nbt(nbt_coords, workers=workers))
+            self.assertEqual(sorted(results), self.nbt_coords)
+
+    def testReducer(self):
+        for workers in (0, 2):
+            for chunksize in (1, 2):
+                self.assertEqual(self.world.call_for_each_nbt(count, workers=workers, \
+                        chunksize=chunksize, reducer=add), len(self.nbt_coords))
+        self.assertEqual(self.world.call_for_each_region(lambda r: 1, workers=0, reducer=add), 3)
+
+
+class BoundingBoxTest(unittest.TestCase):
+    """Test iterating over the chunks inside a bounding box."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.world = WorldFolder(generate_world(self.tempdir, [(0, 0), (-1, 0), (2, 3)]))
+        self.nbt_coords = sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt())
+        # Chunk coordinates of the region file at (0, 0)
+        self.box = BoundingBox(minx=0, maxx=31, minz=0, maxz=31)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testContains(self):
+        self.assertTrue(self.box.contains(0, None, 31))
+        self.assertFalse(self.box.contains(-1, None, 0))
+        self.assertTrue(BoundingBox(minx=5).contains(100, 2, -100))
+        self.assertFalse(BoundingBox(minx=5).contains(4, 2, -100))
+        self.assertTrue(self.box.intersects(-10, 0, None, None, 31, 40))
+        self.assertFalse(self.box.intersects(-10, -1, None, None, 0, 40))
+
+    def testIterRegions(self):
+        coords = [(r.loc.x, r.loc.z) for r in self.world.iter_regions(self.box)]
+        self.assertEqual(coords, [(0, 0)])
+        box = BoundingBox(minx=-1, maxx=64, minz=0, maxz=0)
+        coords = sorted((r.loc.x, r.loc.z) for r in self.world.iter_regions(box))
+        self.assertEqual(coords, [(-1, 0), (0, 0)])
+
+    def testIterNbt(self):
+        expected = [c for c in self.nbt_coords if 0 <= c[0] <= 31 and 0 <= c[1] <= 31]
+        self.assertEqual(len(expected), 13)
+        self.assertEqual(sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt(self.box)), expected)
+        box = BoundingBox(minx=-2, maxx=1, minz=0, maxz=1)
+        expected = [c for c in self.nbt_coords if -2 <= c[0] <= 1 and 0 <= c[1] <= 1]
+        self.assertEqual(sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt(box)), expected)
+
+    def testNoDataRead(self):
+        """Chunks outside the bounding box are not read."""
+        read = []
+        get_blockdata = region.RegionFile.get_blockdata
+        def counting_get_blockdata(regionfile, x, z):
+            read.append((x, z))
+            return get_blockdata(regionfile, x, z)
+        region.RegionFile.get_blockdata = counting_get_blockdata
+        try:
+            box = BoundingBox(minx=0, maxx=0, minz=0, maxz=1)
+            list(self.world.iter_nbt(box))
+        finally:
+            region.RegionFile.get_blockdata = get_blockdata
+        self.assertTrue(set(read) <= set([(0, 0), (0, 1)]))
+
+    def testCallForEach(self):
+        expected = [c for c in self.nbt_coords if 0 <= c[0] <= 31 and 0 <= c[1] <= 31]
+        for workers in (0, 2):
+            results = self.world.call_for_each_nbt(nbt_coords, boundingbox=self.box, workers=workers)
+            self.assertEqual(sorted(results), expected)
+            results = self.world.call_for_each_region(region_coords, boundingbox=self.box, workers=workers)
+            self.assertEqual(list(results), [(0, 0, 21)])
+
+
+class OrderTest(unittest.TestCase):
+    """Test the order of region files and chunks during iteration."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.world = WorldFolder(generate_world(self.tempdir, [(0, 0), (-1, 0), (0, -1), (-1, -1), (2, 3)]))
+        self.nbt_coords = sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testCurves(self):
+        # Both curves visit all points of an aligned square before leaving it
+        points = [(x, z) for x in range(-4, 4) for z in range(-4, 4)]
+        for key in (_zcurve_key, _hilbert_key):
+            curve = sorted(points, key=lambda p: key(*p))
+            self.assertEqual(len(set(key(*p) for p in points)), len(points))
+            for i in range(0, len(curve), 4):
+                square = curve[i:i+4]
+                self.assertEqual(len(set((x // 2, z // 2) for x, z in square)), 1)
+        # Consecutive points along the Hilbert curve are neighbours
+        points = [(x, z) for x in range(16) for z in range(16)]
+        curve = sorted(points, key=lambda p: _hilbert_key(*p))
+        for (x1, z1), (x2, z2) in zip(curve, curve[1:]):
+            self.assertEqual(abs(x1 - x2) + abs(z1 - z2), 1)
+
+    def testCurveOrder(self):
+        for order, key in (('zcurve', _zcurve_key), ('hilbert', _hilbert_key)):
+            coords = [nbt_coords(nbt) for nbt in self.world.iter_nbt(order=order)]
+            self.assertEqual(coords, sorted(self.nbt_coords, key=lambda p: key(*p)))
+            regions = [(r.loc.x, r.loc.z) for r in self.world.iter_regions(order=order)]
+            self.assertEqual(regions, sorted(regions, key=lambda p: key(32*p[0], 32*p[1])))
+
+    def testDiskOrder(self):
+        coords = [nbt_coords(nbt) for nbt in self.world.iter_nbt(order='disk')]
+        self.assertEqual(sorted(coords), self.nbt_coords)
+        for regionfile in self.world.iter_regions():
+            blockstarts = [regionfile.metadata[x % 32, z % 32].blockstart for x, z in coords \
+                           if (x // 32, z // 32) == (regionfile.loc.x, regionfile.loc.z)]
+            self.assertEqual(len(blockstarts), 13)
+            self.assertEqual(blockstarts, sorted(blockstarts))
+
+    def testUnknownOrder(self):
+        self.assertRaises(ValueError, list, self.world.iter_nbt(order='random'))
+
+
+class RegionCacheTest(unittest.TestCase):
+    """Test the cache of open region files of a world."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.regions = [(0, 0), (-1, 0), (2, 3)]
+        self.world = WorldFolder(generate_world(self.tempdir, self.regions), \
+                                 max_open_regions=1, max_cached_regions=2)
+
+    def tearDown(self):
+        self.world.close()
+        shutil.rmtree(self.tempdir)
+
+    def testEviction(self):
+        first = self.world.get_region(0, 0)
+        second = self.world.get_region(-1, 0)
+        self.assertTrue(first.file.closed)
+        self.assertFalse(second.file.closed)
+        self.assertEqual(list(self.world.regions.keys()), [(0, 0), (-1, 0)])
+        # A closed region file is opened again, with its metadata kept
+        metadata = first.metadata[6, 0]
+        self.assertIs(self.world.get_region(0, 0), first)
+        self.assertFalse(first.file.closed)
+        self.assertIs(first.metadata[6, 0], metadata)
+        self.assertEqual(first.get_nbt(6, 0).loc.x, 6)
+        self.assertTrue(second.file.closed)
+        # Only 2 region files are cached
+        self.world.get_region(2, 3)
+        self.assertEqual(list(self.world.regions.keys()), [(0, 0), (2, 3)])
+        self.assertEqual((self.world.region_hits, self.world.region_misses), (1, 3))
+
+    def testModifiedFile(self):
+        regionfile = self.world.get_region(0, 0)
+        self.world.get_region(-1, 0)
+        self.assertTrue(regionfile.file.closed)
+        other = RegionFile(self.world.regionfiles[0, 0])
+        other.unlink_chunk(6, 0)
+        other.close()
+        # Make sure the modification time differs on coarse file systems
+        st = os.stat(self.world.regionfiles[0, 0])
+        os.utime(self.world.regionfiles[0, 0], (st.st_atime, st.st_mtime + 10))
+        self.assertIs(self.world.get_region(0, 0), regionfile)
+        self.assertFalse(regionfile.metadata[6, 0].is_created())
+
+    def testEvictedReference(self):
+        """A region file can still be used after it was closed by eviction."""
+        world = WorldFolder(self.tempdir, max_open_regions=2)
+        regionfile = world.get_region(0, 0)
+        world.get_region(-1, 0)
+        world.get_region(2, 3)
+        self.assertTrue(regionfile.file.closed)
+        nbt = regionfile.get_nbt(6, 0)
+        self.assertEqual(nbt.loc.x, 6)
+        nbt['marker'] = TAG_Int(1)
+        regionfile.write_chunk(6, 0, nbt)
+        regionfile.close()
+        self.assertIn('marker', regionfile.get_nbt(6, 0))
+        regionfile.close()
+        world.close()
+
+    def testChunkCache(self):
+        self.assertIsNone(self.world.chunk_cache)
+        world = WorldFolder(self.tempdir, chunk_cache_size=1 << 20)
+        nbt = world.get_nbt(6, 0)
+        self.assertIs(world.get_nbt(6, 0), nbt)
+        self.assertEqual((world.chunk_cache.hits, world.chunk_cache.misses), (1, 1))
+        self.assertIsNot(world.get_nbt(-26, 0), nbt)
+        world.close()
+
+    def testChunkCacheIterRegions(self):
+        """Writes to a region file from iter_regions() invalidate the chunk cache."""
+        world = WorldFolder(self.tempdir, max_cached_regions=1, chunk_cache_size=1 << 20)
+        nbt = world.get_nbt(6, 0)
+        world.get_region(-1, 0)
+        self.assertNotIn((0, 0), world.regions)
+        nbt['marker'] = TAG_Int(1)
+        for regionfile in world.iter_regions(BoundingBox(minx=0, maxx=31, minz=0, maxz=31)):
+            regionfile.write_chunk(6, 0, nbt)
+        del nbt['marker']
+        self.assertIn('marker', world.get_nbt(6, 0))
+        world.close()
+
+    def testIterationNotClosed(self):
+        """A region file is not closed while its chunks are iterated over."""
+        expected = sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt())
+        self.world.get_region(0, 0)
+        self.world.get_region(-1, 0)
+        coords = []
+        for nbt in self.world.iter_nbt():
+            # Open the other cached region file
+            self.world.get_nbt(-26, 0) if nbt.loc.x >= 0 else self.world.get_nbt(6, 0)
+            coords.append(nbt_coords(nbt))
+        self.assertEqual(sorted(coords), expected)
+        self.world.get_region(2, 3)
+        self.assertEqual(len(self.world._open_regions), 1)
+
+    def testIterRegions(self):
+        for i in range(2):
+            coords = [(r.loc.x, r.loc.z) for r in self.world.iter_regions()]
+            self.assertEqual(sorted(coords), sorted(self.regions))
+            self.world.get_region(0, 0)
+
+
+class CopyChunksTest(unittest.TestCase):
+    """Test copying the compressed chunks of a world to another world."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        sourcedir = os.path.join(self.tempdir, 'source')
+        self.destdir = os.path.join(self.tempdir, 'dest')
+        os.mkdir(sourcedir)
+        os.mkdir(self.destdir)
+        self.source = WorldFolder(generate_world(sourcedir, [(0, 0), (-1, 0)]))
+        self.nbt_coords = sorted(nbt_coords(nbt) for nbt in self.source.iter_nbt())
+
+    def tearDown(self):
+        self.source.close()
+        shutil.rmtree(self.tempdir)
+
+    def testCopy(self):
+        dest = AnvilWorldFolder(self.destdir)
+        copied = dest.copy_chunks(self.source)
+        dest.close()
+        # 15 of the 21 chunks in regiontest.mca have a readable header
+        self.assertEqual(copied, 2 * 15)
+        dest = WorldFolder(self.destdir)
+        self.assertEqual(sorted(dest.regionfiles.keys()), [(-1, 0), (0, 0)])
+        self.assertEqual(sorted(nbt_coords(nbt) for nbt in dest.iter_nbt()), self.nbt_coords)
+        srcregion = self.source.get_region(0, 0)
+        dstregion = dest.get_region(0, 0)
+        for m in srcregion.get_metadata():
+            copy = dstregion.metadata[m.x, m.z]
+            if copy.is_created():
+                self.assertEqual((copy.timestamp, copy.compression), (m.timestamp, m.compression))
+                self.assertEqual(dstregion._get_rawdata(copy), srcregion._get_rawdata(m))
+        dest.close()
+
+    def testBoundingBox(self):
+        dest = AnvilWorldFolder(self.destdir)
+        box = BoundingBox(minx=0, maxx=31, minz=0, maxz=31)
+        dest.copy_chunks(self.source, boundingbox=box)
+        self.assertEqual(sorted(dest.regionfiles.keys()), [(0, 0)])
+        expected = [c for c in self.nbt_coords if c[0] >= 0]
+        self.assertEqual(sorted(nbt_coords(nbt) for nbt in dest.iter_nbt()), expected)
+        dest.close()
+
+    def testMerge(self):
+        dest = WorldFolder(generate_world(self.destdir, [(0, 0)]))
+        dstregion = dest.get_region(0, 0)
+        dstregion.unlink_chunk(6, 0)
+        dstregion.write_blockdata(7, 0, b'kept')
+        # All chunks of region -1,0, and only chunk 6,0 of region 0,0
+        self.assertEqual(dest.copy_chunks(self.source, overwrite=False), 15 + 1)
+        self.assertEqual(dstregion.get_blockdata(7, 0), b'kept')
+        self.assertEqual(dstregion.get_nbt(6, 0).loc.x, 6)
+        self.assertRaises(ValueError, dest.copy_chunks, McRegionWorldFolder(self.tempdir))
+        dest.close()
+
+
+class ManifestTest(unittest.TestCase):
+    """Test iterating over the chunks that changed since a manifest."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.world = WorldFolder(generate_world(self.tempdir, [(0, 0), (-1, 0)]))
+
+    def tearDown(self):
+        self.world.close()
+        shutil.rmtree(self.tempdir)
+
+    def modify_world(self):
+        """Rewrite chunk 6,0 and add region file 2,3."""
+        regionfile = RegionFile(self.world.regionfiles[0, 0])
+        regionfile.write_chunk(6, 0, regionfile.get_nbt(6, 0))
+        regionfile.close()
+        shutil.copy(REGIONTESTFILE, os.path.join(self.tempdir, 'region', 'r.2.3.mca'))
+        self.world.close()
+        self.world = WorldFolder(self.tempdir)
+
+    def testIterChanged(self):
+        manifest = self.world.get_manifest()
+        self.assertEqual(sorted(manifest.regions.keys()), [(-1, 0), (0, 0)])
+        self.assertEqual(list(self.world.iter_nbt(since=manifest)), [])
+        self.modify_world()
+        changed = sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt(since=manifest))
+        new = sorted(nbt_coords(nbt) for nbt in self.world.iter_nbt(BoundingBox(minx=64, minz=96)))
+        self.assertEqual(len(new), 13)
+        self.assertEqual(changed, sorted([(6, 0)] + new))
+        self.assertEqual(list(self.world.iter_nbt(since=self.world.get_manifest())), [])
+
+    def testSaveLoad(self):
+        filename = os.path.join(self.tempdir, 'manifest.json')
+        manifest = self.world.get_manifest('crc32')
+        manifest.save(filename)
+        loaded = ChunkManifest.load(filename)
+        self.assertEqual(loaded.checksum, 'crc32')
+        self.assertEqual(loaded.regions, manifest.regions)
+        self.modify_world()
+        changed = [nbt_coords(nbt) for nbt in self.world.iter_nbt(since=loaded)]
+        self.assertIn((6, 0), changed)
+        self.assertEqual(len(changed), 14)
+
+
+if __name__ == '__main__':
+    unittest.main()